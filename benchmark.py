@@ -0,0 +1,823 @@
+"""Замеры производительности JellyJump.
+
+Запуск:  python benchmark.py [имя_замера ...]
+Без аргументов выполняются все замеры.
+"""
+import base64
+import gc
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from array import array
+from contextlib import contextmanager
+
+import arcade
+from PIL import Image
+
+from main import (
+    COIN_TEXTURE, EXIT_TEXTURE, PLAYER_FALLBACK_TEXTURE, SCREEN_H, SCREEN_W, TEXTURE_CACHE, TILE_SCALING,
+    CollectiblePool, CompiledLevel, DrawPlan, EnemyArrays, FrameProfiler, GameApp, GameDatabase,
+    GameSimulation, INPUT_JUMP, INPUT_LEFT, INPUT_RIGHT, INPUT_UP, InputLog, LEVEL_REGISTRY, ShapeBatch, TextBatch,
+    TextureCache, TileGridIndex, load_level_sprite_lists, run_input_script, simulate_batch,
+)
+
+
+# ============================================================================
+# ВСПОМОГАТЕЛЬНОЕ
+# ============================================================================
+
+@contextmanager
+def temp_database(**kwargs):
+    """Временная база, удаляется после замера"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = GameDatabase(os.path.join(tmp_dir, "bench.db"), **kwargs)
+        try:
+            yield db
+        finally:
+            db.close()
+
+
+def report(name, operations, seconds):
+    print(f"  {name:<40} {operations / seconds:>12,.0f} оп/с  {seconds / operations * 1000:>10.3f} мс/оп")
+
+
+class UnpooledConnections:
+    """Старое поведение: новое соединение на каждый вызов"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    @contextmanager
+    def connection(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def close(self):
+        pass
+
+
+def legacy_write_progress(db, cursor, user_id, level_id, score, deaths, time_taken):
+    """Старый update_progress: SELECT, UPDATE, COUNT и INSERT/UPDATE"""
+    cursor.execute(
+        'SELECT best_score, stars FROM user_progress WHERE user_id = ? AND level_id = ?',
+        (user_id, level_id)
+    )
+    current = cursor.fetchone()
+    new_score = max(score, current[0] if current else 0)
+    stars = max(db.calculate_stars(score, deaths, time_taken), current[1] if current else 0)
+    cursor.execute(
+        'UPDATE user_progress SET best_score = ?, stars = ? WHERE user_id = ? AND level_id = ?',
+        (new_score, stars, user_id, level_id)
+    )
+    if new_score >= 30 and level_id < 2:
+        cursor.execute(
+            'SELECT COUNT(*) FROM user_progress WHERE user_id = ? AND level_id = ?',
+            (user_id, level_id + 1)
+        )
+        if cursor.fetchone()[0] == 0:
+            cursor.execute(
+                'INSERT INTO user_progress (user_id, level_id, unlocked) VALUES (?, ?, 1)',
+                (user_id, level_id + 1)
+            )
+        else:
+            cursor.execute(
+                'UPDATE user_progress SET unlocked = 1 WHERE user_id = ? AND level_id = ?',
+                (user_id, level_id + 1)
+            )
+    return stars
+
+
+def legacy_restore_collectibles(original_collectibles_data):
+    """Старый restore_collectibles: новый SpriteList и новый спрайт на предмет"""
+    collectibles = arcade.SpriteList(use_spatial_hash=True)
+    for item_data in original_collectibles_data:
+        new_item = arcade.Sprite()
+        new_item.texture = item_data['texture']
+        new_item.scale = item_data['scale']
+        new_item.width = item_data['width']
+        new_item.height = item_data['height']
+        new_item.center_x = item_data['center_x']
+        new_item.center_y = item_data['center_y']
+        collectibles.append(new_item)
+    return collectibles
+
+
+def synthetic_collectibles(count):
+    """count монет на сетке и их исходные данные"""
+    texture = arcade.load_texture(":resources:images/items/coinGold.png")
+    collectibles = arcade.SpriteList(use_spatial_hash=True)
+    original_collectibles_data = []
+    for i in range(count):
+        coin = arcade.Sprite(texture, 0.5, (i % 100) * 40, (i // 100) * 40)
+        collectibles.append(coin)
+        original_collectibles_data.append({
+            'type': 'textured', 'center_x': coin.center_x, 'center_y': coin.center_y,
+            'scale': coin.scale, 'width': coin.width, 'height': coin.height, 'texture': texture
+        })
+    return collectibles, original_collectibles_data
+
+
+def legacy_enemy_contact(player, enemies):
+    """Старый check_damage: проверка расстояния до каждого врага в цикле"""
+    for enemy in enemies:
+        distance_x = abs(player.center_x - enemy.center_x)
+        distance_y = abs(player.center_y - enemy.center_y)
+        if distance_x < (player.width / 2 + enemy.width / 2) and distance_y < (
+                player.height / 2 + enemy.height / 2):
+            return enemy
+    return None
+
+
+def random_input_script(rng, ticks, change_chance=0.05):
+    """Случайное управление [(шаг, маска)]: игрок в основном бежит вправо и прыгает"""
+    masks = [INPUT_RIGHT, INPUT_RIGHT | INPUT_JUMP, INPUT_RIGHT | INPUT_UP, INPUT_LEFT, 0]
+    return [(tick, rng.choice(masks)) for tick in range(ticks) if rng.random() < change_chance]
+
+
+def random_completions(count, users, seed=1):
+    rng = random.Random(seed)
+    return [
+        (rng.randint(1, users), rng.choice([1, 2]), rng.randrange(0, 60, 10),
+         rng.randint(0, 3), rng.uniform(20, 120))
+        for _ in range(count)
+    ]
+
+
+def make_synthetic_level(directory, width, height, seed=1, layers=("osnova", "collision", "collect"), density=0.3):
+    """Карта Tiled width x height с тайлсетом 10x10 тайлов по 18 пикселей, density - доля непустых клеток"""
+    rng = random.Random(seed)
+    image = Image.new("RGBA", (180, 180))
+    for tile_id in range(100):
+        row, col = divmod(tile_id, 10)
+        color = (tile_id * 37 % 256, tile_id * 91 % 256, tile_id * 53 % 256, 255)
+        image.paste(color, (col * 18, row * 18, col * 18 + 18, row * 18 + 18))
+    image.save(os.path.join(directory, "tiles.png"))
+
+    with open(os.path.join(directory, "tiles.tsx"), "w", encoding="utf-8") as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<tileset version="1.10" tiledversion="1.11.2" name="tiles" tilewidth="18" tileheight="18" tilecount="100" columns="10">\n'
+            ' <image source="tiles.png" width="180" height="180"/>\n'
+            '</tileset>\n'
+        )
+
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<map version="1.10" tiledversion="1.11.2" orientation="orthogonal" renderorder="right-down" width="{width}" '
+        f'height="{height}" tilewidth="18" tileheight="18" infinite="0" '
+        f'nextlayerid="{len(layers) + 1}" nextobjectid="1">\n'
+        ' <tileset firstgid="1" source="tiles.tsx"/>\n'
+    ]
+    for layer_id, name in enumerate(layers, 1):
+        gids = array("I", (
+            rng.randint(1, 100) | (0x80000000 if rng.random() < 0.1 else 0) if rng.random() < density else 0
+            for _ in range(width * height)
+        ))
+        data = base64.b64encode(zlib.compress(gids.tobytes())).decode()
+        visible = ' visible="0"' if name == "collision" else ""
+        parts.append(
+            f' <layer id="{layer_id}" name="{name}" width="{width}" height="{height}"{visible}>\n'
+            f'  <data encoding="base64" compression="zlib">{data}</data>\n'
+            ' </layer>\n'
+        )
+    parts.append('</map>\n')
+
+    tmx_path = os.path.join(directory, "level.tmx")
+    with open(tmx_path, "w", encoding="utf-8") as f:
+        f.write("".join(parts))
+    return tmx_path
+
+
+# ============================================================================
+# ЗАМЕРЫ
+# ============================================================================
+
+def bench_pool(threads=8, calls_per_thread=500):
+    """Пул соединений против соединения на каждый вызов (кэши отключены)"""
+    print(f"Пул соединений: {threads} потоков x {calls_per_thread} вызовов")
+
+    def worker(db, user_id):
+        for _ in range(calls_per_thread):
+            db.get_user_progress(user_id)
+            db.get_user_totals(user_id)
+
+    def run(db, user_id):
+        workers = [threading.Thread(target=worker, args=(db, user_id)) for _ in range(threads)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return time.perf_counter() - start
+
+    operations = threads * calls_per_thread * 2
+    with temp_database(pool_size=threads, cache_size=0) as db:
+        _, user_id, _ = db.create_user("bench", "password")
+
+        pooled = db.pool
+        db.pool = UnpooledConnections(db.db_path)
+        report("без пула (connect на вызов)", operations, run(db, user_id))
+
+        db.pool = pooled
+        report("пул соединений (WAL)", operations, run(db, user_id))
+
+
+def bench_upsert(completions=100_000, users=1000, batch=1000):
+    """UPSERT в update_progress против прежних пяти запросов"""
+    print(f"Сохранение прогресса: {completions:,} прохождений, {users} игроков")
+    records = random_completions(completions, users)
+
+    def run(write):
+        with temp_database() as db:
+            seed_users(db, users)
+            start = time.perf_counter()
+            with db.pool.connection() as conn:
+                cursor = conn.cursor()
+                for i, record in enumerate(records, 1):
+                    write(db, cursor, *record)
+                    if i % batch == 0:
+                        conn.commit()
+                conn.commit()
+            return time.perf_counter() - start
+
+    report("SELECT + UPDATE + COUNT + INSERT/UPDATE", completions, run(legacy_write_progress))
+    report("INSERT ... ON CONFLICT DO UPDATE", completions,
+           run(lambda db, cursor, *record: db._write_progress(cursor, *record)))
+
+
+def fill_synthetic_progress(db_path, users, levels, seed=1):
+    """Синтетическая база: users игроков x levels уровней строк прогресса"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        'INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)',
+        ((user_id, f"user{user_id}", "-") for user_id in range(1, users + 1))
+    )
+    conn.executemany(
+        'INSERT INTO user_progress (user_id, level_id, unlocked, best_score, stars) VALUES (?, ?, 1, ?, ?)',
+        ((user_id, level_id, rng.randrange(0, 1000), rng.randint(0, 5))
+         for user_id in range(1, users + 1) for level_id in range(1, levels + 1))
+    )
+    conn.commit()
+    conn.close()
+
+
+def seed_users(db, users):
+    """users игроков с открытым первым уровнем, как после create_user, но без хэширования пароля"""
+    level_ids = LEVEL_REGISTRY.level_ids()
+    with db.pool.connection() as conn:
+        conn.executemany(
+            'INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)',
+            ((user_id, f"user{user_id}", "-") for user_id in range(1, users + 1))
+        )
+        conn.executemany(
+            'INSERT INTO user_progress (user_id, level_id, unlocked) VALUES (?, ?, ?)',
+            ((user_id, level_id, int(level_id == level_ids[0]))
+             for user_id in range(1, users + 1) for level_id in level_ids)
+        )
+        conn.commit()
+
+
+def timed(repeat, func):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return time.perf_counter() - start
+
+
+def bench_leaderboard(users=100_000, levels=10, repeat=50):
+    """Таблицы рекордов и статистика на базе из users x levels строк"""
+    print(f"Таблицы рекордов: {users * levels:,} строк user_progress")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "bench.db")
+        GameDatabase(db_path).close()
+        fill_synthetic_progress(db_path, users, levels)
+
+        db = GameDatabase(db_path)
+        report("топ-10 уровня", repeat, timed(repeat, lambda: db.get_leaderboard(1, 10)))
+
+        def keyset_pages(pages=1000):
+            cursor = None
+            for _ in range(pages):
+                _, cursor = db.get_leaderboard(1, 10, cursor)
+
+        def offset_pages(pages=1000):
+            with db.pool.connection() as conn:
+                for page in range(pages):
+                    conn.execute(
+                        'SELECT p.user_id, u.username, p.best_score, p.stars '
+                        'FROM user_progress AS p JOIN users AS u ON u.id = p.user_id '
+                        'WHERE p.level_id = 1 ORDER BY p.best_score DESC, p.user_id DESC '
+                        'LIMIT 10 OFFSET ?', (page * 10,)
+                    ).fetchall()
+
+        report("1000 страниц по ключу (keyset)", 1000, timed(1, keyset_pages))
+        report("1000 страниц через OFFSET", 1000, timed(1, offset_pages))
+        report("распределение звезд (GROUP BY)", repeat, timed(repeat, lambda: db.get_star_distribution(1)))
+        report("итоги игрока (GROUP BY)", repeat, timed(repeat, lambda: db.get_user_totals(users // 2)))
+        report("топ-10 игроков (GROUP BY)", 1, timed(1, lambda: db.get_top_players(10)))
+        db.close()
+
+        start = time.perf_counter()
+        db = GameDatabase(db_path, materialize_stats=True)
+        print(f"  построение агрегатов: {time.perf_counter() - start:.2f} с")
+        report("распределение звезд (агрегат)", repeat, timed(repeat, lambda: db.get_star_distribution(1)))
+        report("итоги игрока (агрегат)", repeat, timed(repeat, lambda: db.get_user_totals(users // 2)))
+        report("топ-10 игроков (агрегат)", repeat, timed(repeat, lambda: db.get_top_players(10)))
+        report("update_progress с триггерами", repeat,
+               timed(repeat, lambda: db.update_progress(users // 2, 1, 999, 0, 10)))
+        db.close()
+
+
+def bench_level_load(width=200, height=100, repeat=5):
+    """Загрузка уровня: arcade.load_tilemap против скомпилированного кэша"""
+    print(f"Загрузка уровня {width}x{height} тайлов, 3 слоя")
+    layer_options = {name: {"use_spatial_hash": True} for name in ("collision", "collect")}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmx_path = make_synthetic_level(tmp_dir, width, height)
+
+        def tilemap():
+            tile_map = arcade.load_tilemap(tmx_path, scaling=TILE_SCALING, layer_options=layer_options, lazy=True)
+            arcade.Scene.from_tilemap(tile_map)
+
+        cache_dir = os.path.join(tmp_dir, "cache")
+
+        def compiled():
+            load_level_sprite_lists(tmx_path, TILE_SCALING, layer_options, lazy=True, cache_dir=cache_dir)
+
+        start = time.perf_counter()
+        CompiledLevel.load(tmx_path, cache_dir).close()
+        print(f"  компиляция кэша: {time.perf_counter() - start:.3f} с")
+
+        report("arcade.load_tilemap + Scene", repeat, timed(repeat, tilemap))
+        report("скомпилированный кэш (mmap)", repeat, timed(repeat, compiled))
+
+
+def bench_textures(width=200, height=100, repeat=5, entries=20):
+    """Повторный вход в уровень: новый arcade.TextureCacheManager против общего TextureCache"""
+    print(f"Текстуры уровня {width}x{height} тайлов при повторном входе")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmx_path = make_synthetic_level(tmp_dir, width, height)
+        level = CompiledLevel.load(tmx_path, os.path.join(tmp_dir, "cache"))
+        cache = TextureCache()
+        level.build_sprite_lists(TILE_SCALING, texture_manager=cache, lazy=True)
+
+        report("новый TextureCacheManager", repeat, timed(repeat, lambda: level.build_sprite_lists(
+            TILE_SCALING, texture_manager=arcade.TextureCacheManager(), lazy=True)))
+        report("общий TextureCache", repeat, timed(repeat, lambda: level.build_sprite_lists(
+            TILE_SCALING, texture_manager=cache, lazy=True)))
+        level.close()
+    print(f"  TextureCache: {cache.stats()}")
+
+    # Спрайты тестового уровня: раньше каждый раскодировал свою картинку
+    paths = [COIN_TEXTURE] * 5 + [EXIT_TEXTURE, PLAYER_FALLBACK_TEXTURE]
+    report("arcade.Sprite(путь), 7 спрайтов", entries, timed(entries, lambda: [arcade.Sprite(path) for path in paths]))
+    report("arcade.Sprite(TEXTURE_CACHE), 7 спрайтов", entries, timed(entries, lambda: [
+        arcade.Sprite(TEXTURE_CACHE.load_or_get_texture(path)) for path in paths]))
+
+    # Тестовый уровень: монетки, замок и игрок берутся из TEXTURE_CACHE
+    before = TEXTURE_CACHE.stats()
+    start = time.perf_counter()
+    for _ in range(entries):
+        GameSimulation(1).close()
+    seconds = time.perf_counter() - start
+    after = TEXTURE_CACHE.stats()
+    print(f"  {entries} входов в уровень 1: {seconds / entries * 1000:.1f} мс на вход, "
+          f"раскодировано картинок: {after['decodes'] - before['decodes']}, "
+          f"попаданий: {after['hits'] - before['hits']}, промахов: {after['misses'] - before['misses']}")
+
+
+def bench_grid(width=1000, height=1000, queries=20_000, density=0.02):
+    """Что под игроком: пространственный хэш списков против сетки клеток"""
+    layers = ("ladder", "batut", "damage", "exit")
+    print(f"Проверки слоев {', '.join(layers)}: карта {width}x{height}, {queries:,} положений игрока")
+    layer_options = {name: {"use_spatial_hash": True} for name in layers}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmx_path = make_synthetic_level(tmp_dir, width, height, layers=layers, density=density)
+        level = CompiledLevel.load(tmx_path, os.path.join(tmp_dir, "cache"))
+        sprite_lists = level.build_sprite_lists(TILE_SCALING, layer_options)
+
+        start = time.perf_counter()
+        grid = TileGridIndex.from_compiled(level, sprite_lists, TILE_SCALING)
+        print(f"  построение сетки: {time.perf_counter() - start:.2f} с, "
+              f"{sum(len(sprite_lists[name]) for name in layers):,} спрайтов")
+        level.close()
+
+    player = arcade.SpriteSolidColor(30, 40, arcade.color.RED)
+    rng = random.Random(1)
+    positions = [(rng.uniform(0, width * grid.cell_w), rng.uniform(0, height * grid.cell_h))
+                 for _ in range(queries)]
+
+    def spatial_hash():
+        for position in positions:
+            player.position = position
+            for name in layers:
+                arcade.check_for_collision_with_list(player, sprite_lists[name])
+
+    def tile_grid():
+        for position in positions:
+            player.position = position
+            layers_under = grid.flags_under(player)
+            for flag in (TileGridIndex.LADDER, TileGridIndex.BATUT, TileGridIndex.DAMAGE, TileGridIndex.EXIT):
+                if layers_under & flag:
+                    grid.hits(player, flag)
+
+    report("check_for_collision_with_list x4", queries, timed(1, spatial_hash))
+    report("TileGridIndex", queries, timed(1, tile_grid))
+
+
+def bench_enemies(enemies=500, level_width=40_000, frames=2000):
+    """Касание врагов: цикл по спрайтам против EnemyArrays"""
+    print(f"Касание врагов: {enemies} врагов на {level_width} пикселях, {frames} кадров")
+    rng = random.Random(1)
+    enemy_list = arcade.SpriteList()
+    for _ in range(enemies):
+        enemy = arcade.SpriteSolidColor(32, 32, arcade.color.DARK_RED)
+        enemy.position = rng.uniform(0, level_width), rng.uniform(0, SCREEN_H)
+        enemy_list.append(enemy)
+
+    player = arcade.SpriteSolidColor(30, 40, arcade.color.RED)
+    positions = [(rng.uniform(0, level_width), rng.uniform(0, SCREEN_H)) for _ in range(frames)]
+    arrays = EnemyArrays(enemy_list)
+
+    def run(check):
+        def frames_loop():
+            for position in positions:
+                player.position = position
+                check()
+        return frames_loop
+
+    report("цикл по врагам", frames, timed(1, run(lambda: legacy_enemy_contact(player, enemy_list))))
+    report("EnemyArrays, все враги", frames, timed(1, run(lambda: arrays.first_overlap(player))))
+    report("EnemyArrays, полоса экрана", frames, timed(1, run(lambda: arrays.first_overlap(
+        player, player.center_x - SCREEN_W, player.center_x + SCREEN_W))))
+
+
+def bench_respawn(items=5000, repeat=20):
+    """Возврат предметов после смерти: пересоздание спрайтов против пула"""
+    print(f"Возврат предметов: {items} предметов")
+    collectibles, original_collectibles_data = synthetic_collectibles(items)
+    report("новый SpriteList и спрайты", repeat,
+           timed(repeat, lambda: legacy_restore_collectibles(original_collectibles_data)))
+
+    pool = CollectiblePool(collectibles)
+    seconds = 0.0
+    for _ in range(repeat):
+        # Все предметы собраны (как после сбора в игре), замеряем только сброс
+        for sprite in pool.sprites:
+            sprite.visible = False
+        pool.active[:] = bytes(len(pool))
+        pool.active_count = 0
+        start = time.perf_counter()
+        pool.reset()
+        seconds += time.perf_counter() - start
+    report("сброс флагов пула", repeat, seconds)
+
+
+def measure_allocated(func):
+    """Байт памяти, которые занимает результат func (по tracemalloc)"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = func()
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, allocated
+
+
+def bench_snapshot(items=10_000, repeat=20):
+    """Данные для возврата предметов: список словарей против флагов пула"""
+    print(f"Снимок предметов: {items} предметов")
+    collectibles, _ = synthetic_collectibles(items)
+    sprites = list(collectibles)
+
+    def dicts():
+        return [{
+            'type': 'textured', 'center_x': item.center_x, 'center_y': item.center_y,
+            'scale': item.scale, 'width': item.width, 'height': item.height, 'texture': item.texture
+        } for item in sprites]
+
+    original_collectibles_data, dicts_bytes = measure_allocated(dicts)
+    pool, _ = measure_allocated(lambda: CollectiblePool(collectibles))
+    print(f"  список словарей: {dicts_bytes / 1024:,.0f} КБ, флаги пула: {len(pool.active) / 1024:,.0f} КБ")
+
+    def collect_all():
+        for sprite in sprites:
+            sprite.visible = False
+        pool.active[:] = bytes(len(pool))
+        pool.active_count = 0
+
+    def restore_from_dicts():
+        for sprite, item_data in zip(sprites, original_collectibles_data):
+            sprite.position = item_data['center_x'], item_data['center_y']
+            sprite.visible = True
+
+    def timed_after_collect(func):
+        seconds = 0.0
+        for _ in range(repeat):
+            collect_all()
+            start = time.perf_counter()
+            func()
+            seconds += time.perf_counter() - start
+        return seconds
+
+    report("места из словарей", repeat, timed_after_collect(restore_from_dicts))
+    report("только видимость (пул)", repeat, timed_after_collect(pool.reset))
+
+
+def bench_simulation(ticks=20_000):
+    """Шаги GameSimulation без окна (тестовый уровень, игрок бежит и прыгает)"""
+    print(f"Симуляция без окна: {ticks:,} шагов")
+    simulation = GameSimulation(1)
+    step = simulation.timestep.step
+
+    def run(name, profiler):
+        simulation.reset()
+        simulation.right = True
+        simulation.profiler = profiler
+        start = time.perf_counter()
+        for tick in range(ticks):
+            simulation.jump_pressed = tick % 90 < 10
+            simulation.physics_step(step)
+            if profiler is not None:
+                profiler.end_frame()
+        report(name, ticks, time.perf_counter() - start)
+
+    run("шаг физики", None)
+    profiler = FrameProfiler()
+    run("шаг физики с FrameProfiler", profiler)
+    for name, stats in profiler.summary().items():
+        print(f"    {name:<8} p50 {stats['p50']:.3f}  p95 {stats['p95']:.3f}  p99 {stats['p99']:.3f} мс")
+    simulation.close()
+
+
+def bench_batch(runs=100, ticks=1200, workers=None):
+    """Пакетный прогон записей управления в нескольких процессах"""
+    workers = workers or os.cpu_count() or 1
+    print(f"Пакетная симуляция: {runs} записей по {ticks} шагов, {workers} процессов")
+    rng = random.Random(1)
+    scripts = [random_input_script(rng, ticks) for _ in range(runs)]
+    _, summary = simulate_batch(1, scripts, max_ticks=ticks, workers=workers)
+
+    print(f"  пройдено: {summary['completed']} из {summary['runs']}, звезды: {summary['stars']}")
+    for name in ("score", "deaths", "time"):
+        values = ", ".join(f"{key} {value:.1f}" for key, value in summary[name].items())
+        print(f"  {name}: {values}")
+    print(f"  {summary['ticks']:,} шагов за {summary['seconds']:.2f} с, "
+          f"{summary['ticks_per_second_per_core']:,.0f} шагов/с на ядро")
+
+
+def bench_replay(runs=20, ticks=3600):
+    """Размер записи управления и проверка результата повтором"""
+    print(f"Запись управления: {runs} прохождений по {ticks} шагов")
+    rng = random.Random(1)
+    simulation = GameSimulation(1)
+    logs = []
+    for _ in range(runs):
+        simulation.reset()
+        run_input_script(simulation, random_input_script(rng, ticks), ticks)
+        logs.append(InputLog.from_simulation(simulation))
+
+    blobs = [log.to_bytes() for log in logs]
+    recorded = sum(log.ticks for log in logs)
+    size = sum(len(blob) for blob in blobs)
+    print(f"  {sum(len(log.events) for log in logs)} событий, {size:,} байт "
+          f"(маска на каждый шаг: {recorded:,} байт, {recorded / size:.0f}x больше)")
+    report("разбор записи", runs * runs, timed(runs, lambda: [InputLog.from_bytes(blob) for blob in blobs]))
+
+    with temp_database() as db:
+        _, user_id, _ = db.create_user("bench", "secret")
+        for log, blob in zip(logs, blobs):
+            result = log.replay(simulation)
+            db.update_progress(user_id, 1, result["score"], result["deaths"], result["time"], blob)
+        start = time.perf_counter()
+        ok, result, message = db.verify_replay(user_id, 1)
+        seconds = time.perf_counter() - start
+    print(f"  проверка лучшего результата: {message}, {result['ticks']:,} шагов за {seconds:.3f} с "
+          f"({result['ticks'] / seconds:,.0f} шагов/с, x{result['ticks'] / seconds / simulation.timestep.tick_rate:.0f} "
+          f"быстрее реального времени)")
+    simulation.close()
+
+
+def bench_hud(frames=300):
+    """Кадр интерфейса: arcade.draw_text против постоянных надписей"""
+    print(f"Интерфейс: {frames} кадров, 6 надписей")
+    window = arcade.Window(SCREEN_W, SCREEN_H, "bench", visible=False)
+    lines = [(10, SCREEN_H - 30 - i * 20) for i in range(6)]
+
+    def draw_text_frame(frame):
+        window.clear()
+        for i, (x, y) in enumerate(lines):
+            arcade.draw_text(f"Строка {i}: {frame // 30}", x, y, arcade.color.WHITE, 16)
+        window.ctx.finish()
+
+    hud = TextBatch()
+    for i, (x, y) in enumerate(lines):
+        hud.add(i, "", x, y, arcade.color.WHITE, 16)
+
+    def batch_frame(frame):
+        window.clear()
+        for i in range(len(lines)):
+            hud.set(i, f"Строка {i}: {frame // 30}")
+        hud.draw()
+        window.ctx.finish()
+
+    for name, draw in (("arcade.draw_text", draw_text_frame), ("TextBatch", batch_frame)):
+        start = time.perf_counter()
+        for frame in range(frames):
+            draw(frame)
+        report(name, frames, time.perf_counter() - start)
+    window.close()
+
+
+def bench_menu(cards=48, frames=300):
+    """Карточки меню: отдельные draw_* на кадр против ShapeBatch"""
+    print(f"Меню: {cards} карточек, {frames} кадров")
+    window = arcade.Window(SCREEN_W, SCREEN_H, "bench", visible=False)
+    centers = [(100 + (i % 8) * 100, 80 + (i // 8) * 110) for i in range(cards)]
+
+    def card_shapes(rect_filled, rect_outline, circle_filled, circle_outline):
+        for x, y in centers:
+            rect_filled(x - 45, x + 45, y - 50, y + 50, arcade.color.LIGHT_GRAY)
+            rect_outline(x - 45, x + 45, y - 50, y + 50, arcade.color.BLACK, 2)
+            for i in range(5):
+                if i < 3:
+                    circle_filled(x - 40 + i * 20, y - 30, 8, arcade.color.GOLD)
+                else:
+                    circle_outline(x - 40 + i * 20, y - 30, 8, arcade.color.GRAY, 1)
+
+    def immediate_frame():
+        window.clear()
+        card_shapes(arcade.draw_lrbt_rectangle_filled, arcade.draw_lrbt_rectangle_outline,
+                    arcade.draw_circle_filled, arcade.draw_circle_outline)
+        window.ctx.finish()
+
+    shapes = ShapeBatch(lambda batch: card_shapes(
+        batch.rect_filled, batch.rect_outline, batch.circle_filled, batch.circle_outline))
+
+    def batch_frame():
+        window.clear()
+        shapes.draw(None)
+        window.ctx.finish()
+
+    report("draw_* на каждую фигуру", frames, timed(frames, immediate_frame))
+    report("ShapeBatch (без пересборки)", frames, timed(frames, batch_frame))
+    report("ShapeBatch (пересборка)", frames // 10, timed(frames // 10, lambda: (shapes.invalidate(), batch_frame())))
+    window.close()
+
+
+def bench_baking(sizes=((60, 30), (200, 100), (400, 200)), frames=100):
+    """Кадр уровня: все спрайты декоративных слоев против заранее нарисованных кусков"""
+    layers = ("osnova", "naosnove", "naosnove2")
+    print(f"Неизменные слои: {', '.join(layers)}, {frames} кадров, экран {SCREEN_W}x{SCREEN_H}")
+    window = arcade.Window(SCREEN_W, SCREEN_H, "bench", visible=False)
+    view = (0, 0, SCREEN_W, SCREEN_H)
+    for width, height in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmx_path = make_synthetic_level(tmp_dir, width, height, layers=layers, density=0.6)
+            sprite_lists = list(load_level_sprite_lists(tmx_path, TILE_SCALING, {}, cache_dir=tmp_dir).values())
+        sprites = sum(len(sprite_list) for sprite_list in sprite_lists)
+        print(f"  карта {width}x{height}, спрайтов: {sprites}")
+
+        for name, plan in (("спрайты каждый кадр", DrawPlan(sprite_lists)),
+                           ("заранее нарисованные куски", DrawPlan(sprite_lists, static=sprite_lists))):
+            def frame():
+                window.clear()
+                plan.draw(view)
+                window.ctx.finish()
+
+            frame()  # Первый кадр рисует куски
+            report(f"{name} ({plan.draw_calls} вызовов)", frames, timed(frames, frame))
+            plan.release()
+            window.flip()
+    window.close()
+
+
+def bench_camera(sizes=((26, 15), (200, 100), (2000, 200)), frames=600, speed=8):
+    """Прокрутка камеры по картам разного размера: все слои целиком против кусков у экрана"""
+    layers = ("osnova", "collision", "collect", "naosnove2")
+    print(f"Камера: {frames} кадров, прокрутка {speed} пикс./кадр, экран {SCREEN_W}x{SCREEN_H}")
+    window = arcade.Window(SCREEN_W, SCREEN_H, "bench", visible=False)
+    camera = arcade.camera.Camera2D()
+    for width, height in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmx_path = make_synthetic_level(tmp_dir, width, height, layers=layers, density=0.3)
+            sprite_lists = load_level_sprite_lists(tmx_path, TILE_SCALING, {}, lazy=True, cache_dir=tmp_dir)
+        sprites = sum(len(sprite_list) for sprite_list in sprite_lists.values())
+        level_w, level_h = width * 18 * TILE_SCALING, height * 18 * TILE_SCALING
+        print(f"  карта {width}x{height}, спрайтов: {sprites}")
+
+        static = [sprite_lists["osnova"], sprite_lists["naosnove2"]]
+        culled = [sprite_lists["collision"], sprite_lists["collect"]]
+        for name, plan in (("все слои целиком", DrawPlan(sprite_lists.values())),
+                           ("куски у экрана", DrawPlan(sprite_lists.values(), static=static, culled=culled))):
+            times = []
+            for frame in range(frames + 1):
+                # Камера идет вправо со скоростью игрока и обратно, если карта кончилась
+                x = SCREEN_W / 2 + frame * speed % (2 * max(1, level_w - SCREEN_W))
+                x = min(x, 2 * level_w - SCREEN_W - x) if level_w > SCREEN_W else SCREEN_W / 2
+                y = max(SCREEN_H / 2, min(level_h - SCREEN_H / 2, level_h / 2))
+                camera.position = (round(x), round(y))
+                start = time.perf_counter()
+                window.clear()
+                with camera.activate():
+                    plan.draw((x - SCREEN_W / 2, y - SCREEN_H / 2, x + SCREEN_W / 2, y + SCREEN_H / 2))
+                window.ctx.finish()
+                if frame:  # Первый кадр - загрузка спрайтов в видеопамять
+                    times.append(time.perf_counter() - start)
+                window.flip()
+            plan.release()
+            times.sort()
+            print(f"  {name:<40} p50 {times[len(times) // 2] * 1000:>8.2f} мс, p99 "
+                  f"{times[len(times) * 99 // 100] * 1000:>8.2f} мс, вызовов: {plan.draw_calls}")
+    window.close()
+
+
+def bench_views(cycles=1000, windows=10):
+    """Переходы меню <-> уровень в одном окне и память за много кругов"""
+    print(f"Экраны: {cycles} кругов меню -> уровень -> меню в одном окне")
+    with temp_database() as db:
+        _, user_id, _ = db.create_user("bench", "secret")
+        app = GameApp(db, visible=False)
+        app.show_menu(user_id)
+        app.current_view.on_draw()
+        app.flip()
+
+        to_level, to_menu = [], []
+        memory = []
+        tracemalloc.start()
+        for cycle in range(cycles):
+            start = time.perf_counter()
+            app.show_level(1)
+            to_level.append(time.perf_counter() - start)
+            app.current_view.on_update(1 / 60)
+            app.current_view.on_draw()
+            app.flip()  # Как в цикле событий: flip() освобождает удаленные объекты OpenGL
+
+            start = time.perf_counter()
+            app.show_menu()
+            to_menu.append(time.perf_counter() - start)
+            app.current_view.on_draw()
+            app.flip()
+
+            if cycle % (cycles // 10 or 1) == 0 or cycle == cycles - 1:
+                gc.collect()
+                memory.append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+        app.close()
+
+    for name, times in (("меню -> уровень (с загрузкой уровня)", to_level), ("уровень -> меню", to_menu)):
+        times.sort()
+        print(f"  {name}: p50 {times[len(times) // 2] * 1000:.2f} мс, p99 {times[len(times) * 99 // 100] * 1000:.2f} мс")
+    print(f"  память Python по ходу: {', '.join(f'{m / 1024 / 1024:.1f}' for m in memory)} МБ")
+
+    # Прежний способ: каждый переход закрывает окно и создает новое со своим контекстом
+    def new_window():
+        window = arcade.Window(SCREEN_W, SCREEN_H, "bench", visible=False)
+        window.clear()
+        window.close()
+
+    report("новое окно на каждый переход", windows, timed(windows, new_window))
+
+
+BENCHMARKS = {
+    "pool": bench_pool,
+    "upsert": bench_upsert,
+    "leaderboard": bench_leaderboard,
+    "level_load": bench_level_load,
+    "textures": bench_textures,
+    "grid": bench_grid,
+    "enemies": bench_enemies,
+    "respawn": bench_respawn,
+    "snapshot": bench_snapshot,
+    "simulation": bench_simulation,
+    "batch": bench_batch,
+    "replay": bench_replay,
+    "hud": bench_hud,
+    "menu": bench_menu,
+    "baking": bench_baking,
+    "camera": bench_camera,
+    "views": bench_views,
+}
+
+
+def main():
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Неизвестный замер: {name}. Доступны: {', '.join(BENCHMARKS)}")
+            continue
+        BENCHMARKS[name]()
+        print()
+
+
+if __name__ == "__main__":
+    main()
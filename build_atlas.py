@@ -0,0 +1,268 @@
+"""Сборка общего атласа тайлов для набора уровней JellyJump.
+
+Запуск:  python build_atlas.py [папка_вывода] [уровень.tmx ...]
+Без уровней берутся все карты из папки уровней, вывод по умолчанию - atlas/.
+
+Одинаковые тайлы из всех тайлсетов всех карт (например, одна и та же
+картинка из "Текстуры/Tiled" и "Новая папка/Tiled") попадают в атлас один
+раз. Свойства, формы столкновений и анимации тайлов (элементы <tile>)
+переносятся в atlas.tsx; тайлы с одинаковыми пикселями, но разными
+свойствами остаются разными. В папку вывода пишутся atlas.png, atlas.tsx и
+копии карт, GID которых пересчитаны на атлас. Игра загрузит их, если указать эту папку в
+JELLYJUMP_LEVELS.
+"""
+import base64
+import copy
+import hashlib
+import math
+import os
+import sys
+import zlib
+from array import array
+from xml.etree import ElementTree
+
+from PIL import Image
+
+from main import GID_MASK, LEVEL_REGISTRY, LevelCompileError, _decode_layer_data, _read_tileset
+
+
+class TileAtlas:
+    """Уникальные тайлы набора карт: хэш пикселей и свойств -> номер в атласе"""
+
+    def __init__(self):
+        self.tile_size = None
+        self.tiles = []  # Картинки тайлов в порядке номеров
+        self.nodes = []  # Элементы <tile> для atlas.tsx (или None) в порядке номеров
+        self._index = {}  # хэш пикселей и <tile> -> номер тайла
+        self._images = {}  # путь -> картинка тайлсета в RGBA
+
+    def image(self, path):
+        image = self._images.get(path)
+        if image is None:
+            image = Image.open(path)
+            if image.mode != "RGBA":
+                image = image.convert("RGBA")
+            self._images[path] = image
+        return image
+
+    def add(self, tile, node=None):
+        """Номер тайла (path, x, y, w, h) в атласе.
+
+        node - элемент <tile> без id из _atlas_tile_node. Одинаковые пиксели
+        с одинаковым node получают один номер.
+        """
+        path, x, y, w, h = tile
+        if self.tile_size is None:
+            self.tile_size = (w, h)
+        elif self.tile_size != (w, h):
+            raise LevelCompileError(f"Тайлы разного размера: {self.tile_size} и {(w, h)} ({path})")
+
+        pixels = self.image(path).crop((x, y, x + w, y + h))
+        key = hashlib.sha1(pixels.tobytes())
+        if node is not None:
+            key.update(ElementTree.tostring(node))
+        key = key.digest()
+        index = self._index.get(key)
+        if index is None:
+            index = self._index[key] = len(self.tiles)
+            self.tiles.append(pixels)
+            self.nodes.append(node)
+        return index
+
+    def columns(self):
+        return max(1, math.ceil(math.sqrt(len(self.tiles))))
+
+    def save(self, out_dir, name):
+        """Записать картинку атласа и тайлсет TSX, вернуть путь к картинке"""
+        w, h = self.tile_size or (1, 1)
+        columns = self.columns()
+        rows = max(1, math.ceil(len(self.tiles) / columns))
+        sheet = Image.new("RGBA", (columns * w, rows * h))
+        for index, tile in enumerate(self.tiles):
+            row, col = divmod(index, columns)
+            sheet.paste(tile, (col * w, row * h))
+
+        image_path = os.path.join(out_dir, f"{name}.png")
+        sheet.save(image_path, optimize=True)
+
+        tileset = ElementTree.Element("tileset", {
+            "version": "1.10", "tiledversion": "1.11.2", "name": name, "tilewidth": str(w), "tileheight": str(h),
+            "tilecount": str(len(self.tiles)), "columns": str(columns),
+        })
+        ElementTree.SubElement(tileset, "image", {
+            "source": f"{name}.png", "width": str(sheet.width), "height": str(sheet.height),
+        })
+        for index, node in enumerate(self.nodes):
+            if node is not None:
+                tile = ElementTree.SubElement(tileset, "tile", {"id": str(index), **node.attrib})
+                tile.extend(node)
+        ElementTree.indent(tileset)
+        ElementTree.ElementTree(tileset).write(os.path.join(out_dir, f"{name}.tsx"),
+                                               encoding="UTF-8", xml_declaration=True)
+        return image_path
+
+
+def _rgba_bytes(image):
+    return image.width * image.height * 4
+
+
+def _find_tileset(tilesets, gid):
+    """(тайлы, элементы <tile>, локальный id) тайлсета карты, к которому относится GID"""
+    for firstgid, tiles, tile_nodes in tilesets:
+        if gid >= firstgid:
+            return tiles, tile_nodes, gid - firstgid
+    return {}, {}, None
+
+
+def _atlas_tile_node(node, atlas, tiles):
+    """Копия <tile> для атласа без id и картинки; None, если в ней нечего переносить.
+
+    Кадры анимации ссылаются на тайлы того же тайлсета - они добавляются в
+    атлас как обычные картинки, и tileid кадров пересчитывается на атлас.
+    Пробелы между тегами убираются, чтобы ключ не зависел от оформления.
+    """
+    if node is None:
+        return None
+    result = ElementTree.Element("tile", {key: value for key, value in node.attrib.items() if key != "id"})
+    for child in node:
+        if child.tag == "image":
+            continue  # Картинка тайла уже в атласе
+        child = copy.deepcopy(child)
+        if child.tag == "animation":
+            for frame in child.iter("frame"):
+                frame_tile = tiles.get(int(frame.get("tileid")))
+                if frame_tile is None:
+                    raise LevelCompileError(f"Кадр анимации ссылается на несуществующий тайл {frame.get('tileid')}")
+                frame.set("tileid", str(atlas.add(frame_tile)))
+        result.append(child)
+    if not len(result) and not result.attrib:
+        return None
+    for element in result.iter():
+        element.tail = None
+        if element.text is not None and not element.text.strip():
+            element.text = None
+    return result
+
+
+def build_atlas(tmx_paths, out_dir, name="atlas"):
+    """Собрать атлас для карт tmx_paths и переписать карты в out_dir; вернуть отчет"""
+    os.makedirs(out_dir, exist_ok=True)
+    atlas = TileAtlas()
+    maps = []
+    level_bytes = 0  # Картинки тайлсетов, которые загружает каждый уровень, в RGBA
+    level_images_max = 0
+    source_files = set()
+    placements = 0  # Клетки слоев и объекты-тайлы
+    map_tiles = 0  # Разные тайлы в каждой карте, сумма по картам
+
+    for tmx_path in tmx_paths:
+        tree = ElementTree.parse(tmx_path)
+        root = tree.getroot()
+        base_dir = os.path.dirname(os.path.abspath(tmx_path))
+        width, height = int(root.get("width")), int(root.get("height"))
+
+        tilesets = []
+        for node in root.findall("tileset"):
+            tile_nodes = {}
+            tilesets.append((int(node.get("firstgid")), _read_tileset(node, base_dir, [], tile_nodes), tile_nodes))
+        tilesets.sort(key=lambda item: item[0], reverse=True)
+
+        # GID слоев и объектов-тайлов; новые GID сохраняют флаги отражения
+        layers = [(node, _decode_layer_data(node.find("data"), width * height)) for node in root.iter("layer")]
+        objects = [node for node in root.iter("object") if node.get("gid")]
+        used = {raw_gid & GID_MASK for _, gids in layers for raw_gid in gids}
+        used.update(int(node.get("gid")) & GID_MASK for node in objects)
+        used.discard(0)
+        placements += sum(1 for _, gids in layers for raw_gid in gids if raw_gid & GID_MASK) + len(objects)
+        map_tiles += len(used)
+
+        remap = {}
+        level_images = set()
+        for gid in sorted(used):
+            tiles, tile_nodes, local_id = _find_tileset(tilesets, gid)
+            tile = tiles.get(local_id)
+            if tile is None:
+                raise LevelCompileError(f"Не найден тайл для GID {gid} в {tmx_path}")
+            node = _atlas_tile_node(tile_nodes.get(local_id), atlas, tiles)
+            remap[gid] = atlas.add(tile, node) + 1
+            level_images.add(tile[0])
+
+        level_bytes += sum(_rgba_bytes(atlas.image(path)) for path in level_images)
+        level_images_max = max(level_images_max, len(level_images))
+        source_files.update(level_images)
+        maps.append((tmx_path, tree, layers, objects, remap))
+
+    image_path = atlas.save(out_dir, name)
+
+    for tmx_path, tree, layers, objects, remap in maps:
+        root = tree.getroot()
+        old_tilesets = root.findall("tileset")
+        position = list(root).index(old_tilesets[0]) if old_tilesets else 0
+        for node in old_tilesets:
+            root.remove(node)
+        tileset = ElementTree.Element("tileset", {"firstgid": "1", "source": f"{name}.tsx"})
+        tileset.tail = old_tilesets[-1].tail if old_tilesets else None
+        root.insert(position, tileset)
+
+        for node, gids in layers:
+            new_gids = array("I", (
+                remap[raw_gid & GID_MASK] | (raw_gid & ~GID_MASK) if raw_gid & GID_MASK else raw_gid
+                for raw_gid in gids
+            ))
+            if sys.byteorder != "little":
+                new_gids.byteswap()
+            data = node.find("data")
+            data.attrib = {"encoding": "base64", "compression": "zlib"}
+            data.text = base64.b64encode(zlib.compress(new_gids.tobytes())).decode("ascii")
+        for node in objects:
+            raw_gid = int(node.get("gid"))
+            node.set("gid", str(remap[raw_gid & GID_MASK] | (raw_gid & ~GID_MASK)))
+
+        tree.write(os.path.join(out_dir, os.path.basename(tmx_path)), encoding="UTF-8", xml_declaration=True)
+
+    # Общий кэш текстур держит каждую картинку один раз, поэтому экономия
+    # считается от разных картинок, а не от суммы по уровням
+    source_bytes = sum(_rgba_bytes(atlas.image(path)) for path in source_files)
+    atlas_bytes = _rgba_bytes(Image.open(image_path))
+    return {
+        "maps": len(maps),
+        "tile_placements": placements,
+        "map_tiles": map_tiles,
+        "unique_tiles": len(atlas.tiles),
+        "source_images": len(source_files),
+        "images_per_level": level_images_max,
+        "level_bytes": level_bytes,
+        "source_bytes": source_bytes,
+        "source_file_bytes": sum(os.path.getsize(path) for path in source_files),
+        "atlas_bytes": atlas_bytes,
+        "atlas_file_bytes": os.path.getsize(image_path),
+        "saved_bytes": source_bytes - atlas_bytes,
+    }
+
+
+def main():
+    out_dir = sys.argv[1] if len(sys.argv) > 1 else "atlas"
+    tmx_paths = sys.argv[2:] or list(LEVEL_REGISTRY.levels.values())
+    if not tmx_paths:
+        print("Карты уровней не найдены")
+        return
+
+    try:
+        report = build_atlas(tmx_paths, out_dir)
+    except (OSError, LevelCompileError) as e:
+        print(f"Ошибка сборки атласа: {e}")
+        return
+
+    print(f"Карт: {report['maps']}, размещений тайлов: {report['tile_placements']}, "
+          f"разных тайлов по картам: {report['map_tiles']}, уникальных в атласе: {report['unique_tiles']}")
+    print(f"Картинки тайлсетов: {report['source_images']} файлов "
+          f"(до {report['images_per_level']} на уровень), {report['source_file_bytes'] / 1024:.1f} КБ на диске, "
+          f"{report['source_bytes'] / 1024:.1f} КБ в памяти "
+          f"({report['level_bytes'] / 1024:.1f} КБ, если каждый уровень грузит свои)")
+    print(f"Атлас: 1 файл, {report['atlas_file_bytes'] / 1024:.1f} КБ на диске, "
+          f"{report['atlas_bytes'] / 1024:.1f} КБ в памяти")
+    print(f"Сэкономлено памяти текстур: {report['saved_bytes'] / 1024:.1f} КБ")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,1154 +1,3858 @@
-import arcade
-import sqlite3
-import hashlib
-import os
-from datetime import datetime
-
-# ============================================================================
-# КОНСТАНТЫ
-# ============================================================================
-
-SCREEN_W, SCREEN_H = 780, 450
-GRAVITY, MOVE_SPEED, JUMP_SPEED = 1, 3, 15
-TILE_SCALING = 1.68
-MENU_WIDTH, MENU_HEIGHT = 800, 600
-
-
-# ============================================================================
-# БАЗА ДАННЫХ
-# ============================================================================
-
-class GameDatabase:
-    def __init__(self, db_path="game_database.db"):
-        self.db_path = db_path
-        self.init_database()
-
-    def init_database(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_progress (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                level_id INTEGER NOT NULL,
-                unlocked BOOLEAN DEFAULT 0,
-                best_score INTEGER DEFAULT 0,
-                stars INTEGER DEFAULT 0,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                UNIQUE(user_id, level_id)
-            )
-        ''')
-
-        conn.commit()
-        conn.close()
-
-    def hash_password(self, password):
-        return hashlib.sha256(password.encode()).hexdigest()
-
-    def authenticate_user(self, username, password):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        password_hash = self.hash_password(password)
-
-        cursor.execute(
-            'SELECT id FROM users WHERE username = ? AND password_hash = ?',
-            (username, password_hash)
-        )
-        user = cursor.fetchone()
-        conn.close()
-
-        if user:
-            return True, user[0], "Вход выполнен успешно!"
-        return False, None, "Неверное имя пользователя или пароль"
-
-    def create_user(self, username, password):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        try:
-            # Проверяем существование пользователя
-            cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
-            if cursor.fetchone():
-                return False, None, "Пользователь с таким именем уже существует!"
-
-            password_hash = self.hash_password(password)
-            cursor.execute(
-                'INSERT INTO users (username, password_hash) VALUES (?, ?)',
-                (username, password_hash)
-            )
-            user_id = cursor.lastrowid
-
-            # Создаем прогресс для уровней
-            for level_id in [1, 2]:
-                unlocked = 1 if level_id == 1 else 0
-                cursor.execute(
-                    'INSERT INTO user_progress (user_id, level_id, unlocked) VALUES (?, ?, ?)',
-                    (user_id, level_id, unlocked)
-                )
-
-            conn.commit()
-            return True, user_id, "Пользователь создан успешно!"
-        except Exception as e:
-            conn.rollback()
-            return False, None, f"Ошибка: {str(e)}"
-        finally:
-            conn.close()
-
-    def get_user_progress(self, user_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            SELECT level_id, unlocked, best_score, stars 
-            FROM user_progress 
-            WHERE user_id = ? ORDER BY level_id
-        ''', (user_id,))
-
-        progress = {}
-        for row in cursor.fetchall():
-            level_id, unlocked, best_score, stars = row
-            progress[level_id] = {
-                'unlocked': bool(unlocked),
-                'best_score': best_score,
-                'stars': stars,
-                'name': f"Уровень {level_id}"
-            }
-
-        conn.close()
-        return progress
-
-    def update_progress(self, user_id, level_id, score, deaths, time_taken=999):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Получаем текущий рекорд
-        cursor.execute(
-            'SELECT best_score, stars FROM user_progress WHERE user_id = ? AND level_id = ?',
-            (user_id, level_id)
-        )
-        current = cursor.fetchone()
-        current_score = current[0] if current else 0
-        current_stars = current[1] if current else 0
-
-        # Обновляем если новый рекорд
-        new_score = max(score, current_score)
-
-        # Вычисляем звезды
-        stars = self.calculate_stars(score, deaths, time_taken)
-
-        # Сохраняем лучший результат звезд
-        stars = max(stars, current_stars)
-
-        cursor.execute('''
-            UPDATE user_progress 
-            SET best_score = ?, stars = ?
-            WHERE user_id = ? AND level_id = ?
-        ''', (new_score, stars, user_id, level_id))
-
-        # Разблокируем следующий уровень, если собрано достаточно очков
-        if new_score >= 30 and level_id < 2:  # Только если есть следующий уровень
-            next_level = level_id + 1
-            cursor.execute(
-                'SELECT COUNT(*) FROM user_progress WHERE user_id = ? AND level_id = ?',
-                (user_id, next_level)
-            )
-            if cursor.fetchone()[0] == 0:
-                cursor.execute(
-                    'INSERT INTO user_progress (user_id, level_id, unlocked) VALUES (?, ?, 1)',
-                    (user_id, next_level)
-                )
-            else:
-                cursor.execute(
-                    'UPDATE user_progress SET unlocked = 1 WHERE user_id = ? AND level_id = ?',
-                    (user_id, next_level)
-                )
-
-        conn.commit()
-        conn.close()
-        return stars
-
-    def calculate_stars(self, score, deaths, time_taken):
-        """Расчет звезд по стандартным правилам"""
-        stars = 0
-
-        # Звезда 1: собрано 50% предметов (макс 50 очков)
-        if score >= 25:  # 50% от 50
-            stars += 1
-        # Звезда 2: собрано 75% предметов
-        if score >= 38:  # 75% от 50
-            stars += 1
-        # Звезда 3: собраны все предметы
-        if score >= 50:  # 100% от 50
-            stars += 1
-        # Звезда 4: прохождение без смертей
-        if deaths == 0:
-            stars += 1
-        # Звезда 5: быстрое прохождение (< 60 секунд)
-        if time_taken < 60:
-            stars += 1
-
-        return min(stars, 5)
-
-
-# ============================================================================
-# ОКНО РЕГИСТРАЦИИ/АВТОРИЗАЦИИ
-# ============================================================================
-
-class AuthWindow(arcade.Window):
-    def __init__(self):
-        super().__init__(MENU_WIDTH, MENU_HEIGHT, "Вход / Регистрация")
-        arcade.set_background_color(arcade.color.DARK_SLATE_GRAY)
-
-        self.db = GameDatabase()
-        self.mode = "login"
-        self.username = self.password = self.confirm_password = ""
-        self.active_field = "username"
-        self.message = ""
-        self.message_color = arcade.color.GREEN
-
-    def on_draw(self):
-        self.clear()
-
-        # Заголовок
-        title = "ВХОД" if self.mode == "login" else "РЕГИСТРАЦИЯ"
-        arcade.draw_text(title, MENU_WIDTH // 2, MENU_HEIGHT - 80,
-                         arcade.color.WHITE, 40, anchor_x="center")
-
-        # Поля ввода
-        field_y_positions = {
-            "username": MENU_HEIGHT // 2 + 50,
-            "password": MENU_HEIGHT // 2 - 20,
-            "confirm": MENU_HEIGHT // 2 - 90
-        }
-
-        # Имя пользователя
-        username_y = field_y_positions["username"]
-        field_color = arcade.color.LIGHT_BLUE if self.active_field == "username" else arcade.color.WHITE
-
-        arcade.draw_text("Имя пользователя:", MENU_WIDTH // 2, username_y + 30,
-                         arcade.color.WHITE, 20, anchor_x="center")
-        arcade.draw_lrbt_rectangle_filled(
-            MENU_WIDTH // 2 - 150, MENU_WIDTH // 2 + 150,
-            username_y - 20, username_y + 20,
-            field_color
-        )
-        arcade.draw_text(self.username or "Введите имя", MENU_WIDTH // 2, username_y,
-                         arcade.color.BLACK, 20, anchor_x="center", anchor_y="center")
-
-        # Пароль
-        password_y = field_y_positions["password"]
-        field_color = arcade.color.LIGHT_BLUE if self.active_field == "password" else arcade.color.WHITE
-
-        arcade.draw_text("Пароль:", MENU_WIDTH // 2, password_y + 30,
-                         arcade.color.WHITE, 20, anchor_x="center")
-        arcade.draw_lrbt_rectangle_filled(
-            MENU_WIDTH // 2 - 150, MENU_WIDTH // 2 + 150,
-            password_y - 20, password_y + 20,
-            field_color
-        )
-        hidden_password = "*" * len(self.password)
-        arcade.draw_text(hidden_password or "Введите пароль", MENU_WIDTH // 2, password_y,
-                         arcade.color.BLACK, 20, anchor_x="center", anchor_y="center")
-
-        # Подтверждение пароля (только для регистрации)
-        if self.mode == "register":
-            confirm_y = field_y_positions["confirm"]
-            field_color = arcade.color.LIGHT_BLUE if self.active_field == "confirm" else arcade.color.WHITE
-
-            arcade.draw_text("Подтвердите пароль:", MENU_WIDTH // 2, confirm_y + 30,
-                             arcade.color.WHITE, 20, anchor_x="center")
-            arcade.draw_lrbt_rectangle_filled(
-                MENU_WIDTH // 2 - 150, MENU_WIDTH // 2 + 150,
-                confirm_y - 20, confirm_y + 20,
-                field_color
-            )
-            hidden_confirm = "*" * len(self.confirm_password)
-            arcade.draw_text(hidden_confirm or "Подтвердите пароль", MENU_WIDTH // 2, confirm_y,
-                             arcade.color.BLACK, 20, anchor_x="center", anchor_y="center")
-
-        # Кнопки
-        if self.mode == "login":
-            # Кнопка "Войти"
-            login_y = MENU_HEIGHT // 2 - 160
-            arcade.draw_lrbt_rectangle_filled(
-                MENU_WIDTH // 2 - 150, MENU_WIDTH // 2 + 150,
-                login_y - 25, login_y + 25,
-                arcade.color.GREEN
-            )
-            arcade.draw_text("Войти", MENU_WIDTH // 2, login_y,
-                             arcade.color.WHITE, 24, anchor_x="center", anchor_y="center")
-
-            # Кнопка "Регистрация"
-            register_y = MENU_HEIGHT // 2 - 220
-            arcade.draw_lrbt_rectangle_filled(
-                MENU_WIDTH // 2 - 150, MENU_WIDTH // 2 + 150,
-                register_y - 25, register_y + 25,
-                arcade.color.BLUE
-            )
-            arcade.draw_text("Нет аккаунта? Зарегистрироваться", MENU_WIDTH // 2, register_y,
-                             arcade.color.WHITE, 18, anchor_x="center", anchor_y="center")
-
-        else:  # register mode
-            # Кнопка "Зарегистрироваться"
-            register_y = MENU_HEIGHT // 2 - 160
-            arcade.draw_lrbt_rectangle_filled(
-                MENU_WIDTH // 2 - 150, MENU_WIDTH // 2 + 150,
-                register_y - 25, register_y + 25,
-                arcade.color.GREEN
-            )
-            arcade.draw_text("Зарегистрироваться", MENU_WIDTH // 2, register_y,
-                             arcade.color.WHITE, 24, anchor_x="center", anchor_y="center")
-
-            # Кнопка "Назад"
-            back_y = MENU_HEIGHT // 2 - 220
-            arcade.draw_lrbt_rectangle_filled(
-                MENU_WIDTH // 2 - 150, MENU_WIDTH // 2 + 150,
-                back_y - 25, back_y + 25,
-                arcade.color.BLUE
-            )
-            arcade.draw_text("Назад ко входу", MENU_WIDTH // 2, back_y,
-                             arcade.color.WHITE, 18, anchor_x="center", anchor_y="center")
-
-        # Сообщение
-        if self.message:
-            arcade.draw_text(self.message, MENU_WIDTH // 2, 50,
-                             self.message_color, 18, anchor_x="center")
-
-    def on_mouse_press(self, x, y, button, modifiers):
-        if button != arcade.MOUSE_BUTTON_LEFT:
-            return
-
-        # Проверяем клик по полям ввода
-        field_y_positions = {
-            "username": MENU_HEIGHT // 2 + 50,
-            "password": MENU_HEIGHT // 2 - 20,
-            "confirm": MENU_HEIGHT // 2 - 90
-        }
-
-        for field_name, field_y in field_y_positions.items():
-            if self.mode == "login" and field_name == "confirm":
-                continue
-
-            if (MENU_WIDTH // 2 - 150 <= x <= MENU_WIDTH // 2 + 150 and
-                    field_y - 20 <= y <= field_y + 20):
-                self.active_field = field_name
-                return
-
-        # Проверяем клик по кнопкам
-        if self.mode == "login":
-            # Кнопка "Войти"
-            login_y = MENU_HEIGHT // 2 - 160
-            if (MENU_WIDTH // 2 - 150 <= x <= MENU_WIDTH // 2 + 150 and
-                    login_y - 25 <= y <= login_y + 25):
-                self.login()
-                return
-
-            # Кнопка "Регистрация"
-            register_y = MENU_HEIGHT // 2 - 220
-            if (MENU_WIDTH // 2 - 150 <= x <= MENU_WIDTH // 2 + 150 and
-                    register_y - 25 <= y <= register_y + 25):
-                self.mode = "register"
-                self.message = ""
-                self.confirm_password = ""
-                self.active_field = "username"
-                return
-
-        else:  # register mode
-            # Кнопка "Зарегистрироваться"
-            register_y = MENU_HEIGHT // 2 - 160
-            if (MENU_WIDTH // 2 - 150 <= x <= MENU_WIDTH // 2 + 150 and
-                    register_y - 25 <= y <= register_y + 25):
-                self.register()
-                return
-
-            # Кнопка "Назад"
-            back_y = MENU_HEIGHT // 2 - 220
-            if (MENU_WIDTH // 2 - 150 <= x <= MENU_WIDTH // 2 + 150 and
-                    back_y - 25 <= y <= back_y + 25):
-                self.mode = "login"
-                self.message = ""
-                self.confirm_password = ""
-                self.active_field = "username"
-                return
-
-    def on_key_press(self, key, modifiers):
-        if key == arcade.key.ESCAPE:
-            self.close()
-        elif key == arcade.key.TAB:
-            # Переключение между полями
-            if self.mode == "login":
-                fields = ["username", "password"]
-            else:
-                fields = ["username", "password", "confirm"]
-
-            if self.active_field in fields:
-                idx = fields.index(self.active_field)
-                self.active_field = fields[(idx + 1) % len(fields)]
-            else:
-                self.active_field = fields[0]
-        elif key == arcade.key.ENTER:
-            if self.mode == "login":
-                self.login()
-            else:
-                self.register()
-        elif key == arcade.key.BACKSPACE:
-            if self.active_field == "username":
-                self.username = self.username[:-1]
-            elif self.active_field == "password":
-                self.password = self.password[:-1]
-            elif self.active_field == "confirm":
-                self.confirm_password = self.confirm_password[:-1]
-        elif 32 <= key <= 126:
-            char = chr(key)
-            if self.active_field == "username":
-                self.username += char
-            elif self.active_field == "password":
-                self.password += char
-            elif self.active_field == "confirm":
-                self.confirm_password += char
-
-    def login(self):
-        if not self.username or not self.password:
-            self.message = "Заполните все поля!"
-            self.message_color = arcade.color.RED
-            return
-
-        success, user_id, message = self.db.authenticate_user(self.username, self.password)
-        self.message = message
-        self.message_color = arcade.color.GREEN if success else arcade.color.RED
-
-        if success:
-            self.close()
-            level_menu = LevelMenu(user_id, self.db)
-            level_menu.show()
-
-    def register(self):
-        if not all([self.username, self.password, self.confirm_password]):
-            self.message = "Заполните все поля!"
-            self.message_color = arcade.color.RED
-            return
-
-        if self.password != self.confirm_password:
-            self.message = "Пароли не совпадают!"
-            self.message_color = arcade.color.RED
-            return
-
-        if len(self.username) < 3:
-            self.message = "Имя пользователя должно быть не менее 3 символов"
-            self.message_color = arcade.color.RED
-            return
-
-        if len(self.password) < 4:
-            self.message = "Пароль должен быть не менее 4 символов"
-            self.message_color = arcade.color.RED
-            return
-
-        success, user_id, message = self.db.create_user(self.username, self.password)
-        self.message = message
-        self.message_color = arcade.color.GREEN if success else arcade.color.RED
-
-        if success:
-            self.mode = "login"
-            self.password = self.confirm_password = ""
-            self.active_field = "username"
-
-
-# ============================================================================
-# МЕНЮ ВЫБОРА УРОВНЯ
-# ============================================================================
-
-class LevelMenu(arcade.Window):
-    def __init__(self, user_id, db):
-        super().__init__(MENU_WIDTH, MENU_HEIGHT, "Выбор уровня")
-        arcade.set_background_color(arcade.color.SKY_BLUE)
-
-        self.user_id = user_id
-        self.db = db
-        self.progress = self.db.get_user_progress(user_id)
-        self.hovered_level = None
-
-    def show(self):
-        """Показать меню"""
-        self.progress = self.db.get_user_progress(self.user_id)
-        arcade.run()
-
-    def on_draw(self):
-        self.clear()
-
-        arcade.draw_text("ВЫБОР УРОВНЯ", MENU_WIDTH // 2, MENU_HEIGHT - 50,
-                         arcade.color.NAVY_BLUE, 36, anchor_x="center")
-
-        # Отображаем уровни
-        for level_id in [1, 2]:
-            level_info = self.progress.get(level_id, {
-                'unlocked': level_id == 1,
-                'best_score': 0,
-                'stars': 0,
-                'name': f"Уровень {level_id}"
-            })
-
-            x = MENU_WIDTH // 3 if level_id == 1 else 2 * MENU_WIDTH // 3
-            y = MENU_HEIGHT // 2
-
-            # Фон уровня
-            color = arcade.color.LIGHT_GRAY
-            if not level_info['unlocked']:
-                color = arcade.color.DARK_GRAY
-            elif self.hovered_level == level_id:
-                color = arcade.color.LIGHT_BLUE
-
-            arcade.draw_lrbt_rectangle_filled(
-                x - 90, x + 90,
-                y - 50, y + 50,
-                color
-            )
-            arcade.draw_lrbt_rectangle_outline(
-                x - 90, x + 90,
-                y - 50, y + 50,
-                arcade.color.BLACK, 2
-            )
-
-            # Название
-            text_color = arcade.color.BLACK if level_info['unlocked'] else arcade.color.GRAY
-            arcade.draw_text(level_info['name'], x, y + 20,
-                             text_color, 20, anchor_x="center", anchor_y="center")
-
-            # Статистика
-            if level_info['best_score'] > 0:
-                arcade.draw_text(f"Очки: {level_info['best_score']}", x, y - 10,
-                                 arcade.color.DARK_GREEN, 14, anchor_x="center", anchor_y="center")
-
-            # Звезды
-            if level_info['stars'] > 0:
-                for i in range(5):
-                    star_x = x - 40 + i * 20
-                    star_y = y - 30
-                    if i < level_info['stars']:
-                        arcade.draw_circle_filled(star_x, star_y, 8, arcade.color.GOLD)
-                    else:
-                        arcade.draw_circle_outline(star_x, star_y, 8, arcade.color.GRAY, 1)
-
-            # Замок для заблокированных
-            if not level_info['unlocked']:
-                arcade.draw_text("🔒", x, y - 40,
-                                 arcade.color.BLACK, 24, anchor_x="center", anchor_y="center")
-
-        arcade.draw_text("Нажмите на уровень для начала игры", MENU_WIDTH // 2, 100,
-                         arcade.color.DARK_GRAY, 16, anchor_x="center")
-        arcade.draw_text("ESC - выход в главное меню", MENU_WIDTH // 2, 70,
-                         arcade.color.DARK_GRAY, 14, anchor_x="center")
-
-    def on_mouse_motion(self, x, y, dx, dy):
-        self.hovered_level = None
-        for level_id in [1, 2]:
-            level_x = MENU_WIDTH // 3 if level_id == 1 else 2 * MENU_WIDTH // 3
-            level_y = MENU_HEIGHT // 2
-
-            if (level_x - 90 <= x <= level_x + 90 and
-                    level_y - 50 <= y <= level_y + 50):
-
-                level_info = self.progress.get(level_id, {'unlocked': level_id == 1})
-                if level_info['unlocked']:
-                    self.hovered_level = level_id
-                break
-
-    def on_mouse_press(self, x, y, button, modifiers):
-        if button != arcade.MOUSE_BUTTON_LEFT:
-            return
-
-        for level_id in [1, 2]:
-            level_x = MENU_WIDTH // 3 if level_id == 1 else 2 * MENU_WIDTH // 3
-            level_y = MENU_HEIGHT // 2
-
-            if (level_x - 90 <= x <= level_x + 90 and
-                    level_y - 50 <= y <= level_y + 50):
-
-                level_info = self.progress.get(level_id, {'unlocked': level_id == 1})
-                if level_info['unlocked']:
-                    self.close()
-                    game_window = GameWindow(level_id, self.user_id, self.db)
-                    game_window.run()
-                    # После завершения игры обновляем прогресс и показываем меню
-                    self.progress = self.db.get_user_progress(self.user_id)
-                    self.show_view()
-                    break
-
-    def on_key_press(self, key, modifiers):
-        if key == arcade.key.ESCAPE:
-            self.close()
-            # Возвращаемся к окну авторизации
-            auth_window = AuthWindow()
-            auth_window.run()
-
-    def show_view(self):
-        """Показать это окно снова"""
-        self.__init__(self.user_id, self.db)
-        arcade.run()
-
-
-# ============================================================================
-# ИГРОВОЕ ОКНО
-# ============================================================================
-
-class GameWindow(arcade.Window):
-    def __init__(self, level_id, user_id, db):
-        super().__init__(SCREEN_W, SCREEN_H, f"Уровень {level_id}")
-        arcade.set_background_color(arcade.color.SKY_BLUE)
-
-        self.level_id = level_id
-        self.user_id = user_id
-        self.db = db
-
-        self.score = 0
-        self.max_score = 0  # Максимально возможный счет для этого уровня
-        self.health = 100
-        self.deaths = 0
-        self.start_time = datetime.now()
-        self.has_key = False
-        self.level_complete = False
-
-        # Списки спрайтов
-        self.player_list = arcade.SpriteList()
-        self.walls = None
-        self.collectibles = None
-        self.exit_list = None
-        self.damage_list = None
-        self.ladder_list = None
-        self.batut_list = None
-        self.characters_list = None  # Слой персонажей
-
-        # Для восстановления предметов при смерти
-        self.original_collectibles_data = []  # Храним данные оригинальных предметов
-
-        # Игрок
-        self.player = None
-
-        # Физический движок
-        self.physics_engine = None
-
-        # Управление
-        self.left = self.right = self.up = self.down = False
-        self.jump_pressed = False
-        self.on_ladder = False
-        self.can_jump = False
-
-        # Таймер неуязвимости после получения урона
-        self.invincible_timer = 0
-        self.INVINCIBLE_TIME = 1.0
-
-        # Для прыжка с лестницы
-        self.ladder_jump_cooldown = 0
-
-        self.setup_level()
-
-    def setup_level(self):
-        """Загрузка уровня"""
-        # Пути к файлам уровней
-        level_files = {
-            1: r"C:\Users\NNSneg\Desktop\Проект.tmx",
-            2: r"C:\Users\NNSneg\Desktop\Проект2.tmx"
-        }
-
-        file_path = level_files.get(self.level_id)
-
-        if file_path and os.path.exists(file_path):
-            try:
-                # Загружаем карту Tiled
-                layer_options = {
-                    "collision": {"use_spatial_hash": True, "scaling": TILE_SCALING},
-                    "collect": {"use_spatial_hash": True, "scaling": TILE_SCALING},
-                    "exit": {"use_spatial_hash": True, "scaling": TILE_SCALING},
-                    "damage": {"use_spatial_hash": True, "scaling": TILE_SCALING},
-                    "ladder": {"use_spatial_hash": True, "scaling": TILE_SCALING},
-                    "batut": {"use_spatial_hash": True, "scaling": TILE_SCALING},
-                    "characters": {"use_spatial_hash": True, "scaling": TILE_SCALING}
-                }
-
-                self.tile_map = arcade.load_tilemap(
-                    file_path,
-                    scaling=TILE_SCALING,
-                    layer_options=layer_options
-                )
-
-                # Получаем слои
-                self.walls = self.tile_map.sprite_lists.get("collision") or arcade.SpriteList()
-                self.collectibles = self.tile_map.sprite_lists.get("collect") or arcade.SpriteList()
-                self.exit_list = self.tile_map.sprite_lists.get("exit") or arcade.SpriteList()
-                self.damage_list = self.tile_map.sprite_lists.get("damage") or arcade.SpriteList()
-                self.ladder_list = self.tile_map.sprite_lists.get("ladder") or arcade.SpriteList()
-                self.batut_list = self.tile_map.sprite_lists.get("batut") or arcade.SpriteList()
-                self.characters_list = self.tile_map.sprite_lists.get("characters") or arcade.SpriteList()
-
-                # Сохраняем данные оригинальных предметов для восстановления
-                self.original_collectibles_data = []
-                if self.collectibles:
-                    for item in self.collectibles:
-                        # Сохраняем основные свойства предмета
-                        item_data = {
-                            'center_x': item.center_x,
-                            'center_y': item.center_y,
-                            'scale': item.scale,
-                            'width': item.width,
-                            'height': item.height,
-                        }
-
-                        # Проверяем тип спрайта
-                        if hasattr(item, 'texture') and item.texture:
-                            # Это спрайт с текстурой
-                            item_data['type'] = 'textured'
-                            # Сохраняем информацию о текстуре
-                            if hasattr(item, 'texture') and item.texture:
-                                item_data['texture'] = item.texture
-                        elif hasattr(item, 'color'):
-                            # Это цветной спрайт
-                            item_data['type'] = 'colored'
-                            item_data['color'] = item.color
-                        else:
-                            # По умолчанию считаем текстурированным
-                            item_data['type'] = 'textured'
-
-                        self.original_collectibles_data.append(item_data)
-
-                # Сцена
-                self.scene = arcade.Scene.from_tilemap(self.tile_map)
-
-                # Подсчитываем максимально возможный счет
-                if self.collectibles:
-                    self.max_score = len(self.collectibles) * 10
-                else:
-                    self.max_score = 50  # Максимум 50 очков
-
-            except Exception as e:
-                print(f"Ошибка загрузки уровня: {e}")
-                self.create_test_level()
-        else:
-            self.create_test_level()
-
-        # Создаем игрока
-        try:
-            # Пробуем загрузить свою текстуру
-            self.player = arcade.Sprite(r"C:\Users\NNSneg\Desktop\blue_slime_hero_24x24_strip5.png", scale=1.25)
-        except:
-            # Используем стандартную текстуру
-            self.player = arcade.Sprite(":resources:images/animated_characters/female_person/femalePerson_idle.png",
-                                        0.8)
-
-        self.player.center_x, self.player.center_y = 100, 200
-        self.player_list.append(self.player)
-
-        # Физический движок для игрока
-        if self.walls:
-            self.physics_engine = arcade.PhysicsEnginePlatformer(
-                self.player, self.walls, gravity_constant=GRAVITY,
-                ladders=self.ladder_list
-            )
-
-    def create_test_level(self):
-        """Создание уровня"""
-        # Инициализируем списки
-        self.walls = arcade.SpriteList(use_spatial_hash=True)
-        self.collectibles = arcade.SpriteList()
-        self.exit_list = arcade.SpriteList()
-        self.damage_list = arcade.SpriteList()
-        self.ladder_list = arcade.SpriteList()
-        self.batut_list = arcade.SpriteList()
-        self.characters_list = arcade.SpriteList()
-
-        # Базовые платформы
-        for x in range(0, 800, 64):
-            wall = arcade.SpriteSolidColor(64, 64, arcade.color.GREEN)
-            wall.center_x = x
-            wall.center_y = 32
-            self.walls.append(wall)
-
-        # Добавляем платформы для разнообразия
-        platform = arcade.SpriteSolidColor(200, 32, arcade.color.GREEN)
-        platform.center_x = 300
-        platform.center_y = 150
-        self.walls.append(platform)
-
-        # Лестница для тестирования
-        for y in range(50, 200, 32):
-            ladder = arcade.SpriteSolidColor(32, 32, arcade.color.BLUE)
-            ladder.center_x = 400
-            ladder.center_y = y
-            self.ladder_list.append(ladder)
-
-        # Монетки (5 штук для 50 очков)
-        for i in range(5):
-            coin = arcade.Sprite(":resources:images/items/coinGold.png", 0.5)
-            coin.center_x = 150 + i * 80
-            coin.center_y = 200
-            self.collectibles.append(coin)
-
-        # Сохраняем данные оригинальных предметов
-        self.original_collectibles_data = []
-        for item in self.collectibles:
-            item_data = {
-                'type': 'textured',
-                'center_x': item.center_x,
-                'center_y': item.center_y,
-                'scale': item.scale,
-                'width': item.width,
-                'height': item.height,
-                'texture': item.texture
-            }
-            self.original_collectibles_data.append(item_data)
-
-        # Выход
-        exit_sprite = arcade.Sprite(":resources:images/tiles/lockYellow.png", 0.8)
-        exit_sprite.center_x = 700
-        exit_sprite.center_y = 200
-        self.exit_list.append(exit_sprite)
-
-        # Тестовый враг для обоих уровней
-        enemy = arcade.SpriteSolidColor(32, 32, arcade.color.DARK_RED)
-        enemy.center_x = 500
-        enemy.center_y = 100
-        self.characters_list.append(enemy)
-
-        # Создаем сцену
-        self.scene = arcade.Scene()
-        self.scene.add_sprite_list("walls", sprite_list=self.walls)
-
-        # Максимальный счет для тестового уровня
-        self.max_score = 50  # 5 монеток * 10 очков
-
-    def on_draw(self):
-        self.clear()
-
-        # Отрисовка мира
-        if hasattr(self, 'scene') and self.scene:
-            self.scene.draw()
-
-        if self.collectibles:
-            self.collectibles.draw()
-        if self.exit_list:
-            self.exit_list.draw()
-        if self.damage_list:
-            self.damage_list.draw()
-        if self.ladder_list:
-            self.ladder_list.draw()
-        if self.batut_list:
-            self.batut_list.draw()
-        if self.characters_list:
-            self.characters_list.draw()
-
-        self.player_list.draw()
-
-        # Интерфейс
-        arcade.draw_lrbt_rectangle_filled(5, 250, SCREEN_H - 75, SCREEN_H - 5, (0, 0, 0, 150))
-
-        arcade.draw_text(f"Уровень {self.level_id}", 10, SCREEN_H - 30, arcade.color.WHITE, 16)
-        arcade.draw_text(f"Очки: {self.score}/{self.max_score}", 10, SCREEN_H - 50, arcade.color.WHITE, 16)
-
-        # Здоровье с цветом в зависимости от количества
-        health_color = arcade.color.GREEN
-        if self.health <= 50:
-            health_color = arcade.color.YELLOW
-        if self.health <= 20:
-            health_color = arcade.color.RED
-
-        arcade.draw_text(f"Здоровье: {self.health}", 10, SCREEN_H - 70, health_color, 16)
-
-        if self.has_key:
-            arcade.draw_text("Ключ получен!", SCREEN_W - 150, SCREEN_H - 30, arcade.color.GOLD, 16)
-            arcade.draw_text("Идите к выходу", SCREEN_W - 150, SCREEN_H - 50, arcade.color.YELLOW, 14)
-
-        # Экран завершения
-        if self.level_complete:
-            arcade.draw_lrbt_rectangle_filled(0, SCREEN_W, 0, SCREEN_H, (0, 0, 0, 200))
-            arcade.draw_text("УРОВЕНЬ ПРОЙДЕН!", SCREEN_W // 2, SCREEN_H // 2 + 50,
-                             arcade.color.GOLD, 36, anchor_x="center")
-            arcade.draw_text(f"Очки: {self.score}/{self.max_score}", SCREEN_W // 2, SCREEN_H // 2,
-                             arcade.color.WHITE, 24, anchor_x="center")
-            arcade.draw_text(f"Смерти: {self.deaths}", SCREEN_W // 2, SCREEN_H // 2 - 30,
-                             arcade.color.WHITE, 24, anchor_x="center")
-
-            # Рассчет времени
-            time_taken = (datetime.now() - self.start_time).total_seconds()
-            arcade.draw_text(f"Время: {time_taken:.1f}с", SCREEN_W // 2, SCREEN_H // 2 - 60,
-                             arcade.color.WHITE, 20, anchor_x="center")
-
-            arcade.draw_text("Нажмите ESC для выхода в меню", SCREEN_W // 2, SCREEN_H // 2 - 100,
-                             arcade.color.YELLOW, 18, anchor_x="center")
-
-    def on_key_press(self, key, modifiers):
-        if key == arcade.key.ESCAPE:
-            if self.level_complete:
-                # Сохраняем прогресс с корректным расчетом звезд
-                time_taken = (datetime.now() - self.start_time).total_seconds()
-                self.db.update_progress(self.user_id, self.level_id, self.score, self.deaths, time_taken)
-
-            # Закрываем окно игры
-            self.close()
-            return
-
-        if self.level_complete:
-            return
-
-        if key in (arcade.key.LEFT, arcade.key.A):
-            self.left = True
-        elif key in (arcade.key.RIGHT, arcade.key.D):
-            self.right = True
-        elif key in (arcade.key.UP, arcade.key.W):
-            self.up = True
-        elif key in (arcade.key.DOWN, arcade.key.S):
-            self.down = True
-        elif key == arcade.key.SPACE:
-            self.jump_pressed = True
-
-    def on_key_release(self, key, modifiers):
-        if key in (arcade.key.LEFT, arcade.key.A):
-            self.left = False
-        elif key in (arcade.key.RIGHT, arcade.key.D):
-            self.right = False
-        elif key in (arcade.key.UP, arcade.key.W):
-            self.up = False
-        elif key in (arcade.key.DOWN, arcade.key.S):
-            self.down = False
-        elif key == arcade.key.SPACE:
-            self.jump_pressed = False
-
-    def on_update(self, delta_time):
-        if self.level_complete:
-            return
-
-        # Обновление таймеров
-        if self.invincible_timer > 0:
-            self.invincible_timer -= delta_time
-            if self.invincible_timer <= 0:
-                self.player.alpha = 255
-
-        if self.ladder_jump_cooldown > 0:
-            self.ladder_jump_cooldown -= delta_time
-
-        # Управление движением
-        move_x = 0
-        if self.left and not self.right:
-            move_x = -MOVE_SPEED
-        elif self.right and not self.left:
-            move_x = MOVE_SPEED
-
-        self.player.change_x = move_x
-
-        # Проверка на лестнице
-        self.on_ladder = False
-        if self.ladder_list:
-            ladder_collisions = arcade.check_for_collision_with_list(self.player, self.ladder_list)
-            self.on_ladder = len(ladder_collisions) > 0
-
-        # Управление на лестнице
-        if self.on_ladder:
-            # Отключаем гравитацию на лестнице
-            if self.physics_engine:
-                self.physics_engine.gravity_constant = 0
-
-            # Вертикальное движение на лестнице
-            if self.up:
-                self.player.change_y = MOVE_SPEED
-            elif self.down:
-                self.player.change_y = -MOVE_SPEED
-            else:
-                self.player.change_y = 0
-
-            # Прыжок с лестницы
-            if self.jump_pressed and self.ladder_jump_cooldown <= 0:
-                self.player.change_y = JUMP_SPEED
-                self.on_ladder = False
-                self.ladder_jump_cooldown = 0.3
-
-                # Даем горизонтальный импульс
-                if self.left:
-                    self.player.change_x = -MOVE_SPEED * 1.5
-                elif self.right:
-                    self.player.change_x = MOVE_SPEED * 1.5
-        else:
-            # Включаем гравитацию вне лестницы
-            if self.physics_engine:
-                self.physics_engine.gravity_constant = GRAVITY
-
-            # Проверяем, стоит ли игрок на земле
-            on_ground = False
-            if self.physics_engine:
-                on_ground = self.physics_engine.can_jump()
-
-            # Обычный прычок с земли
-            if self.jump_pressed and on_ground:
-                self.player.change_y = JUMP_SPEED
-                self.jump_pressed = False
-
-        # Батут
-        if self.batut_list:
-            batut_hit = arcade.check_for_collision_with_list(self.player, self.batut_list)
-            for batut in batut_hit:
-                if self.player.change_y < 0:
-                    self.player.change_y = 20
-                    self.jump_pressed = False
-
-        # Обновляем физику
-        if self.physics_engine:
-            self.physics_engine.update()
-
-        # Сбор предметов
-        if self.collectibles:
-            collected = arcade.check_for_collision_with_list(self.player, self.collectibles)
-            for item in collected:
-                item.remove_from_sprite_lists()
-                self.score += 10
-
-                if self.score >= 50:
-                    self.has_key = True
-
-        # Проверка повреждений от опасных объектов
-        self.check_damage()
-
-        # Проверка выхода
-        if self.has_key and self.exit_list:
-            exit_hit = arcade.check_for_collision_with_list(self.player, self.exit_list)
-            if exit_hit:
-                self.level_complete = True
-
-        # Смерть от падения
-        if self.player.center_y < -100:
-            self.player_die()
-
-    def check_damage(self):
-        """Проверка столкновений с опасными объектами"""
-        # Если игрок неуязвим - пропускаем проверку
-        if self.invincible_timer > 0:
-            return
-
-        # Проверка damage слоя
-        if self.damage_list:
-            damage_hit = arcade.check_for_collision_with_list(self.player, self.damage_list)
-            if damage_hit:
-                self.take_damage(20)
-
-        # Проверка врагов
-        if self.characters_list:
-            # Проверяем столкновение с каждым врагом отдельно
-            for enemy in self.characters_list:
-                # Используем простую проверку расстояния
-                distance_x = abs(self.player.center_x - enemy.center_x)
-                distance_y = abs(self.player.center_y - enemy.center_y)
-
-                # Если расстояние достаточно мало
-                if distance_x < (self.player.width / 2 + enemy.width / 2) and distance_y < (
-                        self.player.height / 2 + enemy.height / 2):
-                    self.take_damage(25)
-                    break  # Чтобы не наносить урон несколько раз за один кадр
-
-    def take_damage(self, amount):
-        """Нанесение урона игроку"""
-        self.health -= amount
-
-        if self.health <= 0:
-            self.player_die()
-        else:
-            # Активируем неуязвимость
-            self.invincible_timer = self.INVINCIBLE_TIME
-            self.player.alpha = 128  # Полупрозрачность
-            self.player.change_y = 8  # Отскок
-
-            # Отбрасывание
-            if self.player.center_x < SCREEN_W // 2:
-                self.player.change_x = 5  # Вправо
-            else:
-                self.player.change_x = -5  # Влево
-
-    def player_die(self):
-        """Смерть игрока - восстанавливаем все предметы"""
-        self.deaths += 1
-        self.health = 100
-
-        # Восстанавливаем здоровье игрока
-        self.player.center_x, self.player.center_y = 100, 200
-        self.player.change_x = self.player.change_y = 0
-        self.player.alpha = 255
-
-        # Сбрасываем ключ
-        self.has_key = False
-
-        # Сбрасываем таймеры
-        self.invincible_timer = 0
-        self.on_ladder = False
-        self.ladder_jump_cooldown = 0
-
-        self.restore_collectibles()
-
-        # Сбрасываем счет (предметы восстановлены, нужно собрать заново)
-        self.score = 0
-
-    def restore_collectibles(self):
-        """Восстановление всех предметов из слоя collect"""
-        # Очищаем текущий список предметов
-        if self.collectibles:
-            self.collectibles.clear()
-
-        # Создаем новый список предметов
-        self.collectibles = arcade.SpriteList(use_spatial_hash=True)
-
-        # Восстанавливаем предметы из сохраненных данных
-        for item_data in self.original_collectibles_data:
-            try:
-                if item_data['type'] == 'textured' and 'texture' in item_data:
-                    # Восстанавливаем текстурированный спрайт
-                    # Создаем спрайт с той же текстурой
-                    new_item = arcade.Sprite()
-                    new_item.texture = item_data['texture']
-                    new_item.scale = item_data['scale']
-                    new_item.width = item_data['width']
-                    new_item.height = item_data['height']
-                    new_item.center_x = item_data['center_x']
-                    new_item.center_y = item_data['center_y']
-                elif item_data['type'] == 'colored' and 'color' in item_data:
-                    # Восстанавливаем цветной спрайт
-                    new_item = arcade.SpriteSolidColor(
-                        item_data['width'], item_data['height'], item_data['color']
-                    )
-                    new_item.scale = item_data['scale']
-                    new_item.center_x = item_data['center_x']
-                    new_item.center_y = item_data['center_y']
-                else:
-                    # Если не удалось определить тип, создаем простой спрайт
-                    new_item = arcade.SpriteSolidColor(32, 32, arcade.color.YELLOW)
-                    new_item.center_x = item_data['center_x']
-                    new_item.center_y = item_data['center_y']
-
-                # Добавляем в список
-                self.collectibles.append(new_item)
-
-            except Exception as e:
-                print(f"Ошибка восстановления предмета: {e}")
-                # Создаем простой предмет как запасной вариант
-                try:
-                    fallback_item = arcade.SpriteSolidColor(32, 32, arcade.color.YELLOW)
-                    fallback_item.center_x = item_data.get('center_x', 100)
-                    fallback_item.center_y = item_data.get('center_y', 100)
-                    self.collectibles.append(fallback_item)
-                except:
-                    continue
-
-
-# ============================================================================
-# ЗАПУСК ИГРЫ
-# ============================================================================
-
-def main():
-    """Главная функция запуска игры"""
-    auth_window = AuthWindow()
-    auth_window.run()
-
-
-if __name__ == "__main__":
+import arcade
+import atexit
+import pyglet
+import base64
+import csv
+import gc
+import gzip
+import sqlite3
+import hashlib
+import hmac
+import json
+import math
+import mmap
+import os
+import queue
+import re
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from xml.etree import ElementTree
+
+from PIL import Image
+
+try:
+    import numpy as np  # необязательно: ускоряет работу со столбцами данных
+except ImportError:
+    np = None
+
+# ============================================================================
+# КОНСТАНТЫ
+# ============================================================================
+
+SCREEN_W, SCREEN_H = 780, 450
+GRAVITY, MOVE_SPEED, JUMP_SPEED = 1, 3, 15
+BATUT_SPEED = 20
+# Скорости выше заданы за один шаг физики при 60 шагах в секунду
+PHYSICS_BASE_RATE = 60
+TICK_RATE = 60  # Шагов физики в секунду, не зависит от частоты кадров
+MAX_CATCHUP_STEPS = 5  # Больше шагов за кадр не делаем, остаток отбрасываем
+
+# Управление одним числом: биты нажатых клавиш (для записи и повтора прохождений)
+INPUT_LEFT, INPUT_RIGHT, INPUT_UP, INPUT_DOWN, INPUT_JUMP = 1, 2, 4, 8, 16
+TILE_SCALING = 1.68
+TILE_SIZE = 18  # Размер тайла на картах Tiled, до масштабирования
+MENU_WIDTH, MENU_HEIGHT = 800, 600
+
+# Пути к ресурсам считаются от папки с игрой, их можно переопределить
+# переменными окружения JELLYJUMP_ASSETS и JELLYJUMP_LEVELS
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ASSETS_DIR = os.environ.get("JELLYJUMP_ASSETS", BASE_DIR)
+LEVELS_DIR = os.environ.get("JELLYJUMP_LEVELS", ASSETS_DIR)
+LEVEL_CACHE_DIR = os.path.join(BASE_DIR, ".levelcache")
+# Файл (.csv или .json), куда при выходе из уровня пишутся замеры кадров
+PROFILE_PATH = os.environ.get("JELLYJUMP_PROFILE")
+
+PLAYER_TEXTURE = os.path.join(ASSETS_DIR, "blue_slime_hero_24x24_strip5.png")
+PLAYER_FRAME_SIZE = 24  # Кадры в полосе 24x24
+PLAYER_FALLBACK_TEXTURE = ":resources:images/animated_characters/female_person/femalePerson_idle.png"
+COIN_TEXTURE = ":resources:images/items/coinGold.png"
+EXIT_TEXTURE = ":resources:images/tiles/lockYellow.png"
+TEXTURE_CACHE_MB = 128  # Сколько места могут занимать картинки, которые сейчас не нужны
+BAKE_STATIC_LAYERS = True  # Декоративные слои рисуются из заранее отрисованных текстур
+BAKED_CHUNKS_MAX = 24  # Сколько заранее нарисованных кусков экрана хранится для группы слоев
+
+
+# ============================================================================
+# БАЗА ДАННЫХ
+# ============================================================================
+
+class ConnectionPool:
+    """Пул долгоживущих соединений с SQLite.
+
+    Соединения открываются один раз и переиспользуются, поэтому кэш
+    подготовленных выражений sqlite3 (cached_statements) действует между
+    вызовами. База переводится в режим WAL: читатели не блокируют писателя.
+    """
+
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-8000",  # ~8 МБ страничного кэша
+    )
+
+    def __init__(self, db_path, size=4, timeout=5.0, cached_statements=256):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+
+        self._idle = queue.LifoQueue()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        """Взять соединение из пула (создается лениво, не больше size)"""
+        if self._closed:
+            raise sqlite3.ProgrammingError("Пул соединений закрыт")
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._connections) < self.size:
+                conn = self._connect()
+                self._connections.append(conn)
+                return conn
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Нет свободных соединений в пуле")
+
+    def release(self, conn):
+        """Вернуть соединение в пул"""
+        if self._closed:
+            conn.close()
+            return
+        # Незавершенная транзакция не должна достаться следующему вызову
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Потокобезопасная выдача соединения: with pool.connection() as conn"""
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+
+class ProgressWriter:
+    """Фоновая запись прогресса (write-behind).
+
+    Игровой поток только кладет результат в очередь, а отдельный поток
+    забирает накопившиеся записи и сохраняет их одной транзакцией. Если
+    транзакция не удалась, записи сохраняются по одной, чтобы ошибка в
+    одной из них не потеряла остальные.
+    """
+
+    def __init__(self, db, batch_size=64):
+        self.db = db
+        self.batch_size = batch_size
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pending = {}  # user_id -> записи, которые еще не сохранены
+        self._pending_lock = threading.Lock()
+
+        # Статистика
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+
+    @property
+    def depth(self):
+        """Количество записей, ожидающих сохранения"""
+        return self._queue.qsize()
+
+    def submit(self, user_id, level_id, score, deaths, time_taken=999, replay=None):
+        """Поставить результат уровня в очередь на запись"""
+        self._start()
+        record = (user_id, level_id, score, deaths, time_taken, replay)
+        with self._pending_lock:
+            self._pending.setdefault(user_id, []).append(record)
+        self._queue.put(record)
+
+    def pending(self, user_id):
+        """Результаты игрока, которые стоят в очереди и еще не попали в базу"""
+        with self._pending_lock:
+            return list(self._pending.get(user_id, ()))
+
+    def flush(self):
+        """Дождаться сохранения всех поставленных в очередь записей"""
+        self._queue.join()
+
+    def close(self):
+        """Сохранить все записи и остановить поток"""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="progress-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Забираем все, что успело накопиться
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            records = [item for item in batch if item is not None]
+            if records:
+                self._write(records)
+
+            for _ in batch:
+                self._queue.task_done()
+
+            if len(records) != len(batch):
+                return
+
+    def _write(self, records):
+        try:
+            self.db.write_progress_batch(records)
+            self.written += len(records)
+            self.batches += 1
+        except Exception as e:
+            print(f"Ошибка сохранения прогресса: {e}")
+            # Транзакция откатилась целиком - сохраняем записи по одной
+            for record in records:
+                try:
+                    self.db.write_progress_batch([record])
+                    self.written += 1
+                except Exception as e:
+                    self.failed += 1
+                    print(f"Ошибка сохранения результата уровня {record[1]}: {e}")
+
+        with self._pending_lock:
+            for record in records:
+                user_records = self._pending[record[0]]
+                user_records.remove(record)
+                if not user_records:
+                    del self._pending[record[0]]
+
+
+class ProgressCache:
+    """LRU-кэш прогресса игроков.
+
+    Хранит результат get_user_progress для последних max_users игроков.
+    Запись прогресса сбрасывает запись игрока (write-through invalidation).
+    Возвращаемые словари общие для всех вызовов - их нельзя изменять.
+    """
+
+    def __init__(self, max_users=256):
+        self.max_users = max_users
+
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        # Растет при каждом сбросе: не даем положить в кэш данные,
+        # прочитанные до записи
+        self._epoch = 0
+
+        # Статистика
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def epoch(self):
+        return self._epoch
+
+    def get(self, user_id):
+        with self._lock:
+            progress = self._items.get(user_id)
+            if progress is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(user_id)
+            self.hits += 1
+            return progress
+
+    def put(self, user_id, progress, epoch):
+        with self._lock:
+            if epoch != self._epoch:
+                return
+            self._items[user_id] = progress
+            self._items.move_to_end(user_id)
+            while len(self._items) > self.max_users:
+                self._items.popitem(last=False)
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            self._epoch += 1
+            for user_id in user_ids:
+                self._items.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._items.clear()
+
+
+class PasswordHasher(ABC):
+    """Интерфейс хэширования паролей.
+
+    Хэш хранится строкой в users.password_hash и начинается с имени
+    алгоритма, поэтому алгоритм и сложность можно менять без смены схемы.
+    """
+
+    algorithm = None
+
+    @abstractmethod
+    def hash(self, password):
+        """Хэш пароля для записи в базу"""
+
+    @abstractmethod
+    def verify(self, password, encoded):
+        """Совпадает ли пароль с хэшем encoded"""
+
+    def needs_rehash(self, encoded):
+        """Хэш создан другим алгоритмом или с другой сложностью"""
+        return not encoded.startswith(f"{self.algorithm}$")
+
+
+class LegacySha256Hasher(PasswordHasher):
+    """Старый формат: SHA-256 без соли. Только для проверки существующих хэшей"""
+
+    algorithm = "sha256"
+
+    def hash(self, password):
+        return hashlib.sha256(password.encode()).hexdigest()
+
+    def verify(self, password, encoded):
+        return hmac.compare_digest(self.hash(password), encoded)
+
+    def needs_rehash(self, encoded):
+        return True
+
+
+class Pbkdf2Hasher(PasswordHasher):
+    """PBKDF2-HMAC-SHA256 с солью на каждого пользователя.
+
+    iterations - рабочий коэффициент: чем больше, тем дороже каждый вход.
+    """
+
+    algorithm = "pbkdf2_sha256"
+
+    def __init__(self, iterations=200_000, salt_size=16):
+        self.iterations = iterations
+        self.salt_size = salt_size
+
+    @classmethod
+    def calibrate(cls, target_seconds=0.05, **kwargs):
+        """Подобрать число итераций под желаемую стоимость одного входа"""
+        probe = 10_000
+        start = time.perf_counter()
+        hashlib.pbkdf2_hmac("sha256", b"calibrate", b"salt" * 4, probe)
+        elapsed = max(time.perf_counter() - start, 1e-6)
+        return cls(iterations=max(probe, int(probe * target_seconds / elapsed)), **kwargs)
+
+    def _derive(self, password, salt, iterations):
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+
+    def hash(self, password):
+        salt = os.urandom(self.salt_size)
+        digest = self._derive(password, salt, self.iterations)
+        return f"{self.algorithm}${self.iterations}${salt.hex()}${digest.hex()}"
+
+    def verify(self, password, encoded):
+        try:
+            algorithm, iterations, salt, digest = encoded.split("$")
+            iterations = int(iterations)
+            salt = bytes.fromhex(salt)
+            digest = bytes.fromhex(digest)
+        except ValueError:
+            return False
+        if algorithm != self.algorithm:
+            return False
+        return hmac.compare_digest(self._derive(password, salt, iterations), digest)
+
+    def needs_rehash(self, encoded):
+        return not encoded.startswith(f"{self.algorithm}${self.iterations}$")
+
+
+class VerificationCache:
+    """Недавние успешные входы: повторная проверка пароля без затрат на KDF.
+
+    Пароль не хранится - только HMAC от него с ключом, который живет
+    в памяти процесса. Записи устаревают через ttl секунд.
+    """
+
+    def __init__(self, ttl=300, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._key = os.urandom(32)
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Статистика
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, username, password):
+        return hmac.new(self._key, f"{username}\0{password}".encode(), hashlib.sha256).digest()
+
+    def get(self, username, password):
+        """user_id, если пара логин/пароль недавно прошла проверку"""
+        digest = self._digest(username, password)
+        with self._lock:
+            entry = self._items.get(username)
+            if entry is not None:
+                cached_digest, user_id, expires = entry
+                if expires < time.monotonic():
+                    del self._items[username]
+                elif hmac.compare_digest(cached_digest, digest):
+                    self.hits += 1
+                    return user_id
+            self.misses += 1
+            return None
+
+    def put(self, username, password, user_id):
+        digest = self._digest(username, password)
+        with self._lock:
+            self._items[username] = (digest, user_id, time.monotonic() + self.ttl)
+            self._items.move_to_end(username)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def invalidate(self, username):
+        with self._lock:
+            self._items.pop(username, None)
+
+
+class GameDatabase:
+    def __init__(self, db_path="game_database.db", pool_size=4, cache_size=256, materialize_stats=False,
+                 hasher=None, auth_cache_ttl=300):
+        self.db_path = db_path
+        self.materialize_stats = materialize_stats
+        self.hasher = hasher or Pbkdf2Hasher()
+        self.legacy_hasher = LegacySha256Hasher()
+        self.auth_cache = VerificationCache(ttl=auth_cache_ttl)
+        # Хэш для проверки несуществующих имен: считается заранее, иначе
+        # первый такой вход выполнял бы два KDF и выдавал себя по времени
+        self._dummy_hash = self.hasher.hash("")
+        self.pool = ConnectionPool(db_path, size=pool_size)
+        self.progress_writer = ProgressWriter(self)
+        self.progress_cache = ProgressCache(max_users=cache_size)
+        self._closed = False
+        self.init_database()
+
+        # Гарантируем сохранение очереди прогресса при выходе
+        atexit.register(self.close)
+
+    def init_database(self):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    password_hash TEXT NOT NULL
+                )
+            ''')
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_progress (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    level_id INTEGER NOT NULL,
+                    unlocked BOOLEAN DEFAULT 0,
+                    best_score INTEGER DEFAULT 0,
+                    stars INTEGER DEFAULT 0,
+                    FOREIGN KEY (user_id) REFERENCES users (id),
+                    UNIQUE(user_id, level_id)
+                )
+            ''')
+
+            # Покрывающие индексы для таблиц рекордов и статистики
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_progress_level_score
+                ON user_progress (level_id, best_score, user_id, stars)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_progress_level_stars
+                ON user_progress (level_id, stars)
+            ''')
+
+            # Запись управления лучшего прохождения (InputLog) для проверки результата
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS progress_replays (
+                    user_id INTEGER NOT NULL,
+                    level_id INTEGER NOT NULL,
+                    score INTEGER NOT NULL,
+                    deaths INTEGER NOT NULL,
+                    time_taken REAL NOT NULL,
+                    replay BLOB NOT NULL,
+                    PRIMARY KEY (user_id, level_id),
+                    FOREIGN KEY (user_id) REFERENCES users (id)
+                )
+            ''')
+
+            if self.materialize_stats:
+                self._init_stats_tables(cursor)
+
+            conn.commit()
+
+    def _init_stats_tables(self, cursor):
+        """Материализованные агрегаты, которые триггеры обновляют при записи"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_totals'")
+        existed = cursor.fetchone() is not None
+
+        cursor.executescript('''
+            CREATE TABLE IF NOT EXISTS user_totals (
+                user_id INTEGER PRIMARY KEY,
+                total_score INTEGER NOT NULL DEFAULT 0,
+                total_stars INTEGER NOT NULL DEFAULT 0,
+                levels_completed INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_user_totals_score
+                ON user_totals (total_score, user_id);
+
+            CREATE TABLE IF NOT EXISTS level_star_counts (
+                level_id INTEGER NOT NULL,
+                stars INTEGER NOT NULL,
+                players INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (level_id, stars)
+            );
+
+            CREATE TRIGGER IF NOT EXISTS trg_progress_stats_insert
+            AFTER INSERT ON user_progress BEGIN
+                INSERT INTO user_totals (user_id, total_score, total_stars, levels_completed)
+                VALUES (NEW.user_id, NEW.best_score, NEW.stars, NEW.best_score > 0)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    total_score = total_score + excluded.total_score,
+                    total_stars = total_stars + excluded.total_stars,
+                    levels_completed = levels_completed + excluded.levels_completed;
+                INSERT INTO level_star_counts (level_id, stars, players)
+                VALUES (NEW.level_id, NEW.stars, 1)
+                ON CONFLICT(level_id, stars) DO UPDATE SET players = players + 1;
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS trg_progress_stats_update
+            AFTER UPDATE OF best_score, stars ON user_progress BEGIN
+                UPDATE user_totals SET
+                    total_score = total_score + NEW.best_score - OLD.best_score,
+                    total_stars = total_stars + NEW.stars - OLD.stars,
+                    levels_completed = levels_completed + (NEW.best_score > 0) - (OLD.best_score > 0)
+                WHERE user_id = NEW.user_id;
+                UPDATE level_star_counts SET players = players - 1
+                WHERE level_id = OLD.level_id AND stars = OLD.stars AND OLD.stars != NEW.stars;
+                INSERT INTO level_star_counts (level_id, stars, players)
+                SELECT NEW.level_id, NEW.stars, 1 WHERE OLD.stars != NEW.stars
+                ON CONFLICT(level_id, stars) DO UPDATE SET players = players + 1;
+            END;
+
+            -- Игрок без строк прогресса убирается из user_totals, как и из
+            -- подсчета по user_progress (пересоздается, чтобы обновить старые базы)
+            DROP TRIGGER IF EXISTS trg_progress_stats_delete;
+            CREATE TRIGGER trg_progress_stats_delete
+            AFTER DELETE ON user_progress BEGIN
+                UPDATE user_totals SET
+                    total_score = total_score - OLD.best_score,
+                    total_stars = total_stars - OLD.stars,
+                    levels_completed = levels_completed - (OLD.best_score > 0)
+                WHERE user_id = OLD.user_id;
+                DELETE FROM user_totals
+                WHERE user_id = OLD.user_id
+                  AND NOT EXISTS (SELECT 1 FROM user_progress WHERE user_id = OLD.user_id);
+                UPDATE level_star_counts SET players = players - 1
+                WHERE level_id = OLD.level_id AND stars = OLD.stars;
+            END;
+        ''')
+
+        # Агрегаты созданы впервые - заполняем по уже существующим данным
+        if not existed:
+            self._rebuild_stats(cursor)
+
+    def _rebuild_stats(self, cursor):
+        cursor.execute('DELETE FROM user_totals')
+        cursor.execute('''
+            INSERT INTO user_totals (user_id, total_score, total_stars, levels_completed)
+            SELECT user_id, SUM(best_score), SUM(stars), SUM(best_score > 0)
+            FROM user_progress GROUP BY user_id
+        ''')
+        cursor.execute('DELETE FROM level_star_counts')
+        cursor.execute('''
+            INSERT INTO level_star_counts (level_id, stars, players)
+            SELECT level_id, stars, COUNT(*) FROM user_progress GROUP BY level_id, stars
+        ''')
+
+    def rebuild_stats(self):
+        """Пересчитать материализованные агрегаты целиком"""
+        with self.pool.connection() as conn:
+            self._rebuild_stats(conn.cursor())
+            conn.commit()
+
+    def close(self):
+        """Сохранить отложенный прогресс и закрыть все соединения пула"""
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        self.progress_writer.close()
+        self.pool.close()
+
+    def hash_password(self, password):
+        return self.hasher.hash(password)
+
+    def verify_password(self, password, encoded):
+        # Хэши без префикса алгоритма созданы старой версией (SHA-256 без соли)
+        if "$" not in encoded:
+            return self.legacy_hasher.verify(password, encoded)
+        return self.hasher.verify(password, encoded)
+
+    def authenticate_user(self, username, password):
+        user_id = self.auth_cache.get(username, password)
+        if user_id is not None:
+            return True, user_id, "Вход выполнен успешно!"
+
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT id, password_hash FROM users WHERE username = ?',
+                (username,)
+            )
+            user = cursor.fetchone()
+
+            if user is None:
+                # Тратим то же время, что и на настоящую проверку,
+                # чтобы по задержке нельзя было узнать о существовании имени
+                self.hasher.verify(password, self._dummy_hash)
+                return False, None, "Неверное имя пользователя или пароль"
+
+            user_id, password_hash = user
+            if not self.verify_password(password, password_hash):
+                return False, None, "Неверное имя пользователя или пароль"
+
+            # Переводим старые и устаревшие хэши на текущие настройки
+            if self.hasher.needs_rehash(password_hash):
+                cursor.execute(
+                    'UPDATE users SET password_hash = ? WHERE id = ?',
+                    (self.hash_password(password), user_id)
+                )
+                conn.commit()
+
+        self.auth_cache.put(username, password, user_id)
+        return True, user_id, "Вход выполнен успешно!"
+
+    def create_user(self, username, password):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+
+            try:
+                # Проверяем существование пользователя
+                cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
+                if cursor.fetchone():
+                    return False, None, "Пользователь с таким именем уже существует!"
+
+                password_hash = self.hash_password(password)
+                cursor.execute(
+                    'INSERT INTO users (username, password_hash) VALUES (?, ?)',
+                    (username, password_hash)
+                )
+                user_id = cursor.lastrowid
+
+                # Создаем прогресс для уровней (открыт только первый)
+                level_ids = LEVEL_REGISTRY.level_ids()
+                cursor.executemany(
+                    'INSERT INTO user_progress (user_id, level_id, unlocked) VALUES (?, ?, ?)',
+                    [(user_id, level_id, int(level_id == level_ids[0])) for level_id in level_ids]
+                )
+
+                conn.commit()
+                return True, user_id, "Пользователь создан успешно!"
+            except Exception as e:
+                conn.rollback()
+                return False, None, f"Ошибка: {str(e)}"
+
+    def get_user_progress(self, user_id):
+        # Результаты из очереди записи берем до чтения базы: запись, которая
+        # сохранится за это время, уже будет в выборке
+        pending = self.progress_writer.pending(user_id)
+
+        progress = self.progress_cache.get(user_id)
+        if progress is None:
+            progress = self._read_user_progress(user_id)
+        if pending:
+            progress = self._merge_pending(progress, pending)
+        return progress
+
+    def _read_user_progress(self, user_id):
+        epoch = self.progress_cache.epoch
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute('''
+                SELECT level_id, unlocked, best_score, stars 
+                FROM user_progress 
+                WHERE user_id = ? ORDER BY level_id
+            ''', (user_id,))
+            rows = cursor.fetchall()
+
+            progress = {}
+            for row in rows:
+                level_id, unlocked, best_score, stars = row
+                progress[level_id] = {
+                    'unlocked': bool(unlocked),
+                    'best_score': best_score,
+                    'stars': stars,
+                    'name': f"Уровень {level_id}"
+                }
+
+            # Запись открывает следующий уровень только при новом рекорде. Если
+            # уровень появился на диске позже рекорда, он открывается здесь
+            level_ids = LEVEL_REGISTRY.level_ids()
+            locked = [
+                next_level for level_id, next_level in zip(level_ids, level_ids[1:])
+                if level_id in progress and progress[level_id]['best_score'] >= 30
+                and not progress.get(next_level, {}).get('unlocked')
+            ]
+            if locked:
+                cursor.executemany('''
+                    INSERT INTO user_progress (user_id, level_id, unlocked) VALUES (?, ?, 1)
+                    ON CONFLICT(user_id, level_id) DO UPDATE SET unlocked = 1
+                ''', [(user_id, level_id) for level_id in locked])
+                conn.commit()
+                for level_id in locked:
+                    progress.setdefault(level_id, {
+                        'unlocked': True, 'best_score': 0, 'stars': 0, 'name': f"Уровень {level_id}"
+                    })['unlocked'] = True
+                progress = dict(sorted(progress.items()))
+
+        self.progress_cache.put(user_id, progress, epoch)
+        return progress
+
+    def _merge_pending(self, progress, records):
+        """Прогресс с еще не сохраненными результатами - по тем же правилам, что и _write_progress"""
+        progress = {level_id: dict(level) for level_id, level in progress.items()}
+        for _, level_id, score, deaths, time_taken, _ in records:
+            level = progress.setdefault(level_id, {
+                'unlocked': True, 'best_score': 0, 'stars': 0, 'name': f"Уровень {level_id}"
+            })
+            level['unlocked'] = True
+            level['best_score'] = max(level['best_score'], score)
+            level['stars'] = max(level['stars'], self.calculate_stars(score, deaths, time_taken))
+
+            next_level = next((other for other in LEVEL_REGISTRY.level_ids() if other > level_id), None)
+            if level['best_score'] >= 30 and next_level is not None:
+                progress.setdefault(next_level, {
+                    'unlocked': True, 'best_score': 0, 'stars': 0, 'name': f"Уровень {next_level}"
+                })['unlocked'] = True
+        return dict(sorted(progress.items()))
+
+    def update_progress(self, user_id, level_id, score, deaths, time_taken=999, replay=None):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            self._write_progress(cursor, user_id, level_id, score, deaths, time_taken, replay)
+            conn.commit()
+            self.progress_cache.invalidate(user_id)
+
+            cursor.execute(
+                'SELECT stars FROM user_progress WHERE user_id = ? AND level_id = ?',
+                (user_id, level_id)
+            )
+            return cursor.fetchone()[0]
+
+    def update_progress_async(self, user_id, level_id, score, deaths, time_taken=999, replay=None):
+        """Сохранить прогресс в фоне, не блокируя игровой цикл"""
+        self.progress_writer.submit(user_id, level_id, score, deaths, time_taken, replay)
+
+    def write_progress_batch(self, records):
+        """Сохранить несколько результатов одной транзакцией"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for record in records:
+                self._write_progress(cursor, *record)
+            conn.commit()
+        self.progress_cache.invalidate(*{record[0] for record in records})
+
+    def _write_progress(self, cursor, user_id, level_id, score, deaths, time_taken, replay=None):
+        stars = self.calculate_stars(score, deaths, time_taken)
+
+        # Лучший счет и лучшие звезды выбираются в SQL одним выражением.
+        # Прохождение без улучшения строку не меняет (rowcount = 0)
+        cursor.execute('''
+            INSERT INTO user_progress (user_id, level_id, unlocked, best_score, stars)
+            VALUES (?, ?, 1, ?, ?)
+            ON CONFLICT(user_id, level_id) DO UPDATE SET
+                best_score = MAX(best_score, excluded.best_score),
+                stars = MAX(stars, excluded.stars)
+            WHERE excluded.best_score > best_score OR excluded.stars > stars
+        ''', (user_id, level_id, score, stars))
+
+        # Разблокируем следующий уровень, когда рекорд впервые достигает 30:
+        # рекорд меняется только вместе со строкой, поэтому повторы уровня
+        # и прохождения без улучшения этот запрос не выполняют
+        if cursor.rowcount > 0 and score >= 30:
+            next_level = next((other for other in LEVEL_REGISTRY.level_ids() if other > level_id), None)
+            if next_level is not None:  # Только если есть следующий уровень
+                cursor.execute('''
+                    INSERT INTO user_progress (user_id, level_id, unlocked) VALUES (?, ?, 1)
+                    ON CONFLICT(user_id, level_id) DO UPDATE SET unlocked = 1 WHERE NOT unlocked
+                ''', (user_id, next_level))
+
+        # Храним запись только лучшего прохождения (больше очков или быстрее)
+        if replay is not None:
+            cursor.execute('''
+                INSERT INTO progress_replays (user_id, level_id, score, deaths, time_taken, replay)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(user_id, level_id) DO UPDATE SET
+                    score = excluded.score, deaths = excluded.deaths,
+                    time_taken = excluded.time_taken, replay = excluded.replay
+                WHERE excluded.score > score OR (excluded.score = score AND excluded.time_taken < time_taken)
+            ''', (user_id, level_id, score, deaths, time_taken, replay))
+
+    def get_replay(self, user_id, level_id):
+        """(очки, смерти, время, запись InputLog) лучшего прохождения или None"""
+        with self.pool.connection() as conn:
+            return conn.execute(
+                'SELECT score, deaths, time_taken, replay FROM progress_replays WHERE user_id = ? AND level_id = ?',
+                (user_id, level_id)
+            ).fetchone()
+
+    def verify_replay(self, user_id, level_id):
+        """Повторить сохраненное прохождение и сверить заявленный результат"""
+        self.progress_writer.flush()
+        row = self.get_replay(user_id, level_id)
+        if row is None:
+            return False, None, "Запись прохождения не найдена"
+
+        score, deaths, time_taken, data = row
+        try:
+            log = InputLog.from_bytes(data)
+        except ValueError as e:
+            return False, None, f"Запись повреждена: {e}"
+        if log.level_id != level_id:
+            return False, None, "Запись сделана на другом уровне"
+
+        try:
+            result = log.replay()
+        except Exception as e:
+            return False, None, f"Ошибка повтора прохождения: {e}"
+
+        if not result["complete"]:
+            return False, result, "Уровень в записи не пройден"
+        if result["score"] != score or result["deaths"] != deaths \
+                or abs(result["time"] - time_taken) > 0.5 / log.tick_rate:
+            return False, result, "Результат не совпадает с записью"
+        return True, result, "Результат подтвержден"
+
+    @staticmethod
+    def calculate_stars(score, deaths, time_taken):
+        """Расчет звезд по стандартным правилам"""
+        stars = 0
+
+        # Звезда 1: собрано 50% предметов (макс 50 очков)
+        if score >= 25:  # 50% от 50
+            stars += 1
+        # Звезда 2: собрано 75% предметов
+        if score >= 38:  # 75% от 50
+            stars += 1
+        # Звезда 3: собраны все предметы
+        if score >= 50:  # 100% от 50
+            stars += 1
+        # Звезда 4: прохождение без смертей
+        if deaths == 0:
+            stars += 1
+        # Звезда 5: быстрое прохождение (< 60 секунд)
+        if time_taken < 60:
+            stars += 1
+
+        return min(stars, 5)
+
+    def get_leaderboard(self, level_id, limit=10, after=None):
+        """Лучшие результаты уровня с постраничной выдачей по ключу.
+
+        after - курсор (best_score, user_id) последней строки предыдущей
+        страницы. Возвращает (строки, курсор следующей страницы или None).
+        """
+        self.progress_writer.flush()
+
+        query = '''
+            SELECT p.user_id, u.username, p.best_score, p.stars
+            FROM user_progress AS p
+            JOIN users AS u ON u.id = p.user_id
+            WHERE p.level_id = ?
+        '''
+        params = [level_id]
+        if after is not None:
+            query += ' AND (p.best_score, p.user_id) < (?, ?)'
+            params.extend(after)
+        query += ' ORDER BY p.best_score DESC, p.user_id DESC LIMIT ?'
+        params.append(limit)
+
+        with self.pool.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        leaderboard = [
+            {'user_id': user_id, 'username': username, 'best_score': best_score, 'stars': stars}
+            for user_id, username, best_score, stars in rows
+        ]
+        next_cursor = None
+        if len(rows) == limit:
+            next_cursor = (rows[-1][2], rows[-1][0])
+        return leaderboard, next_cursor
+
+    def get_star_distribution(self, level_id):
+        """Сколько игроков получили на уровне 0..5 звезд"""
+        self.progress_writer.flush()
+
+        if self.materialize_stats:
+            query = 'SELECT stars, players FROM level_star_counts WHERE level_id = ? AND players > 0'
+        else:
+            query = 'SELECT stars, COUNT(*) FROM user_progress WHERE level_id = ? GROUP BY stars'
+
+        distribution = dict.fromkeys(range(6), 0)
+        with self.pool.connection() as conn:
+            for stars, players in conn.execute(query, (level_id,)):
+                distribution[stars] = players
+        return distribution
+
+    def get_user_totals(self, user_id):
+        """Сумма очков и звезд игрока по всем уровням"""
+        self.progress_writer.flush()
+
+        if self.materialize_stats:
+            query = '''
+                SELECT total_score, total_stars, levels_completed
+                FROM user_totals WHERE user_id = ?
+            '''
+        else:
+            query = '''
+                SELECT SUM(best_score), SUM(stars), SUM(best_score > 0)
+                FROM user_progress WHERE user_id = ?
+            '''
+
+        with self.pool.connection() as conn:
+            row = conn.execute(query, (user_id,)).fetchone()
+
+        total_score, total_stars, levels_completed = row if row else (None, None, None)
+        return {
+            'total_score': total_score or 0,
+            'total_stars': total_stars or 0,
+            'levels_completed': levels_completed or 0
+        }
+
+    def get_top_players(self, limit=10, after=None):
+        """Рейтинг игроков по сумме очков, постранично по ключу (total_score, user_id)"""
+        self.progress_writer.flush()
+
+        if self.materialize_stats:
+            source = 'user_totals'
+        else:
+            source = '''(
+                SELECT user_id, SUM(best_score) AS total_score, SUM(stars) AS total_stars
+                FROM user_progress GROUP BY user_id
+            )'''
+
+        query = f'''
+            SELECT t.user_id, u.username, t.total_score, t.total_stars
+            FROM {source} AS t
+            JOIN users AS u ON u.id = t.user_id
+        '''
+        params = []
+        if after is not None:
+            query += ' WHERE (t.total_score, t.user_id) < (?, ?)'
+            params.extend(after)
+        query += ' ORDER BY t.total_score DESC, t.user_id DESC LIMIT ?'
+        params.append(limit)
+
+        with self.pool.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        players = [
+            {'user_id': user_id, 'username': username, 'total_score': total_score, 'total_stars': total_stars}
+            for user_id, username, total_score, total_stars in rows
+        ]
+        next_cursor = None
+        if len(rows) == limit:
+            next_cursor = (rows[-1][2], rows[-1][0])
+        return players, next_cursor
+
+
+# ============================================================================
+# КОМПИЛЯЦИЯ УРОВНЕЙ
+# ============================================================================
+
+class LevelCompileError(Exception):
+    """Карта использует возможности Tiled, которые компилятор не поддерживает"""
+
+
+# Старшие биты GID в Tiled - флаги отражения тайла
+GID_FLIPPED_HORIZONTALLY = 0x80000000
+GID_FLIPPED_VERTICALLY = 0x40000000
+GID_FLIPPED_DIAGONALLY = 0x20000000
+GID_MASK = 0x0FFFFFFF
+
+
+def _decode_layer_data(data_node, count):
+    """GID слоя из узла <data> (csv или base64 с zlib/gzip)"""
+    encoding = data_node.get("encoding")
+    compression = data_node.get("compression")
+    text = (data_node.text or "").strip()
+
+    if encoding == "csv":
+        gids = array("I", (int(value) for value in text.replace("\n", "").split(",") if value))
+    elif encoding == "base64":
+        raw = base64.b64decode(text)
+        if compression == "zlib":
+            raw = zlib.decompress(raw)
+        elif compression == "gzip":
+            raw = gzip.decompress(raw)
+        elif compression:
+            raise LevelCompileError(f"Сжатие {compression} не поддерживается")
+        gids = array("I")
+        gids.frombytes(raw)
+        if sys.byteorder != "little":
+            gids.byteswap()
+    else:
+        raise LevelCompileError(f"Кодировка слоя {encoding} не поддерживается")
+
+    if len(gids) != count:
+        raise LevelCompileError(f"В слое {len(gids)} тайлов вместо {count}")
+    return gids
+
+
+def _read_tileset(node, base_dir, dependencies, tile_nodes=None):
+    """Описание тайлсета: {локальный id: (путь к картинке, x, y, ширина, высота)}
+
+    Если передан словарь tile_nodes, в него складываются элементы <tile> по
+    локальным id - со свойствами, формами и анимациями (нужно build_atlas).
+    Игра их не читает, поэтому без tile_nodes анимации и формы - ошибка.
+    """
+    source = node.get("source")
+    if source:
+        tsx_path = os.path.normpath(os.path.join(base_dir, source))
+        dependencies.append(tsx_path)
+        # Нет файла тайлсета или он не читается - карту нельзя скомпилировать
+        try:
+            node = ElementTree.parse(tsx_path).getroot()
+        except (OSError, ElementTree.ParseError) as e:
+            raise LevelCompileError(f"Не удалось прочитать тайлсет {source}: {e}") from e
+        base_dir = os.path.dirname(tsx_path)
+
+    tiles = {}
+    tile_width = int(node.get("tilewidth"))
+    tile_height = int(node.get("tileheight"))
+
+    for tile in node.findall("tile"):
+        if tile_nodes is not None:
+            tile_nodes[int(tile.get("id"))] = tile
+        elif tile.find("animation") is not None or tile.find("objectgroup") is not None:
+            raise LevelCompileError("Анимации и формы столкновений тайлов не поддерживаются")
+        image = tile.find("image")
+        if image is not None:
+            # Тайлсет-коллекция: у каждого тайла своя картинка
+            tiles[int(tile.get("id"))] = (
+                os.path.normpath(os.path.join(base_dir, image.get("source"))),
+                0, 0, int(image.get("width")), int(image.get("height"))
+            )
+
+    image = node.find("image")
+    if image is not None:
+        image_path = os.path.normpath(os.path.join(base_dir, image.get("source")))
+        columns = int(node.get("columns"))
+        margin = int(node.get("margin", 0))
+        spacing = int(node.get("spacing", 0))
+        for tile_id in range(int(node.get("tilecount"))):
+            row, col = divmod(tile_id, columns)
+            tiles[tile_id] = (
+                image_path,
+                margin + col * (tile_width + spacing),
+                margin + row * (tile_height + spacing),
+                tile_width, tile_height
+            )
+
+    return tiles
+
+
+def _write_str(out, value):
+    data = value.encode("utf-8")
+    out += struct.pack("<H", len(data))
+    out += data
+
+
+def _read_str(buffer, offset):
+    (length,) = struct.unpack_from("<H", buffer, offset)
+    offset += 2
+    return bytes(buffer[offset:offset + length]).decode("utf-8"), offset + length
+
+
+class CompiledLevel:
+    """Уровень Tiled, заранее разобранный в компактный двоичный кэш.
+
+    Формат файла (little-endian):
+        заголовок, список файлов-источников (путь, mtime, размер),
+        таблица картинок, таблица текстур (GID -> картинка + прямоугольник),
+        слои (имя, видимость, массив uint32 GID ширина x высота).
+
+    Кэш действителен, пока у TMX и TSX не изменились mtime и размер, либо
+    совпадает SHA-1 их содержимого. Загрузка - это mmap файла и создание
+    спрайтов, без разбора XML.
+    """
+
+    MAGIC = b"JJLV"
+    VERSION = 1
+    HEADER = struct.Struct("<4sH20sIIHHHHHH")
+
+    def __init__(self, tmx_path, buffer, mapping=None):
+        self.tmx_path = tmx_path
+        self._mapping = mapping
+
+        (magic, version, self.digest, self.width, self.height, self.tile_width, self.tile_height,
+         dep_count, path_count, texture_count, layer_count) = self.HEADER.unpack_from(buffer, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise LevelCompileError("Неизвестный формат кэша уровня")
+
+        base_dir = os.path.dirname(os.path.abspath(tmx_path))
+        offset = self.HEADER.size
+
+        self.dependencies = []
+        for _ in range(dep_count):
+            path, offset = _read_str(buffer, offset)
+            mtime_ns, size = struct.unpack_from("<QQ", buffer, offset)
+            offset += 16
+            self.dependencies.append((os.path.join(base_dir, path), mtime_ns, size))
+
+        images = []
+        for _ in range(path_count):
+            path, offset = _read_str(buffer, offset)
+            images.append(os.path.join(base_dir, path))
+
+        # Индекс текстур: GID -> (картинка, x, y, ширина, высота)
+        self.textures = {}
+        for _ in range(texture_count):
+            gid, image_index, x, y, w, h = struct.unpack_from("<IHHHHH", buffer, offset)
+            offset += 14
+            self.textures[gid] = (images[image_index], x, y, w, h)
+
+        self.layers = []
+        view = memoryview(buffer)
+        cell_count = self.width * self.height
+        for _ in range(layer_count):
+            name, offset = _read_str(buffer, offset)
+            (visible,) = struct.unpack_from("<B", buffer, offset)
+            offset += 1
+            offset += -offset % 4
+            gids = view[offset:offset + cell_count * 4].cast("I")
+            offset += cell_count * 4
+            self.layers.append((name, bool(visible), gids))
+
+    @staticmethod
+    def cache_path(tmx_path, cache_dir=None):
+        cache_dir = cache_dir or LEVEL_CACHE_DIR
+        name = os.path.splitext(os.path.basename(tmx_path))[0]
+        key = hashlib.sha1(os.path.abspath(tmx_path).encode("utf-8")).hexdigest()[:12]
+        return os.path.join(cache_dir, f"{name}-{key}.bin")
+
+    @staticmethod
+    def _digest(paths):
+        digest = hashlib.sha1()
+        for path in paths:
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        return digest.digest()
+
+    @classmethod
+    def compile(cls, tmx_path):
+        """Разобрать TMX и вернуть содержимое файла кэша"""
+        root = ElementTree.parse(tmx_path).getroot()
+        if root.get("orientation") != "orthogonal" or root.get("infinite") == "1":
+            raise LevelCompileError("Поддерживаются только конечные ортогональные карты")
+        if root.find("imagelayer") is not None or root.find("group") is not None:
+            raise LevelCompileError("Слои-картинки и группы слоев не поддерживаются")
+
+        base_dir = os.path.dirname(os.path.abspath(tmx_path))
+        width, height = int(root.get("width")), int(root.get("height"))
+        dependencies = [os.path.abspath(tmx_path)]
+
+        tilesets = []
+        for node in root.findall("tileset"):
+            tilesets.append((int(node.get("firstgid")), _read_tileset(node, base_dir, dependencies)))
+        tilesets.sort(reverse=True)
+
+        layers = []
+        used_gids = set()
+        for node in root.findall("layer"):
+            if any(node.get(attr) not in (None, "0", "1") for attr in ("offsetx", "offsety", "opacity")) \
+                    or node.get("tintcolor"):
+                raise LevelCompileError(f"Смещение, прозрачность и тон слоя {node.get('name')} не поддерживаются")
+            gids = _decode_layer_data(node.find("data"), width * height)
+            used_gids.update(gids)
+            layers.append((node.get("name"), node.get("visible", "1") != "0", gids))
+        used_gids.discard(0)
+
+        images = []
+        textures = []
+        for raw_gid in sorted(used_gids):
+            gid = raw_gid & GID_MASK
+            for firstgid, tiles in tilesets:
+                if gid >= firstgid:
+                    tile = tiles.get(gid - firstgid)
+                    break
+            else:
+                tile = None
+            if tile is None:
+                raise LevelCompileError(f"Не найден тайл для GID {gid}")
+            image, x, y, w, h = tile
+            if image not in images:
+                images.append(image)
+            textures.append((raw_gid, images.index(image), x, y, w, h))
+
+        def relative(path):
+            return os.path.relpath(path, base_dir)
+
+        out = bytearray(cls.HEADER.pack(
+            cls.MAGIC, cls.VERSION, cls._digest(dependencies), width, height,
+            int(root.get("tilewidth")), int(root.get("tileheight")),
+            len(dependencies), len(images), len(textures), len(layers)
+        ))
+        for path in dependencies:
+            stat = os.stat(path)
+            _write_str(out, relative(path))
+            out += struct.pack("<QQ", stat.st_mtime_ns, stat.st_size)
+        for image in images:
+            _write_str(out, relative(image))
+        for texture in textures:
+            out += struct.pack("<IHHHHH", *texture)
+        for name, visible, gids in layers:
+            _write_str(out, name)
+            out += struct.pack("<B", visible)
+            out += bytes(-len(out) % 4)
+            if sys.byteorder != "little":
+                gids.byteswap()
+            out += gids.tobytes()
+        return bytes(out)
+
+    @classmethod
+    def load(cls, tmx_path, cache_dir=None):
+        """Загрузить уровень из кэша, при необходимости перекомпилировав"""
+        cache_path = cls.cache_path(tmx_path, cache_dir)
+
+        if os.path.exists(cache_path):
+            try:
+                level = cls._open(tmx_path, cache_path)
+                if level.is_fresh():
+                    return level
+                level.close()
+            except (OSError, ValueError, struct.error, LevelCompileError):
+                pass
+
+        data = cls.compile(tmx_path)
+        tmp_path = None
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            # Свой временный файл у каждого потока и процесса: уровень может
+            # компилироваться одновременно в фоне (preload) и в главном потоке
+            fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(cache_path) + ".",
+                                            suffix=".tmp", dir=os.path.dirname(cache_path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Не удалось сохранить кэш уровня: {e}")
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+        return cls(tmx_path, data)
+
+    @classmethod
+    def _open(cls, tmx_path, cache_path):
+        with open(cache_path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls(tmx_path, mapping, mapping)
+        except Exception:
+            mapping.close()
+            raise
+
+    def is_fresh(self):
+        """Источники не менялись: сначала сверяем mtime и размер, затем хэш"""
+        try:
+            if all(os.stat(path).st_mtime_ns == mtime_ns and os.stat(path).st_size == size
+                   for path, mtime_ns, size in self.dependencies):
+                return True
+            return self._digest([path for path, _, _ in self.dependencies]) == self.digest
+        except OSError:
+            return False
+
+    def close(self):
+        self.layers = []
+        if self._mapping is not None:
+            self._mapping.close()
+            self._mapping = None
+
+    def load_texture(self, raw_gid, texture_manager):
+        image, x, y, w, h = self.textures[raw_gid]
+        texture = texture_manager.load_or_get_texture(image, x=x, y=y, width=w, height=h)
+        # Тот же порядок отражений, что и в arcade.load_tilemap
+        if raw_gid & GID_FLIPPED_DIAGONALLY:
+            texture = texture.flip_diagonally()
+        if raw_gid & GID_FLIPPED_HORIZONTALLY:
+            texture = texture.flip_horizontally()
+        if raw_gid & GID_FLIPPED_VERTICALLY:
+            texture = texture.flip_vertically()
+        return texture
+
+    def build_sprite_lists(self, scaling=1.0, layer_options=None, texture_manager=None, lazy=False):
+        """Создать списки спрайтов слоев (в порядке слоев карты)"""
+        layer_options = layer_options or {}
+        texture_manager = texture_manager or arcade.TextureCacheManager()
+        textures = {}
+
+        cell_w = self.tile_width * scaling
+        cell_h = self.tile_height * scaling
+
+        sprite_lists = {}
+        for name, visible, gids in self.layers:
+            options = layer_options.get(name, {})
+            layer_scaling = options.get("scaling", scaling)
+            sprite_list = arcade.SpriteList(use_spatial_hash=options.get("use_spatial_hash", False), lazy=lazy)
+            sprite_list.visible = visible
+
+            for index, raw_gid in enumerate(gids):
+                if not raw_gid:
+                    continue
+                entry = textures.get((raw_gid, layer_scaling))
+                if entry is None:
+                    texture = self.load_texture(raw_gid, texture_manager)
+                    entry = textures[raw_gid, layer_scaling] = (
+                        texture, texture.width * layer_scaling / 2, texture.height * layer_scaling / 2
+                    )
+                texture, half_w, half_h = entry
+
+                row, col = divmod(index, self.width)
+                sprite_list.append(arcade.Sprite(
+                    texture, layer_scaling,
+                    col * cell_w + half_w,
+                    (self.height - row - 1) * cell_h + half_h
+                ))
+
+            sprite_lists[name] = sprite_list
+        return sprite_lists
+
+
+def load_level_sprite_lists(file_path, scaling, layer_options, lazy=False, cache_dir=None):
+    """Списки спрайтов уровня: из скомпилированного кэша или через arcade.load_tilemap"""
+    try:
+        level = CompiledLevel.load(file_path, cache_dir)
+        try:
+            return level.build_sprite_lists(scaling, layer_options, lazy=lazy)
+        finally:
+            level.close()
+    except LevelCompileError as e:
+        print(f"Уровень загружается без кэша: {e}")
+
+    tile_map = arcade.load_tilemap(file_path, scaling=scaling, layer_options=layer_options, lazy=lazy)
+    return tile_map.sprite_lists
+
+
+class _CachedImage:
+    __slots__ = ("image", "size", "refs", "textures")
+
+    def __init__(self, image):
+        self.image = image
+        self.size = image.width * image.height * 4
+        self.refs = 0
+        self.textures = {}  # (x, y, ширина, высота, алгоритм рамки) -> arcade.Texture
+
+
+class TextureCache:
+    """Картинки и текстуры, общие для всей игры.
+
+    load_or_get_texture повторяет arcade.TextureCacheManager, поэтому кэш
+    подходит и для CompiledLevel, и для arcade.TileMap. Каждая картинка
+    раскодируется один раз, фрагменты тайлсетов вырезаются из нее и тоже
+    запоминаются - повторный вход в уровень берет готовые текстуры, а
+    атлас окна их уже содержит. acquire/release считают, сколько уровней
+    используют картинку: занятые картинки не вытесняются, свободные
+    вытесняются по давности использования, когда их больше budget_mb.
+
+    budget_mb считает раскодированные картинки в памяти. Текстуры в атласе
+    окна убираются при release: атлас держит их слабыми ссылками, а место
+    освобождает только при перестройке.
+    """
+
+    def __init__(self, budget_mb=TEXTURE_CACHE_MB):
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.decodes = 0
+        self.evictions = 0
+        self._images = OrderedDict()  # путь -> _CachedImage, от давно использованных к недавним
+        self._paths = {}  # путь как его передали -> путь на диске
+        self._bytes = 0
+        self._stale = 0  # Текстуры вытесненных картинок, которые еще могут быть в атласе
+        self._lock = threading.RLock()  # Уровни готовятся и в фоновом потоке
+
+    def _real_path(self, file_path):
+        key = self._paths.get(file_path)
+        if key is None:
+            key = self._paths[file_path] = str(arcade.resources.resolve(file_path))
+        return key
+
+    def _image(self, key):
+        cached = self._images.get(key)
+        if cached is None:
+            image = Image.open(key)
+            if image.mode != "RGBA":
+                image = image.convert("RGBA")
+            image.load()
+            cached = self._images[key] = _CachedImage(image)
+            self._bytes += cached.size
+            self.decodes += 1
+            self._evict(keep=key)
+        else:
+            self._images.move_to_end(key)
+        return cached
+
+    def load_or_get_texture(self, file_path, *, x=0, y=0, width=0, height=0, hit_box_algorithm=None):
+        with self._lock:
+            key = self._real_path(file_path)
+            cached = self._image(key)
+            crop = (x, y, width, height, hit_box_algorithm)
+            texture = cached.textures.get(crop)
+            if texture is not None:
+                self.hits += 1
+                return texture
+
+            self.misses += 1
+            image = cached.image
+            if width or height:
+                image = image.crop((x, y, x + (width or image.width - x), y + (height or image.height - y)))
+            texture = arcade.Texture(image, hit_box_algorithm=hit_box_algorithm)
+            texture.file_path = key
+            cached.textures[crop] = texture
+            return texture
+
+    def preload(self, file_paths):
+        """Раскодировать картинки заранее; вернуть, сколько нашлось"""
+        loaded = 0
+        with self._lock:
+            for file_path in file_paths:
+                try:
+                    self._image(self._real_path(file_path))
+                    loaded += 1
+                except (FileNotFoundError, OSError):
+                    pass  # Нет файла - будет запасная текстура
+        return loaded
+
+    def paths_of(self, sprite_lists):
+        """Картинки из кэша, текстуры которых есть у спрайтов"""
+        paths = set()
+        with self._lock:
+            for sprite_list in sprite_lists:
+                for sprite in sprite_list:
+                    path = sprite.texture.file_path
+                    if path is not None and str(path) in self._images:
+                        paths.add(str(path))
+        return paths
+
+    def acquire(self, paths):
+        with self._lock:
+            for path in paths:
+                if path in self._images:
+                    self._images[path].refs += 1
+
+    def release(self, paths):
+        with self._lock:
+            for path in paths:
+                cached = self._images.get(path)
+                if cached is not None and cached.refs > 0:
+                    cached.refs -= 1
+            self._evict()
+            stale = self._stale
+            self._stale = 0
+        if stale:
+            self._compact_atlas()
+
+    def _evict(self, keep=None):
+        if self._bytes <= self.budget:
+            return
+        for key in [key for key, cached in self._images.items() if not cached.refs and key != keep]:
+            cached = self._images.pop(key)
+            self._bytes -= cached.size
+            self.evictions += 1
+            self._stale += len(cached.textures)
+            if self._bytes <= self.budget:
+                break
+
+    @staticmethod
+    def _compact_atlas():
+        """Убрать вытесненные текстуры из атласа окна.
+
+        Texture и спрайты связаны циклическими ссылками, поэтому без сборки
+        мусора атлас не узнает, что текстура больше не нужна. Перестройка
+        заново раскладывает оставшиеся текстуры и возвращает место.
+        Вызывается только из главного потока: там живет контекст OpenGL.
+        """
+        gc.collect()
+        try:
+            atlas = arcade.get_window().ctx.default_atlas
+        except RuntimeError:
+            return  # Окна нет - нет и атласа
+        atlas.rebuild()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "decodes": self.decodes,
+                "evictions": self.evictions,
+                "images": len(self._images),
+                "textures": sum(len(cached.textures) for cached in self._images.values()),
+                "bytes": self._bytes,
+                "budget": self.budget,
+            }
+
+
+TEXTURE_CACHE = TextureCache()
+
+
+class LevelRegistry:
+    """Уровни игры: файлы .tmx из папки уровней.
+
+    Номер уровня берется из числа в конце имени файла ("Проект 1.tmx" -> 1,
+    "Проект2.tmx" -> 2). Следующий уровень можно подготовить заранее в
+    фоновом потоке: кэш карты и картинки тайлов будут готовы к моменту
+    перехода, в основном потоке останется только создать спрайты.
+    Подготовленным держится только последний запрошенный уровень.
+
+    Папка уровней читается при первом обращении к levels, а не при
+    создании реестра (и не при импорте модуля).
+    """
+
+    # Если файлы уровней не найдены, остаются два тестовых уровня
+    DEFAULT_LEVEL_IDS = [1, 2]
+
+    def __init__(self, levels_dir=None, cache_dir=None, texture_manager=None):
+        self.levels_dir = levels_dir or LEVELS_DIR
+        self.cache_dir = cache_dir
+        self.texture_manager = texture_manager or TEXTURE_CACHE
+        self._levels = None
+
+        self._executor = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @property
+    def levels(self):
+        if self._levels is None:
+            self._levels = self.discover()
+        return self._levels
+
+    def discover(self):
+        """{номер уровня: путь к .tmx}"""
+        try:
+            names = sorted(name for name in os.listdir(self.levels_dir) if name.lower().endswith(".tmx"))
+        except OSError:
+            return {}
+
+        levels = {}
+        unnumbered = []
+        for name in names:
+            match = re.search(r"(\d+)\s*$", os.path.splitext(name)[0])
+            if match and int(match.group(1)) not in levels:
+                levels[int(match.group(1))] = os.path.join(self.levels_dir, name)
+            else:
+                unnumbered.append(name)
+        # Файлы без номера получают следующие свободные номера
+        for name in unnumbered:
+            levels[max(levels, default=0) + 1] = os.path.join(self.levels_dir, name)
+        return dict(sorted(levels.items()))
+
+    def level_ids(self):
+        """Номера уровней по порядку (тестовые, если карт нет)"""
+        return list(self.levels) or list(self.DEFAULT_LEVEL_IDS)
+
+    def path(self, level_id):
+        return self.levels.get(level_id)
+
+    def next_level(self, level_id):
+        return next((other for other in self.levels if other > level_id), None)
+
+    def _prepare(self, level_id):
+        """Кэш карты и картинки тайлов; None, если карту нельзя скомпилировать"""
+        try:
+            level = CompiledLevel.load(self.levels[level_id], self.cache_dir)
+        except LevelCompileError as e:
+            print(f"Уровень {level_id} загружается без кэша: {e}")
+            return None
+
+        try:
+            for raw_gid in level.textures:
+                level.load_texture(raw_gid, self.texture_manager)
+        except Exception:
+            level.close()
+            raise
+        return level
+
+    def preload(self, level_id):
+        """Начать подготовку уровня в фоновом потоке; другие подготовленные уровни освобождаются"""
+        if level_id not in self.levels:
+            return
+        with self._lock:
+            if level_id in self._pending:
+                return
+            stale = list(self._pending.values())
+            self._pending.clear()
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="level-preload")
+            self._pending[level_id] = self._executor.submit(self._prepare, level_id)
+        for future in stale:
+            self._discard(future)
+
+    def discard_pending(self):
+        """Освободить все подготовленные, но не загруженные уровни"""
+        with self._lock:
+            stale = list(self._pending.values())
+            self._pending.clear()
+        for future in stale:
+            self._discard(future)
+
+    @staticmethod
+    def _discard(future):
+        # Еще не начатая подготовка отменяется, готовый уровень закрывается
+        # (сразу или когда поток его доделает)
+        if future.cancel():
+            return
+
+        def close(done):
+            if done.exception() is None and done.result() is not None:
+                done.result().close()
+
+        future.add_done_callback(close)
+
+    def load(self, level_id, scaling=1.0, layer_options=None, lazy=False):
+        """Списки спрайтов уровня (в порядке слоев карты)"""
+        return self._load(level_id, scaling, layer_options, lazy, False)[0]
+
+    def load_with_grid(self, level_id, scaling=1.0, layer_options=None, lazy=False):
+        """Списки спрайтов уровня и TileGridIndex по его слоям"""
+        return self._load(level_id, scaling, layer_options, lazy, True)
+
+    def _load(self, level_id, scaling, layer_options, lazy, with_grid):
+        with self._lock:
+            future = self._pending.pop(level_id, None)
+        level = future.result() if future else self._prepare(level_id)
+
+        if level is None:
+            tile_map = arcade.TileMap(
+                self.levels[level_id], scaling=scaling, layer_options=layer_options, lazy=lazy,
+                texture_cache_manager=self.texture_manager
+            )
+            grid = None
+            if with_grid:
+                grid = TileGridIndex.from_sprite_lists(
+                    tile_map.sprite_lists, tile_map.tile_width * scaling, tile_map.tile_height * scaling,
+                    (tile_map.width, tile_map.height)
+                )
+            return tile_map.sprite_lists, grid
+
+        try:
+            sprite_lists = level.build_sprite_lists(scaling, layer_options, self.texture_manager, lazy)
+            grid = TileGridIndex.from_compiled(level, sprite_lists, scaling) if with_grid else None
+            return sprite_lists, grid
+        finally:
+            level.close()
+
+
+LEVEL_REGISTRY = LevelRegistry()
+
+
+def scene_from_sprite_lists(sprite_lists):
+    """Сцена со слоями в порядке карты"""
+    scene = arcade.Scene()
+    for name, sprite_list in sprite_lists.items():
+        scene.add_sprite_list(name, sprite_list=sprite_list)
+    return scene
+
+
+# ============================================================================
+# ОТРИСОВКА
+# ============================================================================
+
+def chunk_sprites(sprites, chunk_w, chunk_h, overlap=False):
+    """Спрайты по кускам уровня {(столбец, ряд): [спрайты]} и их общие границы.
+
+    Спрайт попадает в кусок, где его центр, а с overlap=True - во все
+    куски, которые он задевает. Границы - (left, bottom, right, top) или
+    None, если спрайтов нет.
+    """
+    chunks = {}
+    left = bottom = math.inf
+    right = top = -math.inf
+    for sprite in sprites:
+        s_left, s_right, s_bottom, s_top = sprite.left, sprite.right, sprite.bottom, sprite.top
+        left, right = min(left, s_left), max(right, s_right)
+        bottom, top = min(bottom, s_bottom), max(top, s_top)
+        if overlap:
+            for col in range(math.floor(s_left / chunk_w), math.ceil(s_right / chunk_w)):
+                for row in range(math.floor(s_bottom / chunk_h), math.ceil(s_top / chunk_h)):
+                    chunks.setdefault((col, row), []).append(sprite)
+        else:
+            key = (math.floor(sprite.center_x / chunk_w), math.floor(sprite.center_y / chunk_h))
+            chunks.setdefault(key, []).append(sprite)
+    return chunks, ((left, bottom, right, top) if left < right else None)
+
+
+def chunk_range(bounds, chunk_w, chunk_h, view=None):
+    """Столбцы и ряды кусков внутри view (left, bottom, right, top) и bounds"""
+    left, bottom, right, top = bounds
+    if view is not None:
+        left, bottom = max(left, view[0]), max(bottom, view[1])
+        right, top = min(right, view[2]), min(top, view[3])
+        if left >= right or bottom >= top:
+            return range(0), range(0)
+    return (range(math.floor(left / chunk_w), math.ceil(right / chunk_w)),
+            range(math.floor(bottom / chunk_h), math.ceil(top / chunk_h)))
+
+
+class BakedLayers:
+    """Неизменные слои уровня, заранее нарисованные в текстуры.
+
+    Слои режутся на куски размером с экран. Кусок рисуется в свой
+    framebuffer, когда впервые попадает на экран (только спрайты, которые
+    его задевают), и дальше выводится одним прямоугольником вместо всех
+    своих спрайтов. Хранится не больше max_chunks последних показанных
+    кусков, остальные рисуются заново при возвращении. При смене размера
+    окна (resize) куски перерисовываются.
+
+    Спрайты каждого куска собираются в свой SpriteList один раз при
+    раскладке. Спрайт хранит ссылки на все свои списки, поэтому старые
+    списки очищаются перед новой раскладкой и в release.
+    """
+
+    VERTEX_SHADER = """
+        #version 330
+        uniform WindowBlock {
+            mat4 projection;
+            mat4 view;
+        } window;
+        in vec2 in_vert;
+        in vec2 in_uv;
+        out vec2 v_uv;
+        void main() {
+            gl_Position = window.projection * window.view * vec4(in_vert, 0.0, 1.0);
+            v_uv = in_uv;
+        }
+    """
+    FRAGMENT_SHADER = """
+        #version 330
+        uniform sampler2D chunk;
+        in vec2 v_uv;
+        out vec4 f_color;
+        void main() {
+            f_color = texture(chunk, v_uv);
+        }
+    """
+
+    visible = True
+
+    def __init__(self, sprite_lists, chunk_size, max_chunks=BAKED_CHUNKS_MAX):
+        self.sprite_lists = sprite_lists
+        self.sprite_count = sum(len(sprite_list) for sprite_list in sprite_lists)
+        self.max_chunks = max_chunks
+        self.chunks = OrderedDict()  # (столбец, ряд) -> (текстура, framebuffer, прямоугольник), старые - первыми
+        self.layer_chunks = None  # Для каждого слоя: (столбец, ряд) -> SpriteList спрайтов, задевающих кусок
+        self.bakes = 0
+        self.draw_calls = 0
+        self._program = None
+        self._split(chunk_size)
+
+    def __len__(self):
+        return self.sprite_count
+
+    def _split(self, chunk_size):
+        self._clear_layers()
+        self.chunk_w, self.chunk_h = chunk_size
+        self.bounds = None
+        self.layer_chunks = []
+        for sprite_list in self.sprite_lists:
+            chunks, bounds = chunk_sprites(sprite_list, self.chunk_w, self.chunk_h, overlap=True)
+            layer = {}
+            for key, sprites in chunks.items():
+                layer[key] = arcade.SpriteList(capacity=len(sprites))
+                layer[key].extend(sprites)
+            self.layer_chunks.append(layer)
+            if bounds is not None:
+                self.bounds = bounds if self.bounds is None else (
+                    min(self.bounds[0], bounds[0]), min(self.bounds[1], bounds[1]),
+                    max(self.bounds[2], bounds[2]), max(self.bounds[3], bounds[3]))
+
+    def _clear_layers(self):
+        if self.layer_chunks is not None:
+            for layer in self.layer_chunks:
+                for sprite_list in layer.values():
+                    sprite_list.clear()
+            self.layer_chunks = None
+
+    def chunk_range(self, view=None):
+        """Столбцы и ряды кусков внутри view (left, bottom, right, top) или всех слоев"""
+        return chunk_range(self.bounds, self.chunk_w, self.chunk_h, view)
+
+    def _bake(self, ctx, col, row):
+        w, h = self.chunk_w, self.chunk_h
+        center = (col * w + w / 2, row * h + h / 2)
+        texture = ctx.texture((w, h), components=4, filter=(ctx.NEAREST, ctx.NEAREST))
+        framebuffer = ctx.framebuffer(color_attachments=[texture])
+        camera = arcade.camera.Camera2D(viewport=arcade.LBWH(0, 0, w, h), position=center,
+                                        render_target=framebuffer)
+        with camera.activate():
+            framebuffer.clear(color_normalized=(0, 0, 0, 0))
+            # Цвет в куске получается умноженным на альфу: при выводе с
+            # (ONE, ONE_MINUS_SRC_ALPHA) полупрозрачные тайлы смешиваются так
+            # же, как если бы спрайты рисовались прямо на экран
+            for layer in self.layer_chunks:
+                sprite_list = layer.get((col, row))
+                if sprite_list is None:
+                    continue
+                sprite_list.draw(blend_function=(ctx.SRC_ALPHA, ctx.ONE_MINUS_SRC_ALPHA,
+                                                 ctx.ONE, ctx.ONE_MINUS_SRC_ALPHA))
+        chunk = self.chunks[col, row] = (texture, framebuffer, arcade.gl.geometry.quad_2d((w, h), center))
+        self.bakes += 1
+        return chunk
+
+    def draw(self, view=None):
+        self.draw_calls = 0
+        if self.layer_chunks is None:
+            self._split((self.chunk_w, self.chunk_h))
+        if self.bounds is None:
+            return
+
+        ctx = arcade.get_window().ctx
+        if self._program is None:
+            self._program = ctx.program(vertex_shader=self.VERTEX_SHADER, fragment_shader=self.FRAGMENT_SHADER)
+
+        # Сначала дорисовываем недостающие куски: отрисовка спрайтов меняет
+        # состояние смешивания, поэтому выводим куски уже после нее
+        cols, rows = self.chunk_range(view)
+        chunks = []
+        for row in rows:
+            for col in cols:
+                chunk = self.chunks.get((col, row))
+                if chunk is None:
+                    chunk = self._bake(ctx, col, row)
+                else:
+                    self.chunks.move_to_end((col, row))
+                chunks.append(chunk)
+
+        # Давно не показанные куски освобождаются (видимые - в конце очереди)
+        while len(self.chunks) > max(self.max_chunks, len(chunks)):
+            self.chunks.popitem(last=False)
+
+        ctx.enable(ctx.BLEND)
+        # ctx.BLEND_PREMULTIPLIED_ALPHA в arcade - это (SRC_ALPHA, ONE), то есть сложение
+        ctx.blend_func = ctx.ONE, ctx.ONE_MINUS_SRC_ALPHA
+        for texture, _, quad in chunks:
+            texture.use(0)
+            quad.render(self._program)
+        ctx.blend_func = ctx.BLEND_DEFAULT
+        self.draw_calls = len(chunks)
+
+    def resize(self, chunk_size):
+        """Новый размер кусков; старые куски освобождаются"""
+        self.release()
+        self._split(chunk_size)
+
+    def release(self):
+        """Освободить куски и их списки; при следующей отрисовке слои разложатся заново"""
+        self.chunks = OrderedDict()
+        self._clear_layers()
+
+
+class ChunkedSpriteList:
+    """Список спрайтов, который рисуется только кусками рядом с экраном.
+
+    Спрайты раскладываются по кускам размером с экран по своему центру,
+    у каждого куска свой SpriteList. Видимость спрайтов (например, у
+    собранных предметов) общая с исходным списком, а положения берутся
+    при раскладке - для списков, спрайты которых не перемещаются.
+    """
+
+    def __init__(self, sprite_list, chunk_size):
+        self.sprite_list = sprite_list
+        self.chunk_w, self.chunk_h = chunk_size
+        self.chunks = None  # (столбец, ряд) -> SpriteList
+        self.bounds = None
+        self.margin = (0, 0)  # Насколько спрайт может выступать из своего куска
+        self.draw_calls = 0
+        self._split()
+
+    def __len__(self):
+        return len(self.sprite_list)
+
+    @property
+    def visible(self):
+        return self.sprite_list.visible
+
+    def _split(self):
+        self._clear()
+        chunks, self.bounds = chunk_sprites(self.sprite_list, self.chunk_w, self.chunk_h)
+        self.chunks = {}
+        margin_x = margin_y = 0
+        for key, sprites in chunks.items():
+            chunk = self.chunks[key] = arcade.SpriteList(capacity=len(sprites))
+            chunk.extend(sprites)
+            for sprite in sprites:
+                margin_x, margin_y = max(margin_x, sprite.width / 2), max(margin_y, sprite.height / 2)
+        self.margin = (margin_x, margin_y)
+
+    def visible_chunks(self, view=None):
+        """Куски (столбец, ряд), спрайты которых могут попасть во view (left, bottom, right, top)"""
+        if self.chunks is None:
+            self._split()
+        if self.bounds is None:
+            return []
+
+        if view is not None:
+            margin_x, margin_y = self.margin
+            view = (view[0] - margin_x, view[1] - margin_y, view[2] + margin_x, view[3] + margin_y)
+        cols, rows = chunk_range(self.bounds, self.chunk_w, self.chunk_h, view)
+        return [(col, row) for row in rows for col in cols if (col, row) in self.chunks]
+
+    def draw(self, view=None):
+        keys = self.visible_chunks(view)
+        for key in keys:
+            self.chunks[key].draw()
+        self.draw_calls = len(keys)
+
+    def resize(self, chunk_size):
+        self.chunk_w, self.chunk_h = chunk_size
+        self._split()
+
+    def release(self):
+        """Освободить списки кусков; при следующей отрисовке спрайты разложатся заново"""
+        self._clear()
+
+    def _clear(self):
+        # Спрайт хранит ссылки на свои списки - без очистки старые куски не освободятся
+        if self.chunks is not None:
+            for chunk in self.chunks.values():
+                chunk.clear()
+            self.chunks = None
+
+
+class DrawPlan:
+    """Порядок отрисовки уровня, собранный один раз при загрузке.
+
+    Каждый список спрайтов рисуется ровно один раз, скрытые слои (например
+    collision с visible="0") в план не попадают. Подряд идущие списки из
+    static рисуются одним BakedLayers из кусков размером chunk_size, списки
+    из culled - ChunkedSpriteList теми же кусками. Если в draw передана
+    видимая область, выводятся только куски рядом с ней.
+    """
+
+    def __init__(self, *groups, static=(), culled=(), chunk_size=(SCREEN_W, SCREEN_H)):
+        self.sprite_lists = []
+        static_ids = {id(sprite_list) for sprite_list in static}
+        culled_ids = {id(sprite_list) for sprite_list in culled}
+        baked_run = []
+        seen = set()
+        for group in groups:
+            for sprite_list in group:
+                if sprite_list is None or id(sprite_list) in seen:
+                    continue
+                seen.add(id(sprite_list))
+                if not sprite_list.visible:
+                    continue
+                if id(sprite_list) in static_ids:
+                    baked_run.append(sprite_list)
+                    continue
+                if baked_run:
+                    self.sprite_lists.append(BakedLayers(baked_run, chunk_size))
+                    baked_run = []
+                if id(sprite_list) in culled_ids:
+                    sprite_list = ChunkedSpriteList(sprite_list, chunk_size)
+                self.sprite_lists.append(sprite_list)
+        if baked_run:
+            self.sprite_lists.append(BakedLayers(baked_run, chunk_size))
+
+        # Вызовов отрисовки в последнем кадре
+        self.draw_calls = 0
+
+    def baked(self):
+        return [item for item in self.sprite_lists if isinstance(item, BakedLayers)]
+
+    def chunked(self):
+        """Все части плана, которые рисуются кусками"""
+        return [item for item in self.sprite_lists if isinstance(item, (BakedLayers, ChunkedSpriteList))]
+
+    def draw(self, view=None):
+        draw_calls = 0
+        for sprite_list in self.sprite_lists:
+            # Пустые списки (например, все предметы собраны) пропускаем
+            if not len(sprite_list):
+                continue
+            if isinstance(sprite_list, (BakedLayers, ChunkedSpriteList)):
+                sprite_list.draw(view)
+                draw_calls += sprite_list.draw_calls
+            else:
+                sprite_list.draw()
+                draw_calls += 1
+        self.draw_calls = draw_calls
+
+    def resize(self, chunk_size):
+        for item in self.chunked():
+            item.resize(chunk_size)
+
+    def release(self):
+        for item in self.chunked():
+            item.release()
+
+
+class TextBatch:
+    """Постоянные arcade.Text, которые рисуются одним пакетом.
+
+    Экраны создают надписи один раз, а в кадре меняют только их текст, цвет
+    и видимость, и только если значение другое: в отличие от
+    arcade.draw_text, текст не раскладывается заново каждый кадр.
+    """
+
+    def __init__(self):
+        self.batch = pyglet.graphics.Batch()
+        self.texts = {}
+
+    def add(self, key, text, x, y, color, font_size, **kwargs):
+        self.texts[key] = arcade.Text(text, x, y, color, font_size, batch=self.batch, **kwargs)
+
+    def set(self, key, text=None, color=None, visible=None):
+        label = self.texts[key]
+        if text is not None:
+            label.text = text  # arcade.Text сам сравнивает строку
+        if color is not None and label.color != color:
+            label.color = color
+        if visible is not None and label.visible != visible:
+            label.visible = visible
+
+    def draw(self):
+        self.batch.draw()
+
+
+class ShapeBatch:
+    """Статичная геометрия меню в одном arcade.shape_list.ShapeElementList.
+
+    build(shapes) заполняет список заново только когда меняется ключ
+    состояния (наведение, активное поле, режим), в остальных кадрах весь
+    список рисуется несколькими вызовами без пересборки вершин.
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self.shapes = None
+        self.key = None
+        self.rebuilds = 0
+
+    def rect_filled(self, left, right, bottom, top, color):
+        self.shapes.append(arcade.shape_list.create_rectangle_filled(
+            (left + right) / 2, (bottom + top) / 2, right - left, top - bottom, color))
+
+    def rect_outline(self, left, right, bottom, top, color, border_width=1):
+        self.shapes.append(arcade.shape_list.create_rectangle_outline(
+            (left + right) / 2, (bottom + top) / 2, right - left, top - bottom, color, border_width))
+
+    # По умолчанию arcade строит эллипс из 128 сегментов, для звезд меню хватает 16
+    def circle_filled(self, x, y, radius, color, num_segments=16):
+        self.shapes.append(arcade.shape_list.create_ellipse_filled(
+            x, y, radius * 2, radius * 2, color, num_segments=num_segments))
+
+    def circle_outline(self, x, y, radius, color, border_width=1, num_segments=16):
+        self.shapes.append(arcade.shape_list.create_ellipse_outline(
+            x, y, radius * 2, radius * 2, color, border_width, num_segments=num_segments))
+
+    def draw(self, key):
+        if self.shapes is None or key != self.key:
+            self.shapes = arcade.shape_list.ShapeElementList()
+            self.build(self)
+            self.key = key
+            self.rebuilds += 1
+        self.shapes.draw()
+
+    def invalidate(self):
+        """Пересобрать при следующей отрисовке (например, изменился прогресс)"""
+        self.shapes = None
+
+
+class FrameStats:
+    """Счетчик кадров в секунду по последним кадрам"""
+
+    def __init__(self, history=60):
+        self._frames = deque(maxlen=history)
+
+    def tick(self):
+        self._frames.append(time.perf_counter())
+
+    @property
+    def fps(self):
+        if len(self._frames) < 2:
+            return 0.0
+        elapsed = self._frames[-1] - self._frames[0]
+        return (len(self._frames) - 1) / elapsed if elapsed > 0 else 0.0
+
+
+class FrameProfiler:
+    """Время участков игрового цикла по последним кадрам.
+
+    start() запоминает момент начала, mark(name) прибавляет к участку name
+    время с прошлой отметки. Участок может встречаться в кадре несколько
+    раз (например, физика при нескольких шагах за кадр) - время
+    складывается. end_frame() переносит суммы кадра в историю, по которой
+    считаются перцентили p50/p95/p99 в миллисекундах.
+    """
+
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, history=600):
+        self.history = history
+        self.frames = 0
+        self._samples = {}  # участок -> deque времени по кадрам, мс
+        self._totals = deque(maxlen=history)
+        self._frame = {}
+        self._last = time.perf_counter()
+
+    def start(self):
+        self._last = time.perf_counter()
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self._frame[name] = self._frame.get(name, 0.0) + now - self._last
+        self._last = now
+
+    def end_frame(self):
+        for name in self._frame:
+            if name not in self._samples:
+                self._samples[name] = deque(maxlen=self.history)
+
+        # Участок, которого не было в кадре, занял 0 мс - иначе перцентили
+        # считались бы только по кадрам, где он был
+        total = 0.0
+        for name, samples in self._samples.items():
+            seconds = self._frame.get(name, 0.0)
+            samples.append(seconds * 1000)
+            total += seconds
+        self._totals.append(total * 1000)
+        self._frame.clear()
+        self.frames += 1
+
+    @staticmethod
+    def _percentile(ordered, percent):
+        # Ближайший ранг: значение, не меньше которого percent% замеров
+        index = max(0, -(-len(ordered) * percent // 100) - 1)
+        return ordered[index]
+
+    def summary(self):
+        """{участок: {"count", "mean", "p50", "p95", "p99", "max"}} в миллисекундах"""
+        result = {}
+        sections = list(self._samples.items())
+        if self._totals:
+            sections.append(("total", self._totals))
+        for name, samples in sections:
+            ordered = sorted(samples)
+            stats = {"count": len(ordered), "mean": sum(ordered) / len(ordered)}
+            for percent in self.PERCENTILES:
+                stats[f"p{percent}"] = self._percentile(ordered, percent)
+            stats["max"] = ordered[-1]
+            result[name] = stats
+        return result
+
+    def lines(self):
+        return [f"{name:<9} {stats['p50']:6.2f} {stats['p95']:6.2f} {stats['p99']:6.2f}"
+                for name, stats in self.summary().items()]
+
+    def dump(self, path):
+        """Сохранить summary() в CSV или JSON (по расширению файла)"""
+        summary = self.summary()
+        try:
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                if path.lower().endswith(".json"):
+                    json.dump({"frames": self.frames, "sections": summary}, f, ensure_ascii=False, indent=2)
+                else:
+                    columns = ["count", "mean"] + [f"p{p}" for p in self.PERCENTILES] + ["max"]
+                    writer = csv.writer(f)
+                    writer.writerow(["section"] + columns)
+                    for name, stats in summary.items():
+                        writer.writerow([name] + [round(stats[c], 4) for c in columns])
+            return True
+        except Exception as e:
+            print(f"Ошибка сохранения замеров кадров: {e}")
+            return False
+
+
+# ============================================================================
+# ИГРОВЫЕ ОБЪЕКТЫ
+# ============================================================================
+
+class FixedTimestep:
+    """Накопитель времени для физики с постоянным шагом.
+
+    advance(delta_time) возвращает, сколько шагов по 1 / tick_rate секунд
+    нужно выполнить за этот кадр. Если кадр был слишком долгим, шагов не
+    больше max_steps, а лишнее время отбрасывается (dropped), чтобы игра
+    не пыталась бесконечно догонять. alpha - доля следующего шага, на
+    которую отрисовка сдвигает объекты между двумя последними шагами.
+    """
+
+    def __init__(self, tick_rate=TICK_RATE, max_steps=MAX_CATCHUP_STEPS):
+        self.tick_rate = tick_rate
+        self.step = 1.0 / tick_rate
+        self.max_steps = max_steps
+        self.accumulator = 0.0
+        self.alpha = 0.0
+        self.ticks = 0
+        self.dropped = 0
+
+    def advance(self, delta_time):
+        self.accumulator += delta_time
+        steps = int(self.accumulator // self.step)
+        if steps > self.max_steps:
+            self.dropped += steps - self.max_steps
+            steps = self.max_steps
+            self.accumulator %= self.step
+        else:
+            self.accumulator -= steps * self.step
+        self.ticks += steps
+        self.alpha = self.accumulator / self.step
+        return steps
+
+    def interpolate(self, previous, current):
+        """Точка между положением на прошлом и текущем шаге"""
+        alpha = self.alpha
+        return (previous[0] + (current[0] - previous[0]) * alpha,
+                previous[1] + (current[1] - previous[1]) * alpha)
+
+
+class TileGridIndex:
+    """Сетка клеток уровня для проверок "что под игроком".
+
+    В каждой клетке хранится битовая маска слоев (лестница, батут, урон,
+    выход, предмет) и спрайты этих слоев. Проверка игрока - это несколько
+    клеток под его прямоугольником вместо запроса к пространственному
+    хэшу каждого списка; точное столкновение проверяется только для
+    спрайтов из этих клеток.
+    """
+
+    LADDER, BATUT, DAMAGE, EXIT, COLLECT = 1, 2, 4, 8, 16
+    LAYER_FLAGS = {"ladder": LADDER, "batut": BATUT, "damage": DAMAGE, "exit": EXIT, "collect": COLLECT}
+    EDGE = 0.01  # Погрешность float на краях тайлов, в пикселях
+
+    def __init__(self, width, height, cell_w, cell_h):
+        self.width, self.height = width, height
+        self.cell_w, self.cell_h = cell_w, cell_h
+        self.flags = bytearray(width * height)  # строки снизу вверх
+        self.sprites = {}  # (номер клетки, флаг) -> [спрайты]
+
+    @classmethod
+    def from_compiled(cls, level, sprite_lists, scaling):
+        """По GID слоев скомпилированной карты; sprite_lists - из build_sprite_lists"""
+        grid = cls(level.width, level.height, level.tile_width * scaling, level.tile_height * scaling)
+        for name, _, gids in level.layers:
+            flag = cls.LAYER_FLAGS.get(name)
+            if not flag or name not in sprite_lists:
+                continue
+            # Спрайты слоя созданы в порядке непустых клеток
+            sprites = iter(sprite_lists[name])
+            for index, raw_gid in enumerate(gids):
+                if not raw_gid:
+                    continue
+                sprite = next(sprites)
+                if sprite.width <= grid.cell_w + cls.EDGE and sprite.height <= grid.cell_h + cls.EDGE:
+                    row, col = divmod(index, level.width)
+                    grid._add((level.height - row - 1) * level.width + col, flag, sprite)
+                else:
+                    grid.add_sprite(sprite, flag)
+        return grid
+
+    @classmethod
+    def from_sprite_lists(cls, sprite_lists, cell_w, cell_h, size=(0, 0)):
+        """По готовым спрайтам (карта без кэша или тестовый уровень); size - наименьший размер в клетках"""
+        right = top = 0
+        for name, sprite_list in sprite_lists.items():
+            if name in cls.LAYER_FLAGS and sprite_list:
+                right = max(right, max(sprite.right for sprite in sprite_list))
+                top = max(top, max(sprite.top for sprite in sprite_list))
+
+        # Край ровно на границе клетки следующую клетку не добавляет
+        grid = cls(max(math.ceil((right - cls.EDGE) / cell_w), size[0]),
+                   max(math.ceil((top - cls.EDGE) / cell_h), size[1]), cell_w, cell_h)
+        for name, sprite_list in sprite_lists.items():
+            flag = cls.LAYER_FLAGS.get(name)
+            if flag and sprite_list:
+                for sprite in sprite_list:
+                    grid.add_sprite(sprite, flag)
+        return grid
+
+    def _add(self, index, flag, sprite):
+        self.flags[index] |= flag
+        self.sprites.setdefault((index, flag), []).append(sprite)
+
+    def _cells(self, left, right, bottom, top):
+        """Номера клеток под прямоугольником (за пределами карты - нет клеток)"""
+        col_start = max(int(left // self.cell_w), 0)
+        col_end = min(int(right // self.cell_w), self.width - 1)
+        row_start = max(int(bottom // self.cell_h), 0)
+        row_end = min(int(top // self.cell_h), self.height - 1)
+        for row in range(row_start, row_end + 1):
+            base = row * self.width
+            for col in range(col_start, col_end + 1):
+                yield base + col
+
+    def add_sprite(self, sprite, flag):
+        # Тайл, край которого ровно на границе клетки, соседнюю клетку не занимает
+        edge = self.EDGE
+        for index in self._cells(sprite.left + edge, sprite.right - edge, sprite.bottom + edge, sprite.top - edge):
+            self._add(index, flag, sprite)
+
+    def flags_under(self, sprite):
+        """Маска слоев во всех клетках под спрайтом"""
+        mask = 0
+        flags = self.flags
+        for index in self._cells(sprite.left, sprite.right, sprite.bottom, sprite.top):
+            mask |= flags[index]
+        return mask
+
+    def hits(self, sprite, flag):
+        """Спрайты слоя flag, с которыми сталкивается sprite"""
+        found = []
+        flags = self.flags
+        for index in self._cells(sprite.left, sprite.right, sprite.bottom, sprite.top):
+            if flags[index] & flag:
+                for other in self.sprites[index, flag]:
+                    if other not in found and arcade.check_for_collision(sprite, other):
+                        found.append(other)
+        return found
+
+
+class EnemyArrays:
+    """Положения и размеры врагов в массивах для проверки касания игрока.
+
+    Столбцы хранятся в array("d"); если установлен numpy, проверка всех
+    врагов выполняется одной векторной операцией над видами этих массивов.
+    Враги дополнительно упорядочены по x: отсечение по горизонтали
+    (например, по видимой области) выбирает только ближних врагов.
+    Если враг двигается, его новое положение передается через move().
+    """
+
+    def __init__(self, sprites):
+        self.sprites = list(sprites)
+        self.x = array("d", (sprite.center_x for sprite in self.sprites))
+        self.y = array("d", (sprite.center_y for sprite in self.sprites))
+        self.half_w = array("d", (sprite.width / 2 for sprite in self.sprites))
+        self.half_h = array("d", (sprite.height / 2 for sprite in self.sprites))
+        self.max_half_w = max(self.half_w, default=0.0)
+        self._sorted = False
+
+    def __len__(self):
+        return len(self.sprites)
+
+    def move(self, index, x, y):
+        """Передвинуть врага и обновить его положение в массивах"""
+        self.sprites[index].position = x, y
+        self.x[index], self.y[index] = x, y
+        self._sorted = False
+
+    def sync(self):
+        """Перечитать положения всех врагов из спрайтов"""
+        for index, sprite in enumerate(self.sprites):
+            self.x[index], self.y[index] = sprite.center_x, sprite.center_y
+        self._sorted = False
+
+    def _sort(self):
+        if np is not None:
+            self._order = np.argsort(np.frombuffer(self.x, dtype=np.float64), kind="stable")
+            self._sorted_x = np.frombuffer(self.x, dtype=np.float64)[self._order]
+        else:
+            self._order = sorted(range(len(self.sprites)), key=self.x.__getitem__)
+            self._sorted_x = [self.x[index] for index in self._order]
+        self._sorted = True
+
+    def first_overlap(self, sprite, left=None, right=None):
+        """Первый враг, пересекающийся со спрайтом; left/right - отсечение по x"""
+        if not self.sprites:
+            return None
+        if not self._sorted:
+            self._sort()
+
+        # Кандидаты - враги, чей центр в полосе [left, right] с запасом на ширину
+        left = -float("inf") if left is None else left - self.max_half_w
+        right = float("inf") if right is None else right + self.max_half_w
+        if np is not None:
+            start = int(np.searchsorted(self._sorted_x, left, "left"))
+            end = int(np.searchsorted(self._sorted_x, right, "right"))
+        else:
+            start = bisect_left(self._sorted_x, left)
+            end = bisect_right(self._sorted_x, right)
+        if start >= end:
+            return None
+
+        px, py = sprite.center_x, sprite.center_y
+        pw, ph = sprite.width / 2, sprite.height / 2
+
+        if np is not None:
+            indices = self._order[start:end]
+            hit = ((np.abs(np.frombuffer(self.x, dtype=np.float64)[indices] - px)
+                    < np.frombuffer(self.half_w, dtype=np.float64)[indices] + pw)
+                   & (np.abs(np.frombuffer(self.y, dtype=np.float64)[indices] - py)
+                      < np.frombuffer(self.half_h, dtype=np.float64)[indices] + ph))
+            found = np.flatnonzero(hit)
+            return self.sprites[indices[found[0]]] if len(found) else None
+
+        for index in self._order[start:end]:
+            if abs(px - self.x[index]) < pw + self.half_w[index] and \
+                    abs(py - self.y[index]) < ph + self.half_h[index]:
+                return self.sprites[index]
+        return None
+
+
+class CollectiblePool:
+    """Предметы уровня, которые не удаляются из списка при сборе.
+
+    Собранный предмет скрывается и помечается неактивным в bytearray.
+    При смерти флаги сбрасываются: спрайты, их место в SpriteList и
+    пространственный хэш остаются прежними, новых объектов не создается.
+    Предметы не двигаются, поэтому их места не запоминаются и не
+    переписываются - сброс только снова делает их видимыми.
+    """
+
+    def __init__(self, sprite_list):
+        self.sprite_list = sprite_list
+        self.sprites = list(sprite_list)
+        self.slots = {sprite: index for index, sprite in enumerate(self.sprites)}
+        self.active = bytearray(b"\x01") * len(self.sprites)
+        self.active_count = len(self.sprites)
+
+    def __len__(self):
+        return len(self.sprites)
+
+    def collect(self, player, grid=None):
+        """Активные предметы под игроком; они сразу скрываются"""
+        if grid is not None:
+            candidates = grid.hits(player, TileGridIndex.COLLECT)
+        else:
+            candidates = arcade.check_for_collision_with_list(player, self.sprite_list)
+
+        collected = []
+        for sprite in candidates:
+            index = self.slots[sprite]
+            if self.active[index]:
+                self.active[index] = 0
+                sprite.visible = False
+                collected.append(sprite)
+        self.active_count -= len(collected)
+        return collected
+
+    def inactive(self):
+        """Номера собранных предметов"""
+        indices = []
+        index = self.active.find(0)
+        while index != -1:
+            indices.append(index)
+            index = self.active.find(0, index + 1)
+        return indices
+
+    def reset(self):
+        """Снова показать все собранные предметы"""
+        sprites = self.sprites
+        for index in self.inactive():
+            sprites[index].visible = True
+        self.active[:] = b"\x01" * len(self.sprites)
+        self.active_count = len(self.sprites)
+
+
+# ============================================================================
+# ЭКРАН РЕГИСТРАЦИИ/АВТОРИЗАЦИИ
+# ============================================================================
+
+class AuthView(arcade.View):
+    def __init__(self, db):
+        super().__init__(background_color=arcade.color.DARK_SLATE_GRAY)
+
+        self.db = db
+        self.mode = "login"
+        self.username = self.password = self.confirm_password = ""
+        self.active_field = "username"
+        self.message = ""
+        self.message_color = arcade.color.GREEN
+
+        self.texts = TextBatch()
+        self.create_texts()
+        self.shapes = ShapeBatch(self.build_shapes)
+
+    def on_show_view(self):
+        self.window.set_screen(MENU_WIDTH, MENU_HEIGHT, "Вход / Регистрация")
+
+        # Каждый вход начинается с пустой формы
+        self.mode = "login"
+        self.username = self.password = self.confirm_password = ""
+        self.active_field = "username"
+        self.message = ""
+
+    def create_texts(self):
+        field_y_positions = {
+            "username": MENU_HEIGHT // 2 + 50,
+            "password": MENU_HEIGHT // 2 - 20,
+            "confirm": MENU_HEIGHT // 2 - 90
+        }
+        captions = {
+            "username": "Имя пользователя:",
+            "password": "Пароль:",
+            "confirm": "Подтвердите пароль:"
+        }
+
+        self.texts.add("title", "ВХОД", MENU_WIDTH // 2, MENU_HEIGHT - 80,
+                       arcade.color.WHITE, 40, anchor_x="center")
+
+        for field_name, field_y in field_y_positions.items():
+            self.texts.add(f"{field_name}_label", captions[field_name], MENU_WIDTH // 2, field_y + 30,
+                           arcade.color.WHITE, 20, anchor_x="center")
+            self.texts.add(field_name, "", MENU_WIDTH // 2, field_y,
+                           arcade.color.BLACK, 20, anchor_x="center", anchor_y="center")
+
+        # Подписи кнопок зависят от режима
+        self.texts.add("main_button", "", MENU_WIDTH // 2, MENU_HEIGHT // 2 - 160,
+                       arcade.color.WHITE, 24, anchor_x="center", anchor_y="center")
+        self.texts.add("second_button", "", MENU_WIDTH // 2, MENU_HEIGHT // 2 - 220,
+                       arcade.color.WHITE, 18, anchor_x="center", anchor_y="center")
+
+        self.texts.add("message", "", MENU_WIDTH // 2, 50, self.message_color, 18, anchor_x="center")
+
+    def update_texts(self):
+        register = self.mode == "register"
+
+        self.texts.set("title", "РЕГИСТРАЦИЯ" if register else "ВХОД")
+        self.texts.set("username", self.username or "Введите имя")
+        self.texts.set("password", "*" * len(self.password) or "Введите пароль")
+
+        # Подтверждение пароля (только для регистрации)
+        self.texts.set("confirm_label", visible=register)
+        self.texts.set("confirm", "*" * len(self.confirm_password) or "Подтвердите пароль", visible=register)
+
+        self.texts.set("main_button", "Зарегистрироваться" if register else "Войти")
+        self.texts.set("second_button", "Назад ко входу" if register else "Нет аккаунта? Зарегистрироваться")
+
+        self.texts.set("message", self.message, self.message_color)
+
+    def build_shapes(self, shapes):
+        """Поля ввода и кнопки; пересобираются при смене режима или активного поля"""
+        field_y_positions = {
+            "username": MENU_HEIGHT // 2 + 50,
+            "password": MENU_HEIGHT // 2 - 20,
+            "confirm": MENU_HEIGHT // 2 - 90
+        }
+
+        for field_name, field_y in field_y_positions.items():
+            if self.mode == "login" and field_name == "confirm":
+                continue
+
+            field_color = arcade.color.LIGHT_BLUE if self.active_field == field_name else arcade.color.WHITE
+            shapes.rect_filled(
+                MENU_WIDTH // 2 - 150, MENU_WIDTH // 2 + 150,
+                field_y - 20, field_y + 20,
+                field_color
+            )
+
+        # Кнопки: основная (Войти / Зарегистрироваться) и переключение режима
+        main_y = MENU_HEIGHT // 2 - 160
+        shapes.rect_filled(
+            MENU_WIDTH // 2 - 150, MENU_WIDTH // 2 + 150,
+            main_y - 25, main_y + 25,
+            arcade.color.GREEN
+        )
+
+        second_y = MENU_HEIGHT // 2 - 220
+        shapes.rect_filled(
+            MENU_WIDTH // 2 - 150, MENU_WIDTH // 2 + 150,
+            second_y - 25, second_y + 25,
+            arcade.color.BLUE
+        )
+
+    def on_draw(self):
+        self.clear()
+
+        self.shapes.draw((self.mode, self.active_field))
+
+        # Все надписи одним пакетом
+        self.update_texts()
+        self.texts.draw()
+
+    def on_mouse_press(self, x, y, button, modifiers):
+        if button != arcade.MOUSE_BUTTON_LEFT:
+            return
+
+        # Проверяем клик по полям ввода
+        field_y_positions = {
+            "username": MENU_HEIGHT // 2 + 50,
+            "password": MENU_HEIGHT // 2 - 20,
+            "confirm": MENU_HEIGHT // 2 - 90
+        }
+
+        for field_name, field_y in field_y_positions.items():
+            if self.mode == "login" and field_name == "confirm":
+                continue
+
+            if (MENU_WIDTH // 2 - 150 <= x <= MENU_WIDTH // 2 + 150 and
+                    field_y - 20 <= y <= field_y + 20):
+                self.active_field = field_name
+                return
+
+        # Проверяем клик по кнопкам
+        if self.mode == "login":
+            # Кнопка "Войти"
+            login_y = MENU_HEIGHT // 2 - 160
+            if (MENU_WIDTH // 2 - 150 <= x <= MENU_WIDTH // 2 + 150 and
+                    login_y - 25 <= y <= login_y + 25):
+                self.login()
+                return
+
+            # Кнопка "Регистрация"
+            register_y = MENU_HEIGHT // 2 - 220
+            if (MENU_WIDTH // 2 - 150 <= x <= MENU_WIDTH // 2 + 150 and
+                    register_y - 25 <= y <= register_y + 25):
+                self.mode = "register"
+                self.message = ""
+                self.confirm_password = ""
+                self.active_field = "username"
+                return
+
+        else:  # register mode
+            # Кнопка "Зарегистрироваться"
+            register_y = MENU_HEIGHT // 2 - 160
+            if (MENU_WIDTH // 2 - 150 <= x <= MENU_WIDTH // 2 + 150 and
+                    register_y - 25 <= y <= register_y + 25):
+                self.register()
+                return
+
+            # Кнопка "Назад"
+            back_y = MENU_HEIGHT // 2 - 220
+            if (MENU_WIDTH // 2 - 150 <= x <= MENU_WIDTH // 2 + 150 and
+                    back_y - 25 <= y <= back_y + 25):
+                self.mode = "login"
+                self.message = ""
+                self.confirm_password = ""
+                self.active_field = "username"
+                return
+
+    def on_key_press(self, key, modifiers):
+        if key == arcade.key.ESCAPE:
+            self.window.close()
+        elif key == arcade.key.TAB:
+            # Переключение между полями
+            if self.mode == "login":
+                fields = ["username", "password"]
+            else:
+                fields = ["username", "password", "confirm"]
+
+            if self.active_field in fields:
+                idx = fields.index(self.active_field)
+                self.active_field = fields[(idx + 1) % len(fields)]
+            else:
+                self.active_field = fields[0]
+        elif key == arcade.key.ENTER:
+            if self.mode == "login":
+                self.login()
+            else:
+                self.register()
+        elif key == arcade.key.BACKSPACE:
+            if self.active_field == "username":
+                self.username = self.username[:-1]
+            elif self.active_field == "password":
+                self.password = self.password[:-1]
+            elif self.active_field == "confirm":
+                self.confirm_password = self.confirm_password[:-1]
+        elif 32 <= key <= 126:
+            char = chr(key)
+            if self.active_field == "username":
+                self.username += char
+            elif self.active_field == "password":
+                self.password += char
+            elif self.active_field == "confirm":
+                self.confirm_password += char
+
+    def login(self):
+        if not self.username or not self.password:
+            self.message = "Заполните все поля!"
+            self.message_color = arcade.color.RED
+            return
+
+        success, user_id, message = self.db.authenticate_user(self.username, self.password)
+        self.message = message
+        self.message_color = arcade.color.GREEN if success else arcade.color.RED
+
+        if success:
+            self.window.show_menu(user_id)
+
+    def register(self):
+        if not all([self.username, self.password, self.confirm_password]):
+            self.message = "Заполните все поля!"
+            self.message_color = arcade.color.RED
+            return
+
+        if self.password != self.confirm_password:
+            self.message = "Пароли не совпадают!"
+            self.message_color = arcade.color.RED
+            return
+
+        if len(self.username) < 3:
+            self.message = "Имя пользователя должно быть не менее 3 символов"
+            self.message_color = arcade.color.RED
+            return
+
+        if len(self.password) < 4:
+            self.message = "Пароль должен быть не менее 4 символов"
+            self.message_color = arcade.color.RED
+            return
+
+        success, user_id, message = self.db.create_user(self.username, self.password)
+        self.message = message
+        self.message_color = arcade.color.GREEN if success else arcade.color.RED
+
+        if success:
+            self.mode = "login"
+            self.password = self.confirm_password = ""
+            self.active_field = "username"
+
+
+# ============================================================================
+# МЕНЮ ВЫБОРА УРОВНЯ
+# ============================================================================
+
+class LevelMenuView(arcade.View):
+    def __init__(self, user_id, db):
+        super().__init__(background_color=arcade.color.SKY_BLUE)
+
+        self.user_id = user_id
+        self.db = db
+        self.progress = self.db.get_user_progress(user_id)
+        self.hovered_level = None
+
+        self.texts = TextBatch()
+        self.create_texts()
+        self.shapes = ShapeBatch(self.build_shapes)
+
+    def level_cards(self):
+        """Центры карточек уровней: по три в ряд, ряды по центру экрана"""
+        level_ids = LEVEL_REGISTRY.level_ids()
+        columns = min(len(level_ids), 3)
+        rows = (len(level_ids) + columns - 1) // columns
+        cards = []
+        for index, level_id in enumerate(level_ids):
+            row, col = divmod(index, columns)
+            x = MENU_WIDTH * (col + 1) // (columns + 1)
+            y = MENU_HEIGHT // 2 + (rows - 1) * 65 - row * 130
+            cards.append((level_id, x, y))
+        return cards
+
+    def level_info(self, level_id):
+        return self.progress.get(level_id, {
+            'unlocked': level_id == LEVEL_REGISTRY.level_ids()[0],
+            'best_score': 0,
+            'stars': 0,
+            'name': f"Уровень {level_id}"
+        })
+
+    def create_texts(self):
+        self.texts.add("title", "ВЫБОР УРОВНЯ", MENU_WIDTH // 2, MENU_HEIGHT - 50,
+                       arcade.color.NAVY_BLUE, 36, anchor_x="center")
+
+        for level_id, x, y in self.level_cards():
+            self.texts.add(("name", level_id), "", x, y + 20,
+                           arcade.color.BLACK, 20, anchor_x="center", anchor_y="center")
+            self.texts.add(("score", level_id), "", x, y - 10,
+                           arcade.color.DARK_GREEN, 14, anchor_x="center", anchor_y="center")
+            # Замок для заблокированных
+            self.texts.add(("lock", level_id), "🔒", x, y - 40,
+                           arcade.color.BLACK, 24, anchor_x="center", anchor_y="center")
+
+        self.texts.add("hint", "Нажмите на уровень для начала игры", MENU_WIDTH // 2, 100,
+                       arcade.color.DARK_GRAY, 16, anchor_x="center")
+        self.texts.add("hint_esc", "ESC - выход в главное меню", MENU_WIDTH // 2, 70,
+                       arcade.color.DARK_GRAY, 14, anchor_x="center")
+
+    def update_texts(self):
+        for level_id in LEVEL_REGISTRY.level_ids():
+            level_info = self.level_info(level_id)
+            text_color = arcade.color.BLACK if level_info['unlocked'] else arcade.color.GRAY
+            self.texts.set(("name", level_id), level_info['name'], text_color)
+            self.texts.set(("score", level_id), f"Очки: {level_info['best_score']}",
+                           visible=level_info['best_score'] > 0)
+            self.texts.set(("lock", level_id), visible=not level_info['unlocked'])
+
+    def on_show_view(self):
+        self.window.set_screen(MENU_WIDTH, MENU_HEIGHT, "Выбор уровня")
+
+        # После уровня прогресс мог измениться
+        self.progress = self.db.get_user_progress(self.user_id)
+        self.hovered_level = None
+        self.shapes.invalidate()
+
+    def build_shapes(self, shapes):
+        """Карточки уровней; пересобираются только при смене наведения"""
+        for level_id, x, y in self.level_cards():
+            level_info = self.level_info(level_id)
+
+            # Фон уровня
+            color = arcade.color.LIGHT_GRAY
+            if not level_info['unlocked']:
+                color = arcade.color.DARK_GRAY
+            elif self.hovered_level == level_id:
+                color = arcade.color.LIGHT_BLUE
+
+            shapes.rect_filled(
+                x - 90, x + 90,
+                y - 50, y + 50,
+                color
+            )
+            shapes.rect_outline(
+                x - 90, x + 90,
+                y - 50, y + 50,
+                arcade.color.BLACK, 2
+            )
+
+            # Звезды
+            if level_info['stars'] > 0:
+                for i in range(5):
+                    star_x = x - 40 + i * 20
+                    star_y = y - 30
+                    if i < level_info['stars']:
+                        shapes.circle_filled(star_x, star_y, 8, arcade.color.GOLD)
+                    else:
+                        shapes.circle_outline(star_x, star_y, 8, arcade.color.GRAY, 1)
+
+    def on_draw(self):
+        self.clear()
+
+        self.shapes.draw(self.hovered_level)
+
+        # Все надписи одним пакетом поверх карточек
+        self.update_texts()
+        self.texts.draw()
+
+    def on_mouse_motion(self, x, y, dx, dy):
+        self.hovered_level = None
+        for level_id, level_x, level_y in self.level_cards():
+            if (level_x - 90 <= x <= level_x + 90 and
+                    level_y - 50 <= y <= level_y + 50):
+
+                if self.level_info(level_id)['unlocked']:
+                    self.hovered_level = level_id
+                    # Скорее всего игрок выберет этот уровень - готовим его заранее
+                    LEVEL_REGISTRY.preload(level_id)
+                break
+
+    def on_mouse_press(self, x, y, button, modifiers):
+        if button != arcade.MOUSE_BUTTON_LEFT:
+            return
+
+        for level_id, level_x, level_y in self.level_cards():
+            if (level_x - 90 <= x <= level_x + 90 and
+                    level_y - 50 <= y <= level_y + 50):
+
+                if self.level_info(level_id)['unlocked']:
+                    self.window.show_level(level_id)
+                    break
+
+    def on_key_press(self, key, modifiers):
+        if key == arcade.key.ESCAPE:
+            # Возвращаемся к экрану авторизации
+            self.window.show_auth()
+
+
+# ============================================================================
+# СИМУЛЯЦИЯ УРОВНЯ
+# ============================================================================
+
+class GameSimulation:
+    """Логика уровня без окна и без OpenGL.
+
+    Состояние уровня, управление, шаг физики, урон, смерть и очки. Списки
+    спрайтов создаются ленивыми (lazy=True), поэтому симуляция работает на
+    машине без дисплея: для тестов, ботов и проверки результатов на
+    сервере. GameView только передает ей нажатия и рисует ее состояние.
+    """
+
+    def __init__(self, level_id, tick_rate=TICK_RATE, hold_textures=True):
+        # Физика идет постоянными шагами, скорости пересчитаны под их частоту
+        self.timestep = FixedTimestep(tick_rate)
+        self.speed_scale = PHYSICS_BASE_RATE / tick_rate
+        self.move_speed = MOVE_SPEED * self.speed_scale
+        self.jump_speed = JUMP_SPEED * self.speed_scale
+        self.batut_speed = BATUT_SPEED * self.speed_scale
+        self.gravity = GRAVITY * self.speed_scale * self.speed_scale
+
+        self.level_id = level_id
+
+        self.score = 0
+        self.max_score = 0  # Максимально возможный счет для этого уровня
+        self.health = 100
+        self.deaths = 0
+        self.elapsed = 0.0  # Время прохождения в секундах симуляции
+        self.has_key = False
+        self.level_complete = False
+
+        # FrameProfiler для замера участков шага физики (задает экран уровня)
+        self.profiler = None
+
+        # Списки спрайтов
+        self.player_list = arcade.SpriteList(lazy=True)
+        self.walls = None
+        self.collectibles = None
+        self.exit_list = None
+        self.damage_list = None
+        self.ladder_list = None
+        self.batut_list = None
+        self.characters_list = None  # Слой персонажей
+
+        # Картинки TEXTURE_CACHE, занятые этим уровнем (освобождает close);
+        # hold_textures=False - для симуляций, которые никто не закрывает
+        self.hold_textures = hold_textures
+        self.texture_paths = set()
+
+        # Собранные предметы, которые возвращаются при смерти
+        self.collectible_pool = None
+
+        # Клетки лестниц, батутов, опасностей, выхода и предметов
+        self.grid_index = None
+        self.enemies = None  # Положения врагов для проверки касания
+
+        # Слои уровня в порядке карты
+        self.level_layers = []
+        self.level_width = self.level_height = 0  # Размер уровня в пикселях
+
+        # Игрок
+        self.player = None
+        self.previous_position = (0, 0)  # Положение на прошлом шаге физики
+
+        # Физический движок
+        self.physics_engine = None
+
+        # Управление
+        self.left = self.right = self.up = self.down = False
+        self.jump_pressed = False
+        self.on_ladder = False
+        self.can_jump = False
+
+        # Таймер неуязвимости после получения урона
+        self.invincible_timer = 0
+        self.INVINCIBLE_TIME = 1.0
+
+        # Для прыжка с лестницы
+        self.ladder_jump_cooldown = 0
+
+        # Номер шага и изменения управления: [(шаг, маска INPUT_*)]
+        self.tick = 0
+        self.input_log = []
+        self._last_input = 0
+
+        self.setup_level()
+
+    def input_mask(self):
+        return (INPUT_LEFT * self.left | INPUT_RIGHT * self.right | INPUT_UP * self.up
+                | INPUT_DOWN * self.down | INPUT_JUMP * self.jump_pressed)
+
+    def apply_input(self, mask):
+        self.left = bool(mask & INPUT_LEFT)
+        self.right = bool(mask & INPUT_RIGHT)
+        self.up = bool(mask & INPUT_UP)
+        self.down = bool(mask & INPUT_DOWN)
+        self.jump_pressed = bool(mask & INPUT_JUMP)
+
+    def reset(self):
+        """Начать уровень заново без повторной загрузки карты"""
+        self.player_die()
+        self.deaths = 0
+        self.elapsed = 0.0
+        self.level_complete = False
+        self.apply_input(0)
+        self.tick = 0
+        self.input_log = []
+        self._last_input = 0
+        self.timestep = FixedTimestep(self.timestep.tick_rate, self.timestep.max_steps)
+        if self.physics_engine:
+            self.physics_engine.gravity_constant = self.gravity
+            self.physics_engine.jumps_since_ground = 0
+
+    def result(self):
+        """Итог прохождения, как он сохраняется в базу"""
+        return {
+            "level_id": self.level_id,
+            "complete": self.level_complete,
+            "score": self.score,
+            "max_score": self.max_score,
+            "deaths": self.deaths,
+            "time": self.elapsed,
+            "ticks": self.tick,
+            "stars": GameDatabase.calculate_stars(self.score, self.deaths, self.elapsed),
+        }
+
+    def setup_level(self):
+        """Загрузка уровня"""
+        file_path = LEVEL_REGISTRY.path(self.level_id)
+
+        if file_path:
+            try:
+                # Загружаем карту Tiled
+                layer_options = {
+                    "collision": {"use_spatial_hash": True, "scaling": TILE_SCALING},
+                    "collect": {"use_spatial_hash": True, "scaling": TILE_SCALING},
+                    "exit": {"use_spatial_hash": True, "scaling": TILE_SCALING},
+                    "damage": {"use_spatial_hash": True, "scaling": TILE_SCALING},
+                    "ladder": {"use_spatial_hash": True, "scaling": TILE_SCALING},
+                    "batut": {"use_spatial_hash": True, "scaling": TILE_SCALING},
+                    "characters": {"use_spatial_hash": True, "scaling": TILE_SCALING}
+                }
+
+                # Скомпилированный кэш уровня (мог быть подготовлен заранее)
+                sprite_lists, self.grid_index = LEVEL_REGISTRY.load_with_grid(
+                    self.level_id, TILE_SCALING, layer_options, lazy=True
+                )
+
+                # Получаем слои
+                self.walls = sprite_lists.get("collision") or arcade.SpriteList(lazy=True)
+                self.collectibles = sprite_lists.get("collect") or arcade.SpriteList(lazy=True)
+                self.exit_list = sprite_lists.get("exit") or arcade.SpriteList(lazy=True)
+                self.damage_list = sprite_lists.get("damage") or arcade.SpriteList(lazy=True)
+                self.ladder_list = sprite_lists.get("ladder") or arcade.SpriteList(lazy=True)
+                self.batut_list = sprite_lists.get("batut") or arcade.SpriteList(lazy=True)
+                self.characters_list = sprite_lists.get("characters") or arcade.SpriteList(lazy=True)
+
+                # Сцена
+                self.scene = scene_from_sprite_lists(sprite_lists)
+                self.level_layers = list(sprite_lists.values())
+
+                # Подсчитываем максимально возможный счет
+                if self.collectibles:
+                    self.max_score = len(self.collectibles) * 10
+                else:
+                    self.max_score = 50  # Максимум 50 очков
+
+            except Exception as e:
+                print(f"Ошибка загрузки уровня: {e}")
+                self.create_test_level()
+        else:
+            self.create_test_level()
+
+        # Создаем игрока
+        try:
+            # Пробуем загрузить свою текстуру (первый кадр полосы)
+            texture = LEVEL_REGISTRY.texture_manager.load_or_get_texture(
+                PLAYER_TEXTURE, x=0, y=0, width=PLAYER_FRAME_SIZE, height=PLAYER_FRAME_SIZE
+            )
+            self.player = arcade.Sprite(texture, scale=1.25)
+        except Exception:
+            # Используем стандартную текстуру
+            self.player = arcade.Sprite(LEVEL_REGISTRY.texture_manager.load_or_get_texture(PLAYER_FALLBACK_TEXTURE),
+                                        0.8)
+
+        self.player.center_x, self.player.center_y = 100, 200
+        self.previous_position = self.player.position
+        self.player_list.append(self.player)
+
+        # Пока уровень открыт, его картинки не вытесняются из кэша
+        if self.hold_textures:
+            self.texture_paths = TEXTURE_CACHE.paths_of(
+                self.level_layers + [self.collectibles, self.exit_list, self.characters_list, self.player_list]
+            )
+            TEXTURE_CACHE.acquire(self.texture_paths)
+
+        # Размер уровня в пикселях - по сетке клеток, она покрывает всю карту
+        self.level_width = self.grid_index.width * self.grid_index.cell_w
+        self.level_height = self.grid_index.height * self.grid_index.cell_h
+
+        # Собранные предметы только скрываются, при смерти они возвращаются
+        self.collectible_pool = CollectiblePool(self.collectibles)
+        self.enemies = EnemyArrays(self.characters_list)
+
+        # Физический движок для игрока
+        if self.walls:
+            self.physics_engine = arcade.PhysicsEnginePlatformer(
+                self.player, self.walls, gravity_constant=self.gravity,
+                ladders=self.ladder_list
+            )
+
+    def create_test_level(self):
+        """Создание уровня"""
+        # Инициализируем списки
+        self.walls = arcade.SpriteList(use_spatial_hash=True, lazy=True)
+        self.collectibles = arcade.SpriteList(lazy=True)
+        self.exit_list = arcade.SpriteList(lazy=True)
+        self.damage_list = arcade.SpriteList(lazy=True)
+        self.ladder_list = arcade.SpriteList(lazy=True)
+        self.batut_list = arcade.SpriteList(lazy=True)
+        self.characters_list = arcade.SpriteList(lazy=True)
+
+        # Базовые платформы
+        for x in range(0, 800, 64):
+            wall = arcade.SpriteSolidColor(64, 64, arcade.color.GREEN)
+            wall.center_x = x
+            wall.center_y = 32
+            self.walls.append(wall)
+
+        # Добавляем платформы для разнообразия
+        platform = arcade.SpriteSolidColor(200, 32, arcade.color.GREEN)
+        platform.center_x = 300
+        platform.center_y = 150
+        self.walls.append(platform)
+
+        # Лестница для тестирования
+        for y in range(50, 200, 32):
+            ladder = arcade.SpriteSolidColor(32, 32, arcade.color.BLUE)
+            ladder.center_x = 400
+            ladder.center_y = y
+            self.ladder_list.append(ladder)
+
+        # Монетки (5 штук для 50 очков)
+        for i in range(5):
+            coin = arcade.Sprite(TEXTURE_CACHE.load_or_get_texture(COIN_TEXTURE), 0.5)
+            coin.center_x = 150 + i * 80
+            coin.center_y = 200
+            self.collectibles.append(coin)
+
+        # Выход
+        exit_sprite = arcade.Sprite(TEXTURE_CACHE.load_or_get_texture(EXIT_TEXTURE), 0.8)
+        exit_sprite.center_x = 700
+        exit_sprite.center_y = 200
+        self.exit_list.append(exit_sprite)
+
+        # Тестовый враг для обоих уровней
+        enemy = arcade.SpriteSolidColor(32, 32, arcade.color.DARK_RED)
+        enemy.center_x = 500
+        enemy.center_y = 100
+        self.characters_list.append(enemy)
+
+        # Создаем сцену
+        self.scene = arcade.Scene()
+        self.scene.add_sprite_list("walls", sprite_list=self.walls)
+        self.level_layers = [self.walls]
+
+        self.grid_index = TileGridIndex.from_sprite_lists({
+            "collect": self.collectibles,
+            "exit": self.exit_list,
+            "damage": self.damage_list,
+            "ladder": self.ladder_list,
+            "batut": self.batut_list,
+        }, TILE_SIZE * TILE_SCALING, TILE_SIZE * TILE_SCALING,
+            (math.ceil(SCREEN_W / (TILE_SIZE * TILE_SCALING)), math.ceil(SCREEN_H / (TILE_SIZE * TILE_SCALING))))
+
+        # Максимальный счет для тестового уровня
+        self.max_score = 50  # 5 монеток * 10 очков
+
+    def update(self, delta_time):
+        """Продвинуть симуляцию на delta_time секунд, вернуть число шагов"""
+        # Столько шагов физики, сколько накопилось времени (не больше MAX_CATCHUP_STEPS)
+        steps = self.timestep.advance(delta_time)
+        for _ in range(steps):
+            self.previous_position = self.player.position
+            self.physics_step(self.timestep.step)
+        return steps
+
+    def physics_step(self, dt):
+        """Один шаг физики длиной dt секунд"""
+        if self.level_complete:
+            return
+        profiler = self.profiler
+
+        # Управление, которое видит этот шаг, записывается при изменении
+        mask = self.input_mask()
+        if mask != self._last_input:
+            self.input_log.append((self.tick, mask))
+            self._last_input = mask
+        self.tick += 1
+        self.elapsed += dt
+
+        # Обновление таймеров
+        if self.invincible_timer > 0:
+            self.invincible_timer -= dt
+            if self.invincible_timer <= 0:
+                self.player.alpha = 255
+
+        if self.ladder_jump_cooldown > 0:
+            self.ladder_jump_cooldown -= dt
+
+        # Управление движением
+        move_x = 0
+        if self.left and not self.right:
+            move_x = -self.move_speed
+        elif self.right and not self.left:
+            move_x = self.move_speed
+
+        self.player.change_x = move_x
+
+        # Маска слоев под игроком: одна проверка клеток вместо запросов к каждому списку
+        layers_under = self.grid_index.flags_under(self.player)
+        if profiler is not None:
+            profiler.mark("input")
+
+        # Проверка на лестнице
+        self.on_ladder = False
+        if layers_under & TileGridIndex.LADDER:
+            self.on_ladder = len(self.grid_index.hits(self.player, TileGridIndex.LADDER)) > 0
+
+        # Управление на лестнице
+        if self.on_ladder:
+            # Отключаем гравитацию на лестнице
+            if self.physics_engine:
+                self.physics_engine.gravity_constant = 0
+
+            # Вертикальное движение на лестнице
+            if self.up:
+                self.player.change_y = self.move_speed
+            elif self.down:
+                self.player.change_y = -self.move_speed
+            else:
+                self.player.change_y = 0
+
+            # Прыжок с лестницы
+            if self.jump_pressed and self.ladder_jump_cooldown <= 0:
+                self.player.change_y = self.jump_speed
+                self.on_ladder = False
+                self.ladder_jump_cooldown = 0.3
+
+                # Даем горизонтальный импульс
+                if self.left:
+                    self.player.change_x = -self.move_speed * 1.5
+                elif self.right:
+                    self.player.change_x = self.move_speed * 1.5
+        else:
+            # Включаем гравитацию вне лестницы
+            if self.physics_engine:
+                self.physics_engine.gravity_constant = self.gravity
+
+            # Проверяем, стоит ли игрок на земле
+            on_ground = False
+            if self.physics_engine:
+                on_ground = self.physics_engine.can_jump()
+
+            # Обычный прычок с земли
+            if self.jump_pressed and on_ground:
+                self.player.change_y = self.jump_speed
+                self.jump_pressed = False
+        if profiler is not None:
+            profiler.mark("ladder")
+
+        # Батут
+        if layers_under & TileGridIndex.BATUT:
+            batut_hit = self.grid_index.hits(self.player, TileGridIndex.BATUT)
+            for batut in batut_hit:
+                if self.player.change_y < 0:
+                    self.player.change_y = self.batut_speed
+                    self.jump_pressed = False
+        if profiler is not None:
+            profiler.mark("batut")
+
+        # Обновляем физику
+        if self.physics_engine:
+            self.physics_engine.update()
+        if profiler is not None:
+            profiler.mark("physics")
+
+        # Маска слоев на новом месте игрока: общая для урона и выхода
+        layers_after = self.grid_index.flags_under(self.player)
+
+        # Сбор предметов
+        if self.collectible_pool.active_count:
+            for item in self.collectible_pool.collect(self.player, self.grid_index):
+                self.score += 10
+
+                if self.score >= 50:
+                    self.has_key = True
+        if profiler is not None:
+            profiler.mark("collect")
+
+        # Проверка повреждений от опасных объектов
+        self.check_damage(layers_after)
+        if profiler is not None:
+            profiler.mark("damage")
+
+        # Проверка выхода
+        if self.has_key and layers_after & TileGridIndex.EXIT:
+            exit_hit = self.grid_index.hits(self.player, TileGridIndex.EXIT)
+            if exit_hit:
+                self.level_complete = True
+
+        # Смерть от падения
+        if self.player.center_y < -100:
+            self.player_die()
+        if profiler is not None:
+            profiler.mark("exit")
+
+    def check_damage(self, layers=None):
+        """Проверка столкновений с опасными объектами.
+
+        layers - маска слоев под игроком, если она уже посчитана на этом шаге.
+        """
+        # Если игрок неуязвим - пропускаем проверку
+        if self.invincible_timer > 0:
+            return
+
+        # Проверка damage слоя
+        if layers is None:
+            layers = self.grid_index.flags_under(self.player)
+        if layers & TileGridIndex.DAMAGE:
+            damage_hit = self.grid_index.hits(self.player, TileGridIndex.DAMAGE)
+            if damage_hit:
+                self.take_damage(20, damage_hit[0])
+
+        # Проверка врагов: все сразу, только в полосе экрана вокруг игрока
+        enemy = self.enemies.first_overlap(self.player, self.player.center_x - SCREEN_W,
+                                           self.player.center_x + SCREEN_W)
+        if enemy is not None:
+            self.take_damage(25, enemy)
+
+    def take_damage(self, amount, source):
+        """Нанесение урона игроку; source - спрайт, который его нанес"""
+        self.health -= amount
+
+        if self.health <= 0:
+            self.player_die()
+        else:
+            # Активируем неуязвимость
+            self.invincible_timer = self.INVINCIBLE_TIME
+            self.player.alpha = 128  # Полупрозрачность
+            self.player.change_y = 8 * self.speed_scale  # Отскок
+
+            # Отбрасывание от источника урона
+            if self.player.center_x >= source.center_x:
+                self.player.change_x = 5 * self.speed_scale  # Вправо
+            else:
+                self.player.change_x = -5 * self.speed_scale  # Влево
+
+    def player_die(self):
+        """Смерть игрока - восстанавливаем все предметы"""
+        self.deaths += 1
+        self.health = 100
+
+        # Восстанавливаем здоровье игрока
+        self.player.center_x, self.player.center_y = 100, 200
+        self.previous_position = self.player.position
+        self.player.change_x = self.player.change_y = 0
+        self.player.alpha = 255
+
+        # Сбрасываем ключ
+        self.has_key = False
+
+        # Сбрасываем таймеры
+        self.invincible_timer = 0
+        self.on_ladder = False
+        self.ladder_jump_cooldown = 0
+
+        self.restore_collectibles()
+
+        # Сбрасываем счет (предметы восстановлены, нужно собрать заново)
+        self.score = 0
+
+    def restore_collectibles(self):
+        """Восстановление всех предметов из слоя collect"""
+        self.collectible_pool.reset()
+
+    def close(self):
+        """Уровень больше не нужен: его картинки можно вытеснять из кэша"""
+        TEXTURE_CACHE.release(self.texture_paths)
+        self.texture_paths = set()
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, offset):
+    value = shift = 0
+    while True:
+        if offset >= len(data):
+            raise ValueError("Запись управления обрывается")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+class InputLog:
+    """Запись управления за прохождение в компактном двоичном виде.
+
+    Формат (little-endian): заголовок "JJIN", версия, частота шагов,
+    номер уровня; затем varint число шагов и число событий, а для каждого
+    события - varint разница номера шага с предыдущим событием и байт
+    маски INPUT_*. Прохождение в пару минут обычно занимает сотни байт.
+    """
+
+    MAGIC = b"JJIN"
+    VERSION = 1
+    HEADER = struct.Struct("<4sBHI")
+
+    def __init__(self, level_id, tick_rate, ticks, events):
+        self.level_id = level_id
+        self.tick_rate = tick_rate
+        self.ticks = ticks
+        self.events = events  # [(шаг, маска)] по возрастанию шага
+
+    @classmethod
+    def from_simulation(cls, simulation):
+        return cls(simulation.level_id, simulation.timestep.tick_rate, simulation.tick, list(simulation.input_log))
+
+    def to_bytes(self):
+        out = bytearray(self.HEADER.pack(self.MAGIC, self.VERSION, self.tick_rate, self.level_id))
+        _write_varint(out, self.ticks)
+        _write_varint(out, len(self.events))
+        previous = 0
+        for tick, mask in self.events:
+            _write_varint(out, tick - previous)
+            out.append(mask)
+            previous = tick
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < cls.HEADER.size:
+            raise ValueError("Запись управления слишком короткая")
+        magic, version, tick_rate, level_id = cls.HEADER.unpack_from(data, 0)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("Неизвестный формат записи управления")
+
+        offset = cls.HEADER.size
+        ticks, offset = _read_varint(data, offset)
+        count, offset = _read_varint(data, offset)
+        events = []
+        tick = 0
+        for _ in range(count):
+            delta, offset = _read_varint(data, offset)
+            if offset >= len(data):
+                raise ValueError("Запись управления обрывается")
+            tick += delta
+            events.append((tick, data[offset]))
+            offset += 1
+        return cls(level_id, tick_rate, ticks, events)
+
+    def replay(self, simulation=None):
+        """Прогнать запись на максимальной скорости и вернуть итог"""
+        if simulation is not None:
+            simulation.reset()
+            return run_input_script(simulation, self.events, self.ticks)
+
+        simulation = GameSimulation(self.level_id, self.tick_rate)
+        try:
+            return run_input_script(simulation, self.events, self.ticks)
+        finally:
+            simulation.close()
+
+
+def run_input_script(simulation, events, max_ticks):
+    """Прогнать записанное управление [(шаг, маска)] не дольше max_ticks шагов"""
+    events = sorted(events)
+    position = 0
+    step = simulation.timestep.step
+    while simulation.tick < max_ticks and not simulation.level_complete:
+        while position < len(events) and events[position][0] <= simulation.tick:
+            simulation.apply_input(events[position][1])
+            position += 1
+        simulation.physics_step(step)
+    return simulation.result()
+
+
+# Симуляция в процессе-исполнителе пакетного прогона (одна карта на процесс)
+_worker_simulation = None
+
+
+def _init_batch_worker(level_id, tick_rate):
+    global _worker_simulation
+    # Процесс-исполнитель не закрывает симуляцию при выходе, поэтому картинки не занимаются
+    _worker_simulation = GameSimulation(level_id, tick_rate, hold_textures=False)
+
+
+def _run_batch_script(job):
+    events, max_ticks = job
+    start = time.process_time()
+    _worker_simulation.reset()
+    result = run_input_script(_worker_simulation, events, max_ticks)
+    return result, time.process_time() - start
+
+
+def _distribution(values):
+    """min / среднее / медиана / p95 / max"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    return {
+        "min": ordered[0],
+        "mean": sum(ordered) / len(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)],
+        "max": ordered[-1],
+    }
+
+
+def simulate_batch(level_id, scripts, max_ticks=TICK_RATE * 300, workers=None, tick_rate=TICK_RATE):
+    """Прогнать много записей управления параллельно и собрать статистику.
+
+    Каждый процесс-исполнитель загружает уровень один раз и перед каждой
+    записью только сбрасывает его. Возвращает (результаты по записям,
+    сводка): распределения очков, смертей и времени, число звезд и
+    скорость в шагах симуляции в секунду на ядро (по процессорному
+    времени самих прогонов, без запуска процессов и загрузки уровня).
+    """
+    workers = workers or os.cpu_count() or 1
+    jobs = [(events, max_ticks) for events in scripts]
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                             initargs=(level_id, tick_rate)) as executor:
+        timed_results = list(executor.map(_run_batch_script, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    seconds = time.perf_counter() - start
+
+    results = [result for result, _ in timed_results]
+    busy = sum(run_seconds for _, run_seconds in timed_results)
+
+    completed = [result for result in results if result["complete"]]
+    ticks = sum(result["ticks"] for result in results)
+    stars = [0] * 6
+    for result in completed:
+        stars[result["stars"]] += 1
+
+    summary = {
+        "runs": len(results),
+        "completed": len(completed),
+        "score": _distribution([result["score"] for result in results]),
+        "deaths": _distribution([result["deaths"] for result in results]),
+        "time": _distribution([result["time"] for result in completed]),
+        "stars": stars,
+        "ticks": ticks,
+        "seconds": seconds,
+        "workers": workers,
+        "ticks_per_second_per_core": ticks / busy if busy > 0 else 0.0,
+    }
+    return results, summary
+
+
+# ============================================================================
+# ЭКРАН УРОВНЯ
+# ============================================================================
+
+class GameView(arcade.View):
+    def __init__(self, level_id, user_id, db, tick_rate=TICK_RATE, bake_static=BAKE_STATIC_LAYERS):
+        super().__init__(background_color=arcade.color.SKY_BLUE)
+
+        self.level_id = level_id
+        self.user_id = user_id
+        self.db = db
+
+        # Вся логика уровня - в симуляции, экран ее только рисует
+        self.simulation = GameSimulation(level_id, tick_rate)
+        sim = self.simulation
+
+        # Пока игрок проходит уровень, готовим следующий (только в игре:
+        # симуляциям для повторов и пакетных прогонов он не нужен)
+        next_level = LEVEL_REGISTRY.next_level(level_id)
+        if next_level is not None:
+            LEVEL_REGISTRY.preload(next_level)
+
+        # Слои карты в их порядке, затем списки, которых нет на карте, и игрок.
+        # Декоративные слои (не стены, не предметы и т. п.) не меняются - их
+        # можно нарисовать заранее
+        gameplay_lists = [sim.walls, sim.collectibles, sim.exit_list, sim.damage_list, sim.ladder_list,
+                          sim.batut_list, sim.characters_list]
+        static = []
+        if bake_static:
+            static = [layer for layer in sim.level_layers if all(layer is not other for other in gameplay_lists)]
+        # Остальные слои на больших картах рисуются только кусками у экрана.
+        # Враги могут двигаться (EnemyArrays.move), их список рисуется целиком
+        self.draw_plan = DrawPlan(
+            sim.level_layers,
+            gameplay_lists[1:],
+            [sim.player_list],
+            static=static,
+            culled=gameplay_lists[:-1]
+        )
+
+        # Камера мира следует за игроком; интерфейс рисуется без нее
+        self.camera = arcade.camera.Camera2D()
+        self.frame_stats = FrameStats()
+        self.show_stats = False  # F3 - FPS и число вызовов отрисовки
+
+        # Время участков кадра, F4 - таблица перцентилей на экране
+        self.profiler = FrameProfiler()
+        sim.profiler = self.profiler
+        self.show_profiler = False
+        self.create_hud()
+
+    def on_show_view(self):
+        self.window.set_screen(SCREEN_W, SCREEN_H, f"Уровень {self.level_id}")
+        self.camera.match_window()
+
+    def on_hide_view(self):
+        self.simulation.close()
+        self.draw_plan.release()
+
+        # Замеры кадров сохраняются при любом выходе из уровня
+        if PROFILE_PATH and self.profiler.frames:
+            self.profiler.dump(PROFILE_PATH)
+
+    def on_draw(self):
+        self.profiler.start()
+        self.clear()
+
+        self.frame_stats.tick()
+        sim = self.simulation
+
+        # Отрисовка мира: каждый видимый слой один раз. Игрок рисуется
+        # между двумя последними шагами физики, чтобы движение было плавным
+        physics_position = sim.player.position
+        sim.player.position = sim.timestep.interpolate(sim.previous_position, physics_position)
+        self.follow_player()
+        with self.camera.activate():
+            # Выводятся только куски уровня, которые попадают на экран
+            self.draw_plan.draw(self.view_rect())
+        sim.player.position = physics_position
+        self.profiler.mark("scene")
+
+        # Интерфейс
+        arcade.draw_lrbt_rectangle_filled(5, 250, SCREEN_H - 75, SCREEN_H - 5, (0, 0, 0, 150))
+        self.update_hud()
+        self.hud.draw()
+
+        # Экран завершения
+        if sim.level_complete:
+            arcade.draw_lrbt_rectangle_filled(0, SCREEN_W, 0, SCREEN_H, (0, 0, 0, 200))
+            self.overlay.draw()
+
+        if self.show_profiler:
+            arcade.draw_lrbt_rectangle_filled(SCREEN_W - 255, SCREEN_W - 5, SCREEN_H - 200, SCREEN_H - 5,
+                                              (0, 0, 0, 180))
+            self.profiler_text.draw()
+        self.profiler.mark("hud")
+        self.profiler.end_frame()
+
+    def follow_player(self):
+        """Камера по центру игрока, но не дальше краев уровня"""
+        sim = self.simulation
+        half_w, half_h = self.camera.width / 2, self.camera.height / 2
+        x = min(max(sim.player.center_x, half_w), max(half_w, sim.level_width - half_w))
+        y = min(max(sim.player.center_y, half_h), max(half_h, sim.level_height - half_h))
+        # Целые пиксели: иначе края тайлов дрожат при движении
+        self.camera.position = (round(x), round(y))
+
+    def view_rect(self):
+        """Видимая часть уровня (left, bottom, right, top)"""
+        x, y = self.camera.position
+        half_w, half_h = self.camera.width / 2, self.camera.height / 2
+        return x - half_w, y - half_h, x + half_w, y + half_h
+
+    def create_hud(self):
+        """Создание надписей интерфейса"""
+        self.hud = TextBatch()
+        self.hud.add("level", f"Уровень {self.level_id}", 10, SCREEN_H - 30, arcade.color.WHITE, 16)
+        self.hud.add("score", "", 10, SCREEN_H - 50, arcade.color.WHITE, 16)
+        self.hud.add("health", "", 10, SCREEN_H - 70, arcade.color.GREEN, 16)
+        self.hud.add("key", "Ключ получен!", SCREEN_W - 150, SCREEN_H - 30, arcade.color.GOLD, 16)
+        self.hud.add("key_hint", "Идите к выходу", SCREEN_W - 150, SCREEN_H - 50, arcade.color.YELLOW, 14)
+        self.hud.add("stats", "", SCREEN_W - 260, 10, arcade.color.WHITE, 12)
+
+        self.profiler_text = TextBatch()
+        self.profiler_text.add("table", "", SCREEN_W - 250, SCREEN_H - 15, arcade.color.WHITE, 10,
+                               width=240, multiline=True, anchor_y="top", font_name=("Courier New", "monospace"))
+
+        self.overlay = TextBatch()
+        self.overlay.add("title", "УРОВЕНЬ ПРОЙДЕН!", SCREEN_W // 2, SCREEN_H // 2 + 50,
+                         arcade.color.GOLD, 36, anchor_x="center")
+        self.overlay.add("score", "", SCREEN_W // 2, SCREEN_H // 2, arcade.color.WHITE, 24, anchor_x="center")
+        self.overlay.add("deaths", "", SCREEN_W // 2, SCREEN_H // 2 - 30, arcade.color.WHITE, 24, anchor_x="center")
+        self.overlay.add("time", "", SCREEN_W // 2, SCREEN_H // 2 - 60, arcade.color.WHITE, 20, anchor_x="center")
+        self.overlay.add("hint", "Нажмите ESC для выхода в меню", SCREEN_W // 2, SCREEN_H // 2 - 100,
+                         arcade.color.YELLOW, 18, anchor_x="center")
+
+    def update_hud(self):
+        sim = self.simulation
+        self.hud.set("score", f"Очки: {sim.score}/{sim.max_score}")
+
+        # Здоровье с цветом в зависимости от количества
+        health_color = arcade.color.GREEN
+        if sim.health <= 50:
+            health_color = arcade.color.YELLOW
+        if sim.health <= 20:
+            health_color = arcade.color.RED
+        self.hud.set("health", f"Здоровье: {sim.health}", health_color)
+
+        self.hud.set("key", visible=sim.has_key)
+        self.hud.set("key_hint", visible=sim.has_key)
+
+        self.hud.set("stats", visible=self.show_stats)
+        if self.show_stats:
+            self.hud.set("stats", f"FPS: {self.frame_stats.fps:.0f}  Вызовов отрисовки: {self.draw_plan.draw_calls}")
+
+        # Таблицу перцентилей обновляем раз в полсекунды, а не каждый кадр
+        if self.show_profiler and self.profiler.frames % 30 == 0:
+            self.update_profiler_text()
+
+        if sim.level_complete:
+            self.overlay.set("score", f"Очки: {sim.score}/{sim.max_score}")
+            self.overlay.set("deaths", f"Смерти: {sim.deaths}")
+            self.overlay.set("time", f"Время: {sim.elapsed:.1f}с")
+
+    def on_resize(self, width, height):
+        # Камера и куски уровня - размером с окно
+        self.camera.match_window()
+        self.draw_plan.resize((width, height))
+
+    def update_profiler_text(self):
+        self.profiler_text.set("table", "\n".join(["мс        p50    p95    p99"] + self.profiler.lines()))
+
+    def on_key_press(self, key, modifiers):
+        sim = self.simulation
+        if key == arcade.key.ESCAPE:
+            if sim.level_complete:
+                # Сохраняем прогресс с корректным расчетом звезд (в фоне)
+                # вместе с записью управления для проверки результата
+                replay = InputLog.from_simulation(sim).to_bytes()
+                self.db.update_progress_async(self.user_id, self.level_id, sim.score, sim.deaths, sim.elapsed,
+                                              replay)
+
+            # Возвращаемся в меню уровней
+            self.window.show_menu()
+            return
+
+        if key == arcade.key.F3:
+            self.show_stats = not self.show_stats
+            return
+
+        if key == arcade.key.F4:
+            self.show_profiler = not self.show_profiler
+            if self.show_profiler:
+                self.update_profiler_text()
+            return
+
+        if sim.level_complete:
+            return
+
+        if key in (arcade.key.LEFT, arcade.key.A):
+            sim.left = True
+        elif key in (arcade.key.RIGHT, arcade.key.D):
+            sim.right = True
+        elif key in (arcade.key.UP, arcade.key.W):
+            sim.up = True
+        elif key in (arcade.key.DOWN, arcade.key.S):
+            sim.down = True
+        elif key == arcade.key.SPACE:
+            sim.jump_pressed = True
+
+    def on_key_release(self, key, modifiers):
+        if key in (arcade.key.LEFT, arcade.key.A):
+            self.simulation.left = False
+        elif key in (arcade.key.RIGHT, arcade.key.D):
+            self.simulation.right = False
+        elif key in (arcade.key.UP, arcade.key.W):
+            self.simulation.up = False
+        elif key in (arcade.key.DOWN, arcade.key.S):
+            self.simulation.down = False
+        elif key == arcade.key.SPACE:
+            self.simulation.jump_pressed = False
+
+    def on_update(self, delta_time):
+        self.profiler.start()
+        self.simulation.update(delta_time)
+
+
+# ============================================================================
+# ОКНО ИГРЫ
+# ============================================================================
+
+class GameApp(arcade.Window):
+    """Единственное окно игры, экраны в нем - arcade.View.
+
+    Переходы между входом, меню и уровнем меняют только показанный экран:
+    контекст OpenGL, загруженные текстуры и цикл событий остаются одни на
+    всю игру. Экраны входа и меню создаются один раз и переиспользуются,
+    экран уровня создается заново при каждом входе в уровень.
+    """
+
+    def __init__(self, db=None, visible=True):
+        super().__init__(MENU_WIDTH, MENU_HEIGHT, "Вход / Регистрация", visible=visible)
+        self.db = db or GameDatabase()
+        self.auth_view = AuthView(self.db)
+        self.menu_view = None
+
+        # Текстуры, нужные каждому уровню, раскодируются до первого входа в уровень
+        TEXTURE_CACHE.preload([PLAYER_TEXTURE, PLAYER_FALLBACK_TEXTURE, COIN_TEXTURE, EXIT_TEXTURE])
+
+    def set_screen(self, width, height, caption):
+        """Размер и заголовок окна для показываемого экрана"""
+        if self.get_size() != (width, height):
+            self.set_size(width, height)
+        self.set_caption(caption)
+
+    def show_auth(self):
+        self.menu_view = None
+        # Уровни, подготовленные по наведению в меню, больше не понадобятся
+        LEVEL_REGISTRY.discard_pending()
+        self.show_view(self.auth_view)
+
+    def show_menu(self, user_id=None):
+        """Меню уровней; без user_id - меню текущего игрока"""
+        if self.menu_view is None or (user_id is not None and user_id != self.menu_view.user_id):
+            self.menu_view = LevelMenuView(user_id, self.db)
+        self.show_view(self.menu_view)
+
+    def show_level(self, level_id):
+        self.show_view(GameView(level_id, self.menu_view.user_id, self.db))
+
+    def close(self):
+        # Экран уровня сохраняет замеры, даже если окно закрыли крестиком
+        if self.current_view is not None:
+            self.current_view.on_hide_view()
+        super().close()
+
+
+# ============================================================================
+# ЗАПУСК ИГРЫ
+# ============================================================================
+
+def main():
+    """Главная функция запуска игры"""
+    app = GameApp()
+    app.show_auth()
+    app.run()
+
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,21 @@
+"""Общие настройки тестов: окно не открывается, уровни - встроенные тестовые"""
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("ARCADE_HEADLESS", "1")
+# Пустая папка уровней: карты с диска не влияют на результаты тестов
+os.environ.setdefault("JELLYJUMP_LEVELS", tempfile.mkdtemp(prefix="jellyjump-levels-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Временная база с дешевым хэшированием паролей"""
+    database = main.GameDatabase(str(tmp_path / "game.db"), hasher=main.Pbkdf2Hasher(iterations=1000))
+    yield database
+    database.close()
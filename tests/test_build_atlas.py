@@ -0,0 +1,55 @@
+from xml.etree import ElementTree
+
+from PIL import Image
+
+from build_atlas import build_atlas
+
+# Тайлы 0 и 1 одинаковые по пикселям, но у 1 есть свойство; 2 - анимация из кадров 2 и 0
+TILESET = """<?xml version="1.0" encoding="UTF-8"?>
+<tileset version="1.10" tiledversion="1.11.2" name="tiles" tilewidth="18" tileheight="18" tilecount="3" columns="3">
+ <image source="tiles.png" width="54" height="18"/>
+ <tile id="1" type="spike">
+  <properties>
+   <property name="damage" type="int" value="20"/>
+  </properties>
+ </tile>
+ <tile id="2">
+  <animation>
+   <frame tileid="2" duration="100"/>
+   <frame tileid="0" duration="100"/>
+  </animation>
+ </tile>
+</tileset>
+"""
+
+MAP = """<?xml version="1.0" encoding="UTF-8"?>
+<map version="1.10" tiledversion="1.11.2" orientation="orthogonal" renderorder="right-down" width="4" height="1"
+     tilewidth="18" tileheight="18" infinite="0" nextlayerid="2" nextobjectid="1">
+ <tileset firstgid="1" source="tiles.tsx"/>
+ <layer id="1" name="osnova" width="4" height="1">
+  <data encoding="csv">1,2,3,1</data>
+ </layer>
+</map>
+"""
+
+
+def test_atlas_keeps_tile_properties_and_animations(tmp_path):
+    image = Image.new("RGBA", (54, 18), (40, 40, 200, 255))
+    image.paste((200, 40, 40, 255), (36, 0, 54, 18))
+    image.save(tmp_path / "tiles.png")
+    (tmp_path / "tiles.tsx").write_text(TILESET, encoding="utf-8")
+    (tmp_path / "level.tmx").write_text(MAP, encoding="utf-8")
+
+    report = build_atlas([str(tmp_path / "level.tmx")], str(tmp_path / "atlas"))
+
+    assert report["tile_placements"] == 4
+    assert report["map_tiles"] == 3
+    # Тайл со свойством не сливается с такими же пикселями без свойств
+    assert report["unique_tiles"] == 4
+
+    tileset = ElementTree.parse(tmp_path / "atlas" / "atlas.tsx").getroot()
+    tiles = {tile.get("id"): tile for tile in tileset.findall("tile")}
+    assert tiles["1"].get("type") == "spike"
+    assert tiles["1"].find("properties/property").get("value") == "20"
+    frames = [int(frame.get("tileid")) for frame in tiles["3"].iter("frame")]
+    assert frames == [2, 0]
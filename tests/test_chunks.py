@@ -0,0 +1,77 @@
+import arcade
+import pytest
+
+from main import BakedLayers, ChunkedSpriteList, chunk_range, chunk_sprites
+
+CHUNK = (780, 450)
+
+
+def row_of_sprites(xs, size=20, y=100):
+    sprite_list = arcade.SpriteList(lazy=True)
+    for x in xs:
+        sprite_list.append(arcade.SpriteSolidColor(size, size, center_x=x, center_y=y))
+    return sprite_list
+
+
+def test_chunk_sprites_by_center_and_overlap():
+    sprites = row_of_sprites([100, 775, 1600])
+    chunks, bounds = chunk_sprites(sprites, *CHUNK)
+    assert {key: [sprite.center_x for sprite in found] for key, found in chunks.items()} == \
+        {(0, 0): [100, 775], (2, 0): [1600]}
+    assert bounds == (90, 90, 1610, 110)
+
+    # Спрайт на границе кусков с overlap=True попадает в оба
+    chunks, _ = chunk_sprites(sprites, *CHUNK, overlap=True)
+    assert sorted(chunks) == [(0, 0), (1, 0), (2, 0)]
+    assert [sprite.center_x for sprite in chunks[1, 0]] == [775]
+
+
+def test_chunk_sprites_empty():
+    assert chunk_sprites([], *CHUNK) == ({}, None)
+
+
+@pytest.mark.parametrize("view, expected", [
+    (None, (range(0, 3), range(0, 1))),
+    ((800, 0, 1580, 450), (range(1, 3), range(0, 1))),
+    ((5000, 0, 5780, 450), (range(0), range(0))),
+    ((0, 500, 780, 950), (range(0), range(0))),
+])
+def test_chunk_range(view, expected):
+    assert chunk_range((90, 90, 1610, 110), *CHUNK, view) == expected
+
+
+@pytest.mark.parametrize("view, expected", [
+    ((0, 0, 700, 450), [(0, 0)]),
+    ((700, 0, 1480, 450), [(0, 0), (1, 0)]),
+    # Спрайт из куска 2 (центр 1565) выступает в вид до x = 1545
+    ((800, 0, 1550, 450), [(1, 0), (2, 0)]),
+    ((5000, 0, 5780, 450), []),
+    (None, [(0, 0), (1, 0), (2, 0), (3, 0)]),
+])
+def test_chunked_list_picks_chunks_near_view(view, expected):
+    chunked = ChunkedSpriteList(row_of_sprites([100, 500, 1000, 1565, 2400], size=40), CHUNK)
+    assert chunked.visible_chunks(view) == expected
+
+
+def test_chunked_list_resize_and_release_free_old_chunks():
+    sprites = row_of_sprites(range(0, 3000, 50))
+    chunked = ChunkedSpriteList(sprites, CHUNK)
+    for width in (300, 400, 500):
+        chunked.resize((width, 300))
+        chunked.release()
+        chunked.visible_chunks()
+
+    # Спрайт - только в исходном списке и в одном текущем куске
+    assert max(len(sprite.sprite_lists) for sprite in sprites) == 2
+    assert sum(len(chunk) for chunk in chunked.chunks.values()) == len(sprites)
+
+
+def test_baked_layers_resize_and_release_free_old_chunks():
+    sprites = row_of_sprites(range(0, 3000, 50))
+    baked = BakedLayers([sprites], CHUNK)
+    for width in (300, 400, 500):
+        baked.resize((width, 300))
+    baked.release()
+
+    assert max(len(sprite.sprite_lists) for sprite in sprites) == 1
+    assert baked.layer_chunks is None
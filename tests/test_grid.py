@@ -0,0 +1,103 @@
+import arcade
+import pytest
+from PIL import Image
+
+from main import TILE_SCALING, CompiledLevel, GameSimulation, TileGridIndex
+
+# Лестница - столбец из двух клеток, опасность и выход - по одной клетке
+MAP = """<?xml version="1.0" encoding="UTF-8"?>
+<map version="1.10" tiledversion="1.11.2" orientation="orthogonal" renderorder="right-down" width="6" height="3"
+     tilewidth="18" tileheight="18" infinite="0" nextlayerid="4" nextobjectid="1">
+ <tileset firstgid="1" source="tiles.tsx"/>
+ <layer id="1" name="ladder" width="6" height="3">
+  <data encoding="csv">0,1,0,0,0,0,0,1,0,0,0,0,0,0,0,0,0,0</data>
+ </layer>
+ <layer id="2" name="damage" width="6" height="3">
+  <data encoding="csv">0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,1,0</data>
+ </layer>
+ <layer id="3" name="exit" width="6" height="3">
+  <data encoding="csv">0,0,0,0,0,1,0,0,0,0,0,0,0,0,0,0,0,0</data>
+ </layer>
+</map>
+"""
+
+TILESET = """<?xml version="1.0" encoding="UTF-8"?>
+<tileset version="1.10" tiledversion="1.11.2" name="tiles" tilewidth="18" tileheight="18" tilecount="1" columns="1">
+ <image source="tiles.png" width="18" height="18"/>
+</tileset>
+"""
+
+CELL = 18 * TILE_SCALING
+
+
+def player_at(col, row, size=CELL / 2):
+    """Игрок - квадрат в центре клетки (столбец, ряд снизу)"""
+    return arcade.SpriteSolidColor(size, size, center_x=(col + 0.5) * CELL, center_y=(row + 0.5) * CELL)
+
+
+@pytest.fixture(scope="module")
+def level(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("grid")
+    Image.new("RGBA", (18, 18), (40, 200, 40, 255)).save(directory / "tiles.png")
+    (directory / "tiles.tsx").write_text(TILESET, encoding="utf-8")
+    (directory / "level.tmx").write_text(MAP, encoding="utf-8")
+    level = CompiledLevel.load(str(directory / "level.tmx"), str(directory / "cache"))
+    sprite_lists = level.build_sprite_lists(TILE_SCALING, lazy=True)
+    yield level, sprite_lists
+    level.close()
+
+
+@pytest.fixture(params=["compiled", "sprites"])
+def grid(request, level):
+    """Обе сборки сетки должны давать одно и то же"""
+    level, sprite_lists = level
+    if request.param == "compiled":
+        return TileGridIndex.from_compiled(level, sprite_lists, TILE_SCALING)
+    return TileGridIndex.from_sprite_lists(sprite_lists, CELL, CELL)
+
+
+def test_grid_size(grid):
+    assert (grid.width, grid.height) == (6, 3)
+
+
+@pytest.mark.parametrize("col, row, mask", [
+    (1, 2, TileGridIndex.LADDER),
+    (1, 1, TileGridIndex.LADDER),
+    (1, 0, 0),
+    (5, 2, TileGridIndex.EXIT),
+    (4, 0, TileGridIndex.DAMAGE),
+    (3, 1, 0),
+])
+def test_flags_under_single_cell(grid, col, row, mask):
+    assert grid.flags_under(player_at(col, row)) == mask
+
+
+def test_flags_under_spans_cells(grid):
+    # Игрок на границе клеток лестницы и выхода собирает маски обеих
+    player = arcade.SpriteSolidColor(CELL * 4, CELL / 2, center_x=3.5 * CELL, center_y=2.5 * CELL)
+    assert grid.flags_under(player) == TileGridIndex.LADDER | TileGridIndex.EXIT
+
+
+def test_flags_under_outside_map(grid):
+    assert grid.flags_under(player_at(-3, 1)) == 0
+    assert grid.flags_under(player_at(10, 10)) == 0
+
+
+def test_hits_returns_colliding_sprites_once(grid, level):
+    _, sprite_lists = level
+    # Высокий игрок задевает обе клетки лестницы, каждая находится один раз
+    player = arcade.SpriteSolidColor(CELL / 2, CELL * 1.5, center_x=1.5 * CELL, center_y=2 * CELL)
+    assert sorted(sprite.center_y for sprite in grid.hits(player, TileGridIndex.LADDER)) == \
+        sorted(sprite.center_y for sprite in sprite_lists["ladder"])
+    assert grid.hits(player, TileGridIndex.DAMAGE) == []
+
+
+def test_simulation_mask_under_player():
+    simulation = GameSimulation(1, hold_textures=False)
+    ladder = simulation.ladder_list[0]
+    simulation.player.position = ladder.position
+    assert simulation.grid_index.flags_under(simulation.player) & TileGridIndex.LADDER
+    assert ladder in simulation.grid_index.hits(simulation.player, TileGridIndex.LADDER)
+
+    simulation.player.position = -500, -500
+    assert simulation.grid_index.flags_under(simulation.player) == 0
@@ -0,0 +1,102 @@
+import threading
+
+import pytest
+from PIL import Image
+
+from main import CompiledLevel, LevelCompileError, LevelRegistry, TextureCache
+
+MAP_WITH_MISSING_TILESET = """<?xml version="1.0" encoding="UTF-8"?>
+<map version="1.10" tiledversion="1.11.2" orientation="orthogonal" renderorder="right-down" width="2" height="1"
+     tilewidth="18" tileheight="18" infinite="0" nextlayerid="2" nextobjectid="1">
+ <tileset firstgid="1" source="missing/tiles.tsx"/>
+ <layer id="1" name="osnova" width="2" height="1">
+  <data encoding="csv">1,0</data>
+ </layer>
+</map>
+"""
+
+TILESET = """<?xml version="1.0" encoding="UTF-8"?>
+<tileset version="1.10" tiledversion="1.11.2" name="tiles" tilewidth="18" tileheight="18" tilecount="1" columns="1">
+ <image source="tiles.png" width="18" height="18"/>
+</tileset>
+"""
+
+
+def write_levels(directory, names):
+    Image.new("RGBA", (18, 18), (200, 40, 40, 255)).save(directory / "tiles.png")
+    (directory / "tiles.tsx").write_text(TILESET, encoding="utf-8")
+    for name in names:
+        (directory / name).write_text(MAP_WITH_MISSING_TILESET.replace("missing/tiles.tsx", "tiles.tsx"),
+                                      encoding="utf-8")
+
+
+def test_missing_tileset_is_compile_error(tmp_path):
+    tmx_path = tmp_path / "level.tmx"
+    tmx_path.write_text(MAP_WITH_MISSING_TILESET, encoding="utf-8")
+
+    with pytest.raises(LevelCompileError, match="tiles.tsx"):
+        CompiledLevel.load(str(tmx_path), str(tmp_path / "cache"))
+
+
+def test_unreadable_tileset_is_compile_error(tmp_path):
+    tmx_path = tmp_path / "level.tmx"
+    tmx_path.write_text(MAP_WITH_MISSING_TILESET, encoding="utf-8")
+    (tmp_path / "missing").mkdir()
+    (tmp_path / "missing" / "tiles.tsx").write_text("<tileset", encoding="utf-8")
+
+    with pytest.raises(LevelCompileError):
+        CompiledLevel.load(str(tmx_path), str(tmp_path / "cache"))
+
+
+def test_registry_reads_folder_lazily(tmp_path):
+    registry = LevelRegistry(str(tmp_path))
+    write_levels(tmp_path, ["Проект 1.tmx", "Проект2.tmx"])
+
+    assert registry.level_ids() == [1, 2]
+    assert registry.path(2) == str(tmp_path / "Проект2.tmx")
+
+
+def test_registry_without_maps_has_test_levels(tmp_path):
+    registry = LevelRegistry(str(tmp_path))
+    assert registry.levels == {}
+    assert registry.level_ids() == LevelRegistry.DEFAULT_LEVEL_IDS
+
+
+def test_preloading_another_level_closes_stale_one(tmp_path):
+    write_levels(tmp_path, ["Проект 1.tmx", "Проект2.tmx"])
+    registry = LevelRegistry(str(tmp_path), str(tmp_path / "cache"), TextureCache())
+
+    registry.preload(1)
+    stale = registry._pending[1]
+    registry.preload(2)
+
+    assert list(registry._pending) == [2]
+    assert stale.cancelled() or stale.result()._mapping is None
+
+    registry.discard_pending()
+    assert registry._pending == {}
+    sprite_lists = registry.load(2)
+    assert len(sprite_lists["osnova"]) == 1
+
+
+def test_parallel_compiles_write_a_valid_cache(tmp_path):
+    # Фоновая подготовка уровня и главный поток компилируют одну карту одновременно
+    write_levels(tmp_path, ["level.tmx"])
+    cache_dir = tmp_path / "cache"
+    start = threading.Barrier(4)
+
+    def load():
+        start.wait()
+        CompiledLevel.load(str(tmp_path / "level.tmx"), str(cache_dir)).close()
+
+    threads = [threading.Thread(target=load) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    cache_path = CompiledLevel.cache_path(str(tmp_path / "level.tmx"), str(cache_dir))
+    assert [str(path) for path in cache_dir.iterdir()] == [cache_path]
+    level = CompiledLevel.load(str(tmp_path / "level.tmx"), str(cache_dir))
+    assert level._mapping is not None and level.is_fresh()
+    level.close()
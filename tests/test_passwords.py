@@ -0,0 +1,87 @@
+import hashlib
+
+import pytest
+
+from main import LegacySha256Hasher, PasswordHasher, Pbkdf2Hasher
+
+
+def stored_hash(db, username):
+    with db.pool.connection() as conn:
+        return conn.execute('SELECT password_hash FROM users WHERE username = ?', (username,)).fetchone()[0]
+
+
+def test_pbkdf2_round_trip():
+    hasher = Pbkdf2Hasher(iterations=1000)
+    encoded = hasher.hash("secret")
+
+    assert encoded.startswith("pbkdf2_sha256$1000$")
+    assert "secret" not in encoded
+    assert hasher.verify("secret", encoded)
+    assert not hasher.verify("Secret", encoded)
+    # У каждого хэша своя соль
+    assert hasher.hash("secret") != encoded
+
+
+def test_pbkdf2_rejects_malformed_hash():
+    hasher = Pbkdf2Hasher(iterations=1000)
+    assert not hasher.verify("secret", "pbkdf2_sha256$oops")
+    assert not hasher.verify("secret", "md5$1000$00$00")
+
+
+def test_needs_rehash_on_new_iterations():
+    encoded = Pbkdf2Hasher(iterations=1000).hash("secret")
+
+    assert not Pbkdf2Hasher(iterations=1000).needs_rehash(encoded)
+    assert Pbkdf2Hasher(iterations=2000).needs_rehash(encoded)
+    # Старый хэш все равно проверяется с числом итераций из самого хэша
+    assert Pbkdf2Hasher(iterations=2000).verify("secret", encoded)
+
+
+def test_incomplete_hasher_fails_on_creation():
+    class NoVerify(PasswordHasher):
+        algorithm = "broken"
+
+        def hash(self, password):
+            return password
+
+    with pytest.raises(TypeError):
+        NoVerify()
+
+
+def test_login_rehashes_with_new_iterations(db):
+    db.create_user("player", "secret")
+    assert stored_hash(db, "player").startswith("pbkdf2_sha256$1000$")
+
+    db.hasher = Pbkdf2Hasher(iterations=2000)
+    success, _, _ = db.authenticate_user("player", "secret")
+
+    assert success
+    assert stored_hash(db, "player").startswith("pbkdf2_sha256$2000$")
+
+
+def test_legacy_hash_upgraded_on_login(db):
+    legacy = hashlib.sha256(b"secret").hexdigest()
+    assert LegacySha256Hasher().verify("secret", legacy)
+    with db.pool.connection() as conn:
+        conn.execute('INSERT INTO users (username, password_hash) VALUES (?, ?)', ("old", legacy))
+        conn.commit()
+
+    assert not db.authenticate_user("old", "wrong")[0]
+    assert stored_hash(db, "old") == legacy
+
+    success, user_id, _ = db.authenticate_user("old", "secret")
+    assert success and user_id is not None
+    assert stored_hash(db, "old").startswith("pbkdf2_sha256$1000$")
+    # После перевода вход по-прежнему работает (без кэша входов)
+    db.auth_cache.invalidate("old")
+    assert db.authenticate_user("old", "secret") == (True, user_id, "Вход выполнен успешно!")
+
+
+def test_unknown_user_rejected(db):
+    assert db._dummy_hash.startswith("pbkdf2_sha256$")
+    assert db.authenticate_user("nobody", "secret") == (False, None, "Неверное имя пользователя или пароль")
+
+
+def test_duplicate_user_rejected(db):
+    assert db.create_user("player", "secret")[0]
+    assert not db.create_user("player", "other")[0]
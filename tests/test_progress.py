@@ -0,0 +1,180 @@
+import random
+import threading
+
+import pytest
+
+from main import LEVEL_REGISTRY, GameDatabase, Pbkdf2Hasher
+
+
+def create_player(db, name="player"):
+    _, user_id, _ = db.create_user(name, "secret")
+    return user_id
+
+
+def lock_level(db, user_id, level_id):
+    with db.pool.connection() as conn:
+        conn.execute('UPDATE user_progress SET unlocked = 0 WHERE user_id = ? AND level_id = ?', (user_id, level_id))
+        conn.commit()
+    db.progress_cache.clear()
+
+
+def test_new_player_has_only_first_level(db):
+    progress = db.get_user_progress(create_player(db))
+    level_ids = LEVEL_REGISTRY.level_ids()
+
+    assert list(progress) == level_ids
+    assert [level["unlocked"] for level in progress.values()] == [True] + [False] * (len(level_ids) - 1)
+
+
+def test_next_level_unlocks_at_30_points(db):
+    user_id = create_player(db)
+
+    db.update_progress(user_id, 1, 20, 0, 100)
+    assert not db.get_user_progress(user_id)[2]["unlocked"]
+
+    db.update_progress(user_id, 1, 30, 0, 100)
+    assert db.get_user_progress(user_id)[2]["unlocked"]
+
+
+def test_best_score_and_stars_only_grow(db):
+    user_id = create_player(db)
+
+    assert db.update_progress(user_id, 1, 50, 0, 30) == 5
+    assert db.update_progress(user_id, 1, 10, 3, 200) == 5
+    level = db.get_user_progress(user_id)[1]
+    assert (level["best_score"], level["stars"]) == (50, 5)
+
+
+def test_stored_record_unlocks_level_added_later(db):
+    # Рекорд 40 поставлен, когда следующего уровня еще не было
+    user_id = create_player(db)
+    db.update_progress(user_id, 1, 40, 0, 100)
+    lock_level(db, user_id, 2)
+
+    # Слабое прохождение все равно открывает уровень по рекорду
+    db.update_progress(user_id, 1, 10, 2, 100)
+    assert db.get_user_progress(user_id)[2]["unlocked"]
+
+
+def test_last_level_adds_no_rows(db):
+    user_id = create_player(db)
+    db.update_progress(user_id, LEVEL_REGISTRY.level_ids()[-1], 50, 0, 30)
+
+    assert list(db.get_user_progress(user_id)) == LEVEL_REGISTRY.level_ids()
+
+
+def test_async_result_visible_before_it_is_written(db):
+    user_id = create_player(db)
+    db.get_user_progress(user_id)  # Прогресс игрока уже в кэше
+
+    # Запись задерживается, пока тест не разрешит ее
+    release = threading.Event()
+    write_batch = db.write_progress_batch
+    db.write_progress_batch = lambda records: (release.wait(5), write_batch(records))
+    db.update_progress_async(user_id, 1, 40, 0, 30)
+
+    progress = db.get_user_progress(user_id)
+    assert progress[1]["best_score"] == 40
+    assert progress[2]["unlocked"]
+
+    release.set()
+    db.progress_writer.flush()
+    assert db.progress_writer.pending(user_id) == []
+    assert db.get_user_progress(user_id)[1]["best_score"] == 40
+
+
+def test_failed_record_does_not_drop_batch(db):
+    user_id = create_player(db)
+    write_batch = db.write_progress_batch
+
+    def failing_write(records):
+        if any(record[1] == 99 for record in records):
+            raise ValueError("bad record")
+        write_batch(records)
+
+    db.write_progress_batch = failing_write
+    db.progress_writer.submit(user_id, 99, 10, 0, 30)
+    db.progress_writer.submit(user_id, 1, 50, 0, 30)
+    db.progress_writer.flush()
+
+    assert db.progress_writer.failed == 1
+    assert db.get_user_progress(user_id)[1]["best_score"] == 50
+
+
+@pytest.fixture
+def stats_db(tmp_path):
+    """База с материализованными агрегатами и результатами с совпадающими очками"""
+    database = GameDatabase(str(tmp_path / "stats.db"), hasher=Pbkdf2Hasher(iterations=1000),
+                            materialize_stats=True)
+    rng = random.Random(5)
+    user_ids = [create_player(database, f"player{number}") for number in range(12)]
+    for _ in range(60):
+        database.update_progress(rng.choice(user_ids), rng.choice([1, 2]), rng.randrange(0, 50, 10),
+                                 rng.randint(0, 3), rng.uniform(20, 120))
+    yield database
+    database.close()
+
+
+def query(db, sql, params=()):
+    with db.pool.connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def assert_stats_match_recount(db):
+    assert query(db, 'SELECT user_id, total_score, total_stars, levels_completed FROM user_totals '
+                     'ORDER BY user_id') == \
+        query(db, 'SELECT user_id, SUM(best_score), SUM(stars), SUM(best_score > 0) FROM user_progress '
+                  'GROUP BY user_id ORDER BY user_id')
+    assert query(db, 'SELECT level_id, stars, players FROM level_star_counts WHERE players > 0 '
+                     'ORDER BY level_id, stars') == \
+        query(db, 'SELECT level_id, stars, COUNT(*) FROM user_progress GROUP BY level_id, stars '
+                  'ORDER BY level_id, stars')
+
+
+def test_stats_triggers_match_recount(stats_db):
+    assert_stats_match_recount(stats_db)
+
+    # Удаление строк тоже учитывается триггером
+    user_id = query(stats_db, 'SELECT MIN(user_id) FROM user_progress')[0][0]
+    with stats_db.pool.connection() as conn:
+        conn.execute('DELETE FROM user_progress WHERE user_id = ?', (user_id,))
+        conn.commit()
+    assert_stats_match_recount(stats_db)
+
+
+def test_materialized_and_direct_stats_agree(stats_db):
+    materialized = [stats_db.get_user_totals(user_id) for user_id in range(1, 13)], \
+        [stats_db.get_star_distribution(level_id) for level_id in (1, 2)]
+    stats_db.materialize_stats = False
+    direct = [stats_db.get_user_totals(user_id) for user_id in range(1, 13)], \
+        [stats_db.get_star_distribution(level_id) for level_id in (1, 2)]
+    assert materialized == direct
+
+
+def read_pages(fetch, limit):
+    rows, cursor = fetch(limit, None)
+    while cursor is not None:
+        page, cursor = fetch(limit, cursor)
+        rows.extend(page)
+    return rows
+
+
+def test_leaderboard_pages_match_full_query(stats_db):
+    for level_id in (1, 2):
+        expected = query(stats_db, 'SELECT user_id, best_score FROM user_progress WHERE level_id = ? '
+                                   'ORDER BY best_score DESC, user_id DESC', (level_id,))
+        # Очков всего пять вариантов: границы страниц попадают на одинаковые очки
+        assert len({score for _, score in expected}) < len(expected)
+        for limit in (1, 3, 5):
+            rows = read_pages(lambda size, after: stats_db.get_leaderboard(level_id, size, after), limit)
+            assert [(row['user_id'], row['best_score']) for row in rows] == expected
+
+
+@pytest.mark.parametrize("materialize", [True, False])
+def test_top_players_pages_match_full_query(stats_db, materialize):
+    stats_db.materialize_stats = materialize
+    expected = query(stats_db, 'SELECT user_id, SUM(best_score) AS total FROM user_progress '
+                               'GROUP BY user_id ORDER BY total DESC, user_id DESC')
+    for limit in (1, 4):
+        rows = read_pages(lambda size, after: stats_db.get_top_players(size, after), limit)
+        assert [(row['user_id'], row['total_score']) for row in rows] == expected
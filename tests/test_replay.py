@@ -0,0 +1,170 @@
+import random
+
+import arcade
+import pytest
+
+from main import (INPUT_JUMP, INPUT_LEFT, INPUT_RIGHT, INPUT_UP, MAX_CATCHUP_STEPS, TEXTURE_CACHE, FixedTimestep,
+                  GameSimulation, InputLog, run_input_script)
+
+
+@pytest.fixture(scope="module")
+def completed_run():
+    """Прохождение тестового уровня 1 случайным управлением (seed подобран под уровень)"""
+    rng = random.Random(95)
+    masks = [INPUT_RIGHT, INPUT_RIGHT | INPUT_JUMP, INPUT_RIGHT | INPUT_UP, INPUT_LEFT, 0]
+    events = [(tick, rng.choice(masks)) for tick in range(3600) if rng.random() < 0.05]
+
+    simulation = GameSimulation(1)
+    result = run_input_script(simulation, events, 3600)
+    assert result["complete"]
+    return result, InputLog.from_simulation(simulation).to_bytes()
+
+
+def test_input_log_round_trip():
+    log = InputLog(2, 60, 5000, [(0, INPUT_RIGHT), (130, INPUT_RIGHT | INPUT_JUMP), (131, INPUT_RIGHT), (4999, 0)])
+    decoded = InputLog.from_bytes(log.to_bytes())
+
+    assert (decoded.level_id, decoded.tick_rate, decoded.ticks, decoded.events) == (2, 60, 5000, log.events)
+
+
+def test_input_log_is_compact(completed_run):
+    result, data = completed_run
+    assert len(data) < 1024
+    assert InputLog.from_bytes(data).ticks == result["ticks"]
+
+
+@pytest.mark.parametrize("data", [b"", b"JJIN", b"XXXX\x01\x3c\x00\x01\x00\x00\x00\x00\x00"])
+def test_input_log_rejects_bad_header(data):
+    with pytest.raises(ValueError):
+        InputLog.from_bytes(data)
+
+
+def test_input_log_rejects_truncated_events():
+    data = InputLog(1, 60, 100, [(0, INPUT_RIGHT), (50, 0)]).to_bytes()
+    with pytest.raises(ValueError):
+        InputLog.from_bytes(data[:-1])
+
+
+def test_replay_reproduces_result(completed_run):
+    result, data = completed_run
+    assert InputLog.from_bytes(data).replay() == result
+
+
+def test_replay_releases_textures(completed_run):
+    _, data = completed_run
+    log = InputLog.from_bytes(data)
+    simulation = GameSimulation(1)
+    refs = {path: TEXTURE_CACHE._images[path].refs for path in simulation.texture_paths}
+    assert refs and all(count >= 1 for count in refs.values())
+
+    for _ in range(3):
+        log.replay()
+    assert {path: TEXTURE_CACHE._images[path].refs for path in refs} == refs
+
+    simulation.close()
+    assert all(TEXTURE_CACHE._images[path].refs == count - 1 for path, count in refs.items())
+
+
+def test_verify_replay_accepts_real_run(db, completed_run):
+    result, data = completed_run
+    _, user_id, _ = db.create_user("player", "secret")
+    db.update_progress(user_id, 1, result["score"], result["deaths"], result["time"], data)
+
+    ok, replayed, message = db.verify_replay(user_id, 1)
+    assert ok, message
+    assert replayed["score"] == result["score"]
+
+
+def test_verify_replay_rejects_tampered_score(db, completed_run):
+    result, data = completed_run
+    _, user_id, _ = db.create_user("player", "secret")
+    db.update_progress(user_id, 1, result["score"] + 10, result["deaths"], result["time"], data)
+
+    assert db.verify_replay(user_id, 1)[::2] == (False, "Результат не совпадает с записью")
+
+
+def test_verify_replay_rejects_corrupted_log(db, completed_run):
+    result, data = completed_run
+    _, user_id, _ = db.create_user("player", "secret")
+    db.update_progress(user_id, 1, result["score"], result["deaths"], result["time"], data[:-3])
+
+    ok, _, message = db.verify_replay(user_id, 1)
+    assert not ok
+    assert message.startswith("Запись повреждена")
+
+
+def test_worse_run_keeps_best_replay(db, completed_run):
+    result, data = completed_run
+    _, user_id, _ = db.create_user("player", "secret")
+    db.update_progress(user_id, 1, result["score"], result["deaths"], result["time"], data)
+    db.update_progress(user_id, 1, 0, 5, 500, b"worse")
+
+    assert db.get_replay(user_id, 1)[3] == data
+    assert db.verify_replay(user_id, 1)[0]
+
+
+def test_missing_replay(db):
+    _, user_id, _ = db.create_user("player", "secret")
+    assert db.verify_replay(user_id, 1) == (False, None, "Запись прохождения не найдена")
+
+
+@pytest.mark.parametrize("source_x, direction", [(4990, 1), (5010, -1)])
+def test_knockback_away_from_damage_source(source_x, direction):
+    """Далеко за первым экраном игрок отлетает от источника урона, а не всегда влево"""
+    simulation = GameSimulation(1, hold_textures=False)
+    simulation.player.position = 5000, 200
+    source = arcade.SpriteSolidColor(16, 16, center_x=source_x, center_y=200)
+
+    simulation.take_damage(10, source)
+
+    assert simulation.health == 90
+    assert simulation.player.change_x * direction > 0
+
+
+def test_fixed_timestep_steps_per_frame():
+    timestep = FixedTimestep(60)
+
+    assert timestep.advance(1 / 60) == 1
+    assert timestep.advance(1 / 120) == 0
+    assert timestep.advance(1 / 120) == 1
+    assert timestep.advance(2.5 / 60) == 2
+    assert timestep.ticks == 4
+    assert timestep.dropped == 0
+
+
+def test_fixed_timestep_caps_catch_up():
+    timestep = FixedTimestep(60)
+
+    assert timestep.advance(1.0) == MAX_CATCHUP_STEPS
+    assert timestep.dropped == 60 - MAX_CATCHUP_STEPS
+    assert 0 <= timestep.accumulator < timestep.step
+    # После долгого кадра игра не пытается догнать отброшенное время
+    assert timestep.advance(1 / 60) == 1
+
+
+def test_fixed_timestep_interpolation_alpha():
+    timestep = FixedTimestep(60)
+
+    assert timestep.advance(1.5 / 60) == 1
+    assert timestep.alpha == pytest.approx(0.5)
+    assert timestep.interpolate((0, 0), (10, 20)) == pytest.approx((5, 10))
+
+
+def test_simulation_does_not_depend_on_frame_times():
+    """Неровные кадры дают то же положение, что и ровные шаги"""
+    rng = random.Random(3)
+    jittery = GameSimulation(1, hold_textures=False)
+    steady = GameSimulation(1, hold_textures=False)
+    for simulation in (jittery, steady):
+        simulation.apply_input(INPUT_RIGHT | INPUT_JUMP)
+
+    for _ in range(300):
+        jittery.update(rng.uniform(0.004, 0.05))
+    assert jittery.timestep.dropped == 0
+
+    for _ in range(jittery.tick):
+        steady.physics_step(steady.timestep.step)
+
+    assert jittery.tick == steady.tick > 0
+    assert jittery.player.position == steady.player.position
+    assert (jittery.score, jittery.health, jittery.deaths) == (steady.score, steady.health, steady.deaths)